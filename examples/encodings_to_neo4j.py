@@ -7,21 +7,25 @@ import pandas as pd
 import pymatgen.core as pmat
 
 from matgraphdb.database.neo4j.node_types import (ELEMENTS, MAGNETIC_STATES, CRYSTAL_SYSTEMS, CHEMENV_NAMES,
-                                                  MATERIAL_FILES, CHEMENV_ELEMENT_NAMES, SPG_NAMES)
+                                                  MATERIAL_FILES, MATERIAL_IDS, CHEMENV_ELEMENT_NAMES, SPG_NAMES)
 from matgraphdb.database.json.utils import PROPERTY_NAMES
+from matgraphdb.database.encoding_store import EncodingStore, list_encoding_stores
 from matgraphdb.utils import  GLOBAL_PROP_FILE, NODE_DIR, LOGGER, ENCODING_DIR
 
 
 
 node_dict={}
 if os.path.exists(ENCODING_DIR):
-    encoding_files=glob(os.path.join(ENCODING_DIR,'*.csv'))
-    for encoding_file in encoding_files:
+    # Convert the legacy csv encodings once, afterwards the stores are memory-mapped
+    for encoding_file in glob(os.path.join(ENCODING_DIR,'*.csv')):
         encoding_name=encoding_file.split(os.sep)[-1].split('.')[0]
+        if not os.path.exists(os.path.join(ENCODING_DIR,encoding_name)):
+            EncodingStore.from_csv(encoding_file)
 
-        df=pd.read_csv(encoding_file,index_col=0)
+    for store_dir in list_encoding_stores(ENCODING_DIR):
+        store=EncodingStore.load(store_dir)
 
-        # Convert the dataframe values to a list of strings where the strings are the rows of the dataframe separated by a semicolon
-        df = df.apply(lambda x: ';'.join(map(str, x)), axis=1)
-        print(df.tolist())
-        # node_dict.update({encoding_name: df.tolist()})
\ No newline at end of file
+        # One ';' separated string per material, empty where the encoding is missing
+        values=store.to_neo4j_arrays(MATERIAL_IDS)
+        LOGGER.info(f"{store.name}: dimension {store.dimension}, {sum(1 for value in values if value)} materials encoded")
+        # node_dict.update({f'{store.name}:float[]': values})
@@ -8,11 +8,64 @@ from pymatgen.core import Structure
 import spglib
 
 from matgraphdb.utils import periodic_table
+from matgraphdb.utils.symmetry import (get_symmetry_info, symmetry_for_cell, wyckoff_positions, 
+                                       SYMPREC, ANGLE_TOLERANCE)
 
 class CODidNotFound(Exception):
     """Raise this exception if COD database ID is incorrect or not found"""
     pass
 
+def periodic_image_translations(lattice: np.ndarray, 
+                                frac_coords: np.ndarray, 
+                                cutoff: float = None) -> Tuple[np.ndarray, np.ndarray]:
+
+    r"""
+
+    Generates the lattice translations of the periodic images surrounding the
+    central unit cell. Without a cutoff this is the fixed 3x3x3 supercell; with
+    a cutoff, the number of images along each lattice vector follows from the
+    spacing of the lattice planes, and only the images lying within cutoff of
+    the central cell are kept, so skewed or tiny cells get enough images and
+    large cells do not carry 26 full copies.
+
+    :param lattice: the lattice vectors in Angstrom, a vector per array row.
+    :type np.ndarray[3,3]:
+
+    :param frac_coords: fractional coordinates of the atoms in the unit cell.
+    :type np.ndarray[n,3]:
+
+    :param cutoff: Optional, radius in Angstrom around the central cell.
+    :type float:
+
+    :return: translations (n_cells,3) ordered with n_a running fastest, and a bool
+        mask (n_cells,n) of the images to keep.
+    :rtype: Tuple[np.ndarray, np.ndarray]
+
+    """
+
+    if cutoff is None:
+        n_max = np.ones(3, dtype=int)
+    else:
+        # distance between consecutive lattice planes normal to each reciprocal vector
+        plane_spacings = 1.0 / np.linalg.norm(np.linalg.inv(lattice).T, axis=1)
+        n_max = np.ceil(cutoff / plane_spacings).astype(int)
+
+    ranges = [np.arange(-n, n + 1) for n in n_max]
+    n_c, n_b, n_a = np.meshgrid(ranges[2], ranges[1], ranges[0], indexing='ij')
+    translations = np.stack([n_a.ravel(), n_b.ravel(), n_c.ravel()], axis=1)
+
+    if cutoff is None:
+        return translations, np.ones((len(translations), len(frac_coords)), dtype=bool)
+
+    # distance of each image beyond the faces of the central cell
+    images = translations[:, None, :] + frac_coords[None, :, :]
+    excess = np.maximum(np.maximum(-images, images - 1), 0) * plane_spacings
+    image_mask = np.max(excess, axis=2) <= cutoff
+
+    keep = image_mask.any(axis=1)
+    return translations[keep], image_mask[keep]
+
+
 class Structure:
 
     """
@@ -27,7 +80,8 @@ class Structure:
     1) it will generate a 3x3x3 supercell of the primitive cell of the structure so
     that the central unit cell is totally surrounded by periodic images of itself;
     this ensures that all nearest neighbours of the atoms in the central unit cell
-    are considered.
+    are considered. Alternatively, only the periodic images within a cutoff radius
+    of the central cell are generated (see periodic_image_translations).
 
     2) crystallographic facilities from Crystal will be employed to identify a unique
     representative atom for each crystallographic orbit in the crystal, so that
@@ -36,7 +90,8 @@ class Structure:
 
     """
 
-    def __init__(self, structure_id: Union[int, str]=None, pmat_structure_file=None) -> None:
+    def __init__(self, structure_id: Union[int, str]=None, pmat_structure_file=None, 
+                 image_cutoff: float=None, symmetry: dict=None) -> None:
 
         r"""
 
@@ -48,6 +103,15 @@ class Structure:
                     the (path)filename of a local cif file.
         :type Union[int, str]:
 
+        :param image_cutoff: Optional, radius in Angstrom around the central cell within
+                    which periodic images are generated. If None, a 3x3x3 supercell is used.
+        :type float:
+
+        :param symmetry: Optional, a stored symmetry analysis of the material, e.g.
+                    matgraphdb.utils.symmetry.get_stored_symmetry(db). It is reused when it
+                    was computed on the same cell, otherwise the symmetry is computed.
+        :type dict:
+
         """
 
         if isinstance(structure_id, str):  # from a file
@@ -102,66 +166,61 @@ class Structure:
         self.atoms_masses_unit=[self.atoms_masses_unit[i] for i in sorted_indices]
         self.atoms_mass_density_unit=[self.atoms_mass_density_unit[i] for i in sorted_indices]
     
-        # now generate a 3x3x3 supercell in which the basic cell
-        # (the one read in) is the central one
-
-        self.n_atoms = 27 * len(self.primitive)
-
-        self.coordinates = np.zeros((self.n_atoms, 3), dtype=float)  # fractional coords
-        self.voronoi = np.zeros((self.n_atoms), dtype=bool)
-
-        self.voronoi_unit = np.zeros((self.n_atoms), dtype=bool)
-        self.unit_index_map=np.zeros((self.n_atoms), dtype=int)
-        self.atoms = []
+        # now generate the periodic images (by default a 3x3x3 supercell)
+        # surrounding the basic cell (the one read in), which is the central one
 
         # we will separate atoms in groups according to which crystallographic orbit
         # they belong to; we only need to calculate Voronoi polyhedra for one atom
         # in each orbit; the remaining atoms in the orbit are equivalent by symmetry
 
         self.orbits = self.primitive.groupby("crystallographic_orbits")
-        i = 0
-        # note: orbit variable is currently unused, but it may be worthwhile using
-        # it to identify each atom as pertaining to a specific crystal orbit
-        for n_c in range(-1, 2):
-            for n_b in range(-1, 2):
-                for n_a in range(-1, 2):
-                    for orbit, atoms in self.orbits.items():
-                        first = 0
-                        for i_atom,atom in enumerate(atoms):
-                            
-                            self.coordinates[i,:] = \
-                               atom.coords_fractional + np.array([n_a, n_b, n_c])
-
-                            # Voronoi by grouping
-                            if n_a == n_b == n_c == 0 and first == 0:
-                                self.voronoi[i] = True
-                            
-                            # Voronoi unit cell
-                            if n_a == n_b == n_c == 0:
-                                self.voronoi_unit[i]=True
-                            self.atoms.append(atom.atomic_number)
-
-
-
-                            diff = np.abs(self.frac_coords_unit - atom.coords_fractional)
-                            # Check if any row in diff is close to zero (within the specified tolerance) along all columns
-                            match_row = np.all(diff < 1e-6, axis=1)
-                            unit_cell_index = np.where(match_row)[0][0]
-                            self.unit_index_map[i]=unit_cell_index
-
-                            i += 1
-                            first += 1
+
+        # atoms of one cell in orbit order, the order used in every cell of the supercell
+        orbit_atoms = [atom for orbit, atoms in self.orbits.items() for atom in atoms]
+        frac_coords_orbit = np.array([atom.coords_fractional for atom in orbit_atoms])
+        first_in_orbit = np.array([i_atom == 0 for orbit, atoms in self.orbits.items() 
+                                                for i_atom, atom in enumerate(atoms)])
+
+        # map from the orbit order to the sorted unit cell order, computed once
+        diff = np.abs(frac_coords_orbit[:, None, :] - self.frac_coords_unit[None, :, :])
+        self.orbit_to_unit_index = np.argmax(np.all(diff < 1e-6, axis=2), axis=1)
+
+        self.image_cutoff = image_cutoff
+        translations, image_mask = periodic_image_translations(self.direct_lattice, 
+                                                               frac_coords_orbit, 
+                                                               cutoff=image_cutoff)
+
+        # fractional coords, flattened cell by cell
+        self.coordinates = (translations[:, None, :] + frac_coords_orbit[None, :, :])[image_mask].astype(float)
+        self.n_atoms = len(self.coordinates)
+
+        # position in orbit order of every site
+        orbit_position = np.broadcast_to(np.arange(len(orbit_atoms)), image_mask.shape)[image_mask]
+        central_cell = np.broadcast_to(np.all(translations == 0, axis=1)[:, None], image_mask.shape)[image_mask]
+
+        # Voronoi by grouping
+        self.voronoi = np.logical_and(central_cell, first_in_orbit[orbit_position])
+
+        # Voronoi unit cell
+        self.voronoi_unit = central_cell.copy()
+
+        self.atoms = np.array([atom.atomic_number for atom in orbit_atoms])[orbit_position].tolist()
+        self.unit_index_map = self.orbit_to_unit_index[orbit_position]
 
         # Extra properties
 
         # This property can be obtained from materials project
         self.e_above_hull = None
 
+        # Symmetry analysis, taken from the stored one or computed on first use
+        self._stored_symmetry = symmetry
+        self._symmetry = None
+
     def get_n_atoms( self ) -> int:
 
         """
 
-        :return: number of atoms in the 3x3x3 supercell.
+        :return: number of atoms in the supercell (3x3x3 or within image_cutoff).
         :rtype: int
 
         """
@@ -188,7 +247,7 @@ class Structure:
         atom of each crystallographic orbit in the central unit cell; Voronoi polyhedra
         will be reported only for atoms for which this flag is set to True
 
-        :return: list of atomic numbers for all atoms in the 3x3x3 supercell
+        :return: list of atomic numbers for all atoms in the supercell
         :rtype: List[int]
         :return: bool array for reported Voronoi polyhedra
         :rtype: np.ndarray[bool]
@@ -322,67 +381,49 @@ class Structure:
         atom_to_valence_mapping = {Z:valence for Z, valence in zip(self.atoms_unit,self.valences_unit)}
 
         # Map unit cell valences to supercell. 
-        # Logan : I believe this order of the wycoff
-        self.valences = [] 
-
-
-        for n_c in range(-1, 2):
-            for n_b in range(-1, 2):
-                for n_a in range(-1, 2):
-                    for orbit, atoms in self.orbits.items():
-                        for atom in atoms:
-                            for frac_coord_unit,valence_unit in zip(self.frac_coords_unit,self.valences_unit):
-                                if np.array_equal(atom.coords_fractional, frac_coord_unit):
-                                    self.valences.append(valence_unit)
+        self.valences = [self.valences_unit[i] for i in self.unit_index_map]
 
         # for atom, valence in zip(self.atoms,self.valences):
         #     print(atom, valence)
 
         return self.valences
 
+    def get_symmetry(self) -> dict:
+
+        """
+
+        Returns the symmetry analysis of the primitive cell, cached; every symmetry
+        dependent method reuses this result. A stored analysis passed to the constructor
+        is used when it matches the cell and tolerances, spglib only runs otherwise.
+
+        :return: the symmetry dictionary from matgraphdb.utils.symmetry.get_symmetry_info
+        :rtype: dict
+
+        """
+
+        stored = self._stored_symmetry
+        if self._symmetry is None and stored is not None:
+            if stored.get('symprec') == SYMPREC and stored.get('angle_tolerance') == ANGLE_TOLERANCE:
+                self._symmetry = symmetry_for_cell(stored,
+                                                   lattice = self.direct_lattice,
+                                                   positions = self.frac_coords_unit,
+                                                   numbers = self.atoms_unit)
+        if self._symmetry is None:
+            self._symmetry = get_symmetry_info(lattice = self.direct_lattice,
+                                               positions = self.frac_coords_unit,
+                                               numbers = self.atoms_unit,
+                                               symprec=SYMPREC, angle_tolerance=ANGLE_TOLERANCE)
+        return self._symmetry
+
     def get_wyckoff_positions(self):
-        from pyxtal.symmetry import Group
-        from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
-        import pymatgen.core as pmat
 
-        s = pmat.Structure(lattice = self.direct_lattice, 
-                            species = self.atoms_unit, 
-                            coords = self.frac_coords_unit)
-        
-        sa = SpacegroupAnalyzer(structure=s, symprec=0.01, angle_tolerance=5.0)
-        s_dict = sa.get_symmetry_dataset()
+        s_dict = self.get_symmetry()
 
-        # print(s_dict)
         self.wyckoffs_letter_unit = np.array(s_dict['wyckoffs'])
+        self.wyckoff_positions_unit = wyckoff_positions(self.wyckoffs_letter_unit, self.atoms_unit)
 
-        # print(len(self.wyckoffs_letter_unit ))
-        self.wyckoff_positions_unit = ['']*len(self.wyckoffs_letter_unit)
-        for iwyckoff in np.unique(self.wyckoffs_letter_unit):
-            idx = np.where(self.wyckoffs_letter_unit == iwyckoff)[0]
-            for ispc in np.unique(np.array(self.atoms_unit)[idx]):
-                idx2 = np.where(np.array(self.atoms_unit)[idx] == ispc)[0]
-                multiplicity = len(idx2)
-                for i in idx[idx2]:
-                    self.wyckoff_positions_unit[i] = str(multiplicity) + iwyckoff
-
-        # print(self.atoms_unit)
-        # print( self.wyckoff_positions_unit)
-        # print(s_dict['wyckoffs'])
-        # print(s_dict['site_symmetry_symbols'])
-        # print(s_dict['std_types'])
-
-        # Map unit cel l wycoff positions to supercell. 
-        # Logan : I believe this order of the wycoff
-        self.wyckoffs = []
-        for n_c in range(-1, 2):
-            for n_b in range(-1, 2):
-                for n_a in range(-1, 2):
-                    for orbit, atoms in self.orbits.items():
-                        for atom in atoms:
-                            for frac_coord_unit,wyckoff_unit in zip(self.frac_coords_unit,self.wyckoff_positions_unit):
-                                if np.array_equal(atom.coords_fractional, frac_coord_unit):
-                                    self.wyckoffs.append(wyckoff_unit)
-
+        # Map unit cell wycoff positions to supercell. 
+        self.wyckoffs = [self.wyckoff_positions_unit[i] for i in self.unit_index_map]
 
         return self.wyckoffs
 
@@ -450,7 +491,7 @@ class Structure:
     @property
     def spg_number(self):
         "Sets spg_number as an attribute"
-        return self.primitive.international_number
+        return self.get_symmetry()['spg_number']
 
     @property
     def crystal_system(self):
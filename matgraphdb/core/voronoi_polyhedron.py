@@ -1,15 +1,98 @@
 from math import isclose
-from typing import Union
+from typing import List, Tuple, Union
 
 import numpy as np
-from coxeter.shapes import ConvexPolygon, ConvexPolyhedron
+from coxeter.shapes import ConvexPolyhedron
 from mendeleev import element
 
+# absolute tolerance on volumes and areas when comparing polyhedra
+EQUALITY_TOL = 1.0e-6
+
 class UnrecognizedChemicalSpecies(Exception):
     """ Raise this exception if Mendeleev atom species is not correctly assigned."""
     pass
 
 
+def face_statistics(vertices: np.ndarray, faces: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+
+    """
+
+    Computes the area, center, unit normal and number of corners of every face
+    at once. Each face is split into a fan of triangles from its first corner;
+    triangle areas and centroids are then summed per face.
+
+    :param vertices: np.ndarray (n_vertices,3) of vertex coordinates.
+    :type np.ndarray:
+
+    :param faces: list of index arrays into vertices, the corners of each face in order.
+    :type List[np.ndarray]:
+
+    :return: areas (n_faces), centers (n_faces,3), normals (n_faces,3), num_corners (n_faces)
+    :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+    """
+
+    vertices = np.asarray(vertices, dtype=float)
+    num_corners = np.array([len(face) for face in faces], dtype=int)
+    n_faces = len(faces)
+    flat_faces = np.concatenate(faces).astype(int)
+    face_offsets = np.concatenate([[0], np.cumsum(num_corners)[:-1]])
+
+    # a face with k corners is a fan of k-2 triangles (corner 0, corner l, corner l+1)
+    n_triangles = num_corners - 2
+    triangle_face = np.repeat(np.arange(n_faces), n_triangles)
+    triangle_offsets = np.concatenate([[0], np.cumsum(n_triangles)[:-1]])
+    local = np.arange(triangle_face.shape[0]) - np.repeat(triangle_offsets, n_triangles) + 1
+
+    a = vertices[flat_faces[face_offsets[triangle_face]]]
+    b = vertices[flat_faces[face_offsets[triangle_face] + local]]
+    c = vertices[flat_faces[face_offsets[triangle_face] + local + 1]]
+
+    cross = np.cross(b - a, c - a)
+    triangle_areas = 0.5 * np.linalg.norm(cross, axis=1)
+    triangle_centers = (a + b + c) / 3.0
+
+    areas = np.bincount(triangle_face, weights=triangle_areas, minlength=n_faces)
+
+    centers = np.zeros((n_faces, 3), dtype=float)
+    normals = np.zeros((n_faces, 3), dtype=float)
+    for i in range(3):
+        centers[:, i] = np.bincount(triangle_face, weights=triangle_areas * triangle_centers[:, i], minlength=n_faces)
+        normals[:, i] = np.bincount(triangle_face, weights=cross[:, i], minlength=n_faces)
+    centers /= areas[:, None]
+    normals /= np.linalg.norm(normals, axis=1)[:, None]
+
+    return areas, centers, normals, num_corners
+
+
+def batch_face_statistics(polyhedra_vertices: List[np.ndarray], 
+                          polyhedra_faces: List[List[np.ndarray]]) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+
+    """
+
+    Computes face_statistics for many polyhedra in a single vectorized pass.
+
+    :param polyhedra_vertices: the vertices of each polyhedron.
+    :type List[np.ndarray]:
+
+    :param polyhedra_faces: the faces of each polyhedron, indexing its own vertices.
+    :type List[List[np.ndarray]]:
+
+    :return: the face_statistics tuple of each polyhedron
+    :rtype: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]
+
+    """
+
+    vertex_offsets = np.concatenate([[0], np.cumsum([len(v) for v in polyhedra_vertices])[:-1]])
+    all_faces = [np.asarray(face) + offset for faces, offset in zip(polyhedra_faces, vertex_offsets) for face in faces]
+
+    areas, centers, normals, num_corners = face_statistics(np.concatenate(polyhedra_vertices), all_faces)
+
+    splits = np.cumsum([len(faces) for faces in polyhedra_faces])[:-1]
+    return list(zip(np.split(areas, splits), np.split(centers, splits), 
+                    np.split(normals, splits), np.split(num_corners, splits)))
+
+
 class VoronoiPolyhedron(ConvexPolyhedron):
 
     """
@@ -67,21 +150,9 @@ class VoronoiPolyhedron(ConvexPolyhedron):
 
             raise UnrecognizedChemicalSpecies(species)
 
-        # now loop over faces and calculate their area
-
-        num_corners = np.zeros((self.num_faces), dtype=int)
-        areas = np.zeros((self.num_faces), dtype=float)
-        face_centers = np.zeros((self.num_faces, 3), dtype=float)
-        for nface, face in enumerate(self.faces):
-            
-            face_corners = vertices[face]
+        # now calculate the area, center and normal of every face at once
 
-            num_corners[nface] = len(face_corners)
-            polygon = ConvexPolygon(face_corners)
-
-            face_centers[nface] = polygon.center
-
-            areas[nface] = polygon.area
+        areas, face_centers, face_normals, num_corners = face_statistics(self.vertices, self.faces)
 
         # find the index array that would sort the facet areas
 
@@ -91,19 +162,17 @@ class VoronoiPolyhedron(ConvexPolyhedron):
 
         # finally, we will define an array indicating how many
         # polygons of each kind this VP has
-
-        self._num_polygons = np.zeros((np.max(num_corners) - 2), dtype=int)
-        # the -2 above is because the minimum number of corners to
+        # the -3 below is because the minimum number of corners to
         # define a convex polygon is 3
 
-        for nface in range(self.num_faces):
-
-            self._num_polygons[num_corners[nface] - 3] += 1
+        self._num_polygons = np.bincount(num_corners - 3, minlength=np.max(num_corners) - 2)
 
         self.face_areas = areas
 
         self.face_centers = face_centers
 
+        self.face_normals = face_normals
+
     def get_polygons(self) -> dict:
 
         """
@@ -180,19 +249,19 @@ class VoronoiPolyhedron(ConvexPolyhedron):
         must have the same volume, the same number of faces, the same
         face types, face areas and total face area; otherwise they are
         assumed different. Becase volume and area(s) are floats, we
-        base their comparison using intrinsic isclose with a 1.0e-6 tolerance.
+        base their comparison using intrinsic isclose with an EQUALITY_TOL tolerance.
 
         :return: True if self and other are equal accordint to definition above;
           False otherwise
 
         """
 
-        if not isclose( self.volume, other.volume, abs_tol = 1.0e-6 ):
+        if not isclose( self.volume, other.volume, abs_tol = EQUALITY_TOL ):
 
             return False
 
         elif not isclose( self.surface_area, other.surface_area, \
-                          abs_tol = 1.0e-6 ):
+                          abs_tol = EQUALITY_TOL ):
 
             return False
 
@@ -216,7 +285,7 @@ class VoronoiPolyhedron(ConvexPolyhedron):
                     return False
 
                 if not isclose( self._polygons['area'][nface], \
-                       other._polygons['area'][nface], abs_tol = 1.0e-6 ):
+                       other._polygons['area'][nface], abs_tol = EQUALITY_TOL ):
 
                     return False
 
@@ -227,6 +296,41 @@ class VoronoiPolyhedron(ConvexPolyhedron):
 
         return True
 
+    def shape_fingerprint( self ) -> tuple:
+
+        """
+
+        Canonical, hashable key of the shape: number of vertices, number of faces
+        and the face types ordered by increasing area (which fixes the face-type
+        histogram). Two polyhedra have the same fingerprint if and only if
+        sameshape returns True, so grouping by it replaces pairwise comparisons.
+        Area and volume are left out, as sameshape ignores them; see fingerprint.
+
+        :return: (num_vertices, num_faces, face types)
+        :rtype: tuple
+
+        """
+
+        return (int(self.num_vertices), int(self.num_faces), 
+                tuple(int(n) for n in self._polygons['shape']))
+
+    def fingerprint( self ) -> tuple:
+
+        """
+
+        Hashable key for equality (see __eq__): the shape fingerprint plus the
+        volume and the total face area quantized to EQUALITY_TOL. Polyhedra equal
+        within EQUALITY_TOL fall at most one bin apart in each invariant.
+
+        :return: (shape fingerprint, volume bin, surface area bin)
+        :rtype: tuple
+
+        """
+
+        return (self.shape_fingerprint(),
+                int(np.floor(self.volume / EQUALITY_TOL)),
+                int(np.floor(self.surface_area / EQUALITY_TOL)))
+
     def sameshape( self, other ) -> bool:
 
         """
@@ -268,3 +372,59 @@ class VoronoiPolyhedron(ConvexPolyhedron):
         # self and other have same shape
 
         return True
+
+
+
+def group_same_shape(polyhedra: List[VoronoiPolyhedron]) -> List[List[int]]:
+
+    """
+
+    Groups polyhedra by shape (see sameshape) in O(N) through a dictionary
+    keyed by shape_fingerprint.
+
+    :return: list of groups, each a list of indices into polyhedra
+    :rtype: List[List[int]]
+
+    """
+
+    groups = {}
+    for index, polyhedron in enumerate(polyhedra):
+        groups.setdefault(polyhedron.shape_fingerprint(), []).append(index)
+    return list(groups.values())
+
+
+def group_equal(polyhedra: List[VoronoiPolyhedron]) -> List[List[int]]:
+
+    """
+
+    Groups polyhedra that are equal within EQUALITY_TOL (see __eq__) in O(N).
+    Polyhedra are hashed by fingerprint, the shape plus the volume and surface area
+    quantized to EQUALITY_TOL; equal polyhedra differ by at most one bin in each,
+    so only the neighboring bins are compared with __eq__.
+
+    :return: list of groups, each a list of indices into polyhedra
+    :rtype: List[List[int]]
+
+    """
+
+    index = {}
+    groups = []
+    for i_poly, polyhedron in enumerate(polyhedra):
+        key = polyhedron.fingerprint()
+        shape, volume_bin, area_bin = key
+
+        match = None
+        for neighbor_key in ((shape, volume_bin + i, area_bin + j) for i in (-1, 0, 1) for j in (-1, 0, 1)):
+            for i_group in index.get(neighbor_key, []):
+                if polyhedra[groups[i_group][0]] == polyhedron:
+                    match = i_group
+                    break
+            if match is not None:
+                break
+
+        if match is None:
+            match = len(groups)
+            groups.append([])
+            index.setdefault(key, []).append(match)
+        groups[match].append(i_poly)
+    return groups
@@ -3,14 +3,46 @@ import os
 from typing import List, Tuple, Union
 
 import numpy as np
-from scipy.spatial import Voronoi, distance
+from scipy.spatial import Voronoi, cKDTree, distance
 
 import pymatgen.core as pmat
+from pymatgen.analysis.chemenv.coordination_environments.chemenv_strategies import SimplestChemenvStrategy
+from pymatgen.analysis.chemenv.coordination_environments.coordination_geometry_finder import LocalGeometryFinder
+from pymatgen.analysis.chemenv.coordination_environments.structure_environments import LightStructureEnvironments
 
 from matgraphdb.core.structure import Structure
 from matgraphdb.utils import periodic_table
 from matgraphdb.core.voronoi_polyhedron import VoronoiPolyhedron
 
+# Suggested radius in Angstrom of the shell of periodic images around the central cell.
+# Opt-in through image_cutoff, the default stays the 3x3x3 supercell
+IMAGE_CUTOFF = 8.0
+
+def ridge_adjacency(ridge_points: np.ndarray, n_points: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Builds a CSR adjacency index of the Voronoi ridges, so the neighbors of
+    point i are indices[indptr[i]:indptr[i+1]], listed in ridge order.
+
+    :param ridge_points: the (n_ridges,2) array of points separated by each ridge.
+    :type np.ndarray:
+
+    :param n_points: the number of input points.
+    :type int:
+
+    :return: indptr (n_points+1) and indices (2*n_ridges)
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+    ridge_points = np.asarray(ridge_points)
+    ridge_ids = np.arange(len(ridge_points))
+
+    rows = np.concatenate([ridge_points[:, 0], ridge_points[:, 1]])
+    cols = np.concatenate([ridge_points[:, 1], ridge_points[:, 0]])
+    order = np.lexsort((np.concatenate([ridge_ids, ridge_ids]), rows))
+
+    indptr = np.zeros(n_points + 1, dtype=int)
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=n_points))
+    return indptr, cols[order]
+
 
 class VoronoiStructure(Structure):
     """
@@ -25,9 +57,11 @@ class VoronoiStructure(Structure):
     def __init__(self,structure_id: Union[int, str], 
                     database_source:str=None,
                     database_id:str=None,
-                    neighbor_tol:float=0.05):
+                    neighbor_tol:float=0.05,
+                    image_cutoff:float=None,
+                    symmetry:dict=None):
 
-        super().__init__(structure_id=structure_id)
+        super().__init__(structure_id=structure_id, image_cutoff=image_cutoff, symmetry=symmetry)
         
         r"""
 
@@ -48,6 +82,15 @@ class VoronoiStructure(Structure):
         :param neighbor_tol: Optional, tolerance for to count bonds.
         :type float:
 
+        :param image_cutoff: Optional, radius in Angstrom around the central cell within which
+                            periodic images are included in the Voronoi and bond analysis.
+                            If None, the fixed 3x3x3 supercell is used. IMAGE_CUTOFF is a
+                            reasonable value, note it changes the sites and neighbors of the analysis.
+        :type float:
+
+        :param symmetry: Optional, a stored symmetry analysis, see Structure.
+        :type dict:
+
         """
         self.database_source = database_source
         self.database_id = database_id
@@ -103,25 +146,22 @@ class VoronoiStructure(Structure):
         self.combined_voronoi_volume=0
         self.combined_voronoi_surface_area = 0
 
+        # Neighbor lookup through the ridge adjacency and bond lookup through a KD-tree, both built once
+        indptr, adjacent_points = ridge_adjacency(voronoi.ridge_points, len(self.cart_coords))
+        tree = cKDTree(self.cart_coords)
+        covalent_radii_atoms = np.array([periodic_table.covalent_radii[atomic_number] for atomic_number in self.atoms])
+        max_covalent_radius = np.max(covalent_radii_atoms)
+
         for ipoly in indices_unit:
 
             species = self.atoms[ipoly]
 
 
             unit_index= self.unit_index_map[ipoly]
-            # Find the voronoi region of the 
-            target_region=voronoi.point_region[ipoly]
-            neighbors=[]
-            neighbors_unit=[]
-            for p1, p2 in voronoi.ridge_points:
-                if p1 == target_region:
-                    neighbors.append(voronoi.point_region[p2])
-
-                    neighbors_unit.append(self.unit_index_map[p2])
-                elif p2 == target_region:
-                    neighbors.append(voronoi.point_region[p1])
-
-                    neighbors_unit.append(self.unit_index_map[p1])
+            # Find the points sharing a ridge with the center point
+            neighbor_points = adjacent_points[indptr[ipoly]:indptr[ipoly + 1]]
+            neighbors = voronoi.point_region[neighbor_points].tolist()
+            neighbors_unit = self.unit_index_map[neighbor_points].tolist()
             neighbor_coordination_envrionment=[self.coordination_environments[index] for index in neighbors_unit]
             
             vertices = voronoi.vertices[voronoi.regions[voronoi.point_region[ipoly]]]
@@ -135,17 +175,20 @@ class VoronoiStructure(Structure):
             self.combined_voronoi_volume += voronoi_polyhedron.volume
             self.combined_voronoi_surface_area += voronoi_polyhedron.surface_area
             # Determination of the corrdination number
-            covalent_radii_atoms = np.array([periodic_table.covalent_radii[atomic_number] for atomic_number in self.atoms])
             covelent_radius_center = periodic_table.covalent_radii[self.atoms[ipoly]]
+
+            # Only sites within the largest possible bond length are candidates
+            max_bond_distance = (max_covalent_radius + covelent_radius_center) * (1 + self.neighbor_tol)
+            candidates = np.array(tree.query_ball_point(voronoi_polyhedron.center_atom, r=max_bond_distance), dtype=int)
             
             # Calculates the proposed bond length based on the covalent radii and a tolerance
-            proposed_bond_distances = (covalent_radii_atoms + np.array([covelent_radius_center]*len(self.atoms)) ) * (1 + self.neighbor_tol)
+            proposed_bond_distances = (covalent_radii_atoms[candidates] + covelent_radius_center) * (1 + self.neighbor_tol)
 
-            # Calculates the actual distance between center atom and the ther sites
-            distance_array = np.linalg.norm(voronoi_polyhedron.center_atom - self.cart_coords, axis=1)
+            # Calculates the actual distance between center atom and the candidate sites
+            distance_array = np.linalg.norm(voronoi_polyhedron.center_atom - self.cart_coords[candidates], axis=1)
             
             # Determines which sites are the closet to the center site and exludes the center site itself
-            bond_indices = np.where(np.logical_and(distance_array < proposed_bond_distances, distance_array != 0))[0]
+            bond_indices = candidates[np.logical_and(distance_array < proposed_bond_distances, distance_array != 0)]
             
             # Some center site properties
             center_coordination = bond_indices.shape[0]
@@ -0,0 +1,224 @@
+import os
+import json
+from functools import partial
+from multiprocessing import Pool
+from typing import Dict, List, Union
+
+import numpy as np
+
+from matgraphdb.utils import LOGGER, N_CORES
+from matgraphdb.core.voronoi_structure import VoronoiStructure
+
+
+# Fixed width columns, one row per polyhedron
+SCALAR_COLUMNS = ['material_index', 'unit_index', 'species', 'coordination', 'volume', 'surface_area', 'center_atom', 'ce_symbol']
+# Ragged columns, stored flat with an offsets array of length n_polyhedra+1
+RAGGED_COLUMNS = ['vertices', 'face_areas', 'face_shapes', 'neighbor_unit_indices']
+
+
+def polyhedra_columns(voronoi_structure: VoronoiStructure) -> Dict[str, np.ndarray]:
+    """
+    Converts the polyhedra of a VoronoiStructure into columns.
+
+    :param voronoi_structure: the analyzed structure
+    :type VoronoiStructure:
+
+    :return: dictionary of scalar columns and, for each ragged column, the flat
+        values and the number of values per polyhedron under '<name>_counts'
+    :rtype: Dict[str, np.ndarray]
+    """
+    polyhedra = voronoi_structure.voronoi_polyhedra
+    polyhedra_dicts = voronoi_structure.voronoi_polyhedra_dicts
+    _, _, report_voronoi_unit = voronoi_structure.get_atom_lists()
+    indices_unit, = np.nonzero(report_voronoi_unit)
+
+    ce_symbols = []
+    for polyhedron_dict in polyhedra_dicts:
+        coordination_environment = polyhedron_dict['coordination_envrionment']
+        ce_symbols.append(coordination_environment[0]['ce_symbol'] if coordination_environment else '')
+
+    face_shapes = [np.array([len(face) for face in polyhedron.faces], dtype=np.int16) for polyhedron in polyhedra]
+
+    columns = {
+        'unit_index': voronoi_structure.unit_index_map[indices_unit].astype(np.int32),
+        'species': np.array([d['species'] for d in polyhedra_dicts], dtype=np.int16),
+        'coordination': np.array([d['center_coordination'] for d in polyhedra_dicts], dtype=np.int16),
+        'volume': np.array([d['voronoi_volume'] for d in polyhedra_dicts], dtype=float),
+        'surface_area': np.array([d['voronoi_surface_area'] for d in polyhedra_dicts], dtype=float),
+        'center_atom': np.array([d['center_atom'] for d in polyhedra_dicts], dtype=float).reshape(-1, 3),
+        'ce_symbol': np.array(ce_symbols, dtype='<U8'),
+        'vertices': [np.asarray(polyhedron.vertices, dtype=float) for polyhedron in polyhedra],
+        'face_areas': [np.asarray(polyhedron.face_areas, dtype=float) for polyhedron in polyhedra],
+        'face_shapes': face_shapes,
+        'neighbor_unit_indices': [np.array(d['neighbor_unit_indices'], dtype=np.int32) for d in polyhedra_dicts],
+        }
+    return columns
+
+
+def _voronoi_task(structure_id: Union[int, str], **kwargs):
+    try:
+        return polyhedra_columns(VoronoiStructure(structure_id=structure_id, **kwargs))
+    except Exception as e:
+        LOGGER.error(f"Error in Voronoi analysis of {structure_id}: {e}")
+        return None
+
+
+class PolyhedronTable:
+    """
+    A flat columnar table of Voronoi polyhedra, one row per polyhedron.
+
+    Fixed width properties (species, coordination, volume, ...) are numpy
+    columns; vertices, face areas, face shapes and neighbors are ragged and
+    stored as one flat array plus an offsets array, so row i of a ragged
+    column is values[offsets[i]:offsets[i+1]]. Every column is a .npy file,
+    so a saved table can be memory-mapped and queried without loading it.
+
+    :class: `PolyhedronTable`
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], material_ids: List[str]):
+
+        """
+
+        Class Constructor
+
+        :param columns: the scalar columns and, for each ragged column, the flat
+                    values under its name and the offsets under '<name>_offsets'
+        :type Dict[str, np.ndarray]:
+
+        :param material_ids: the id of each material, indexed by the material_index column
+        :type List[str]:
+
+        """
+
+        self.columns = columns
+        self.material_ids = np.asarray(material_ids)
+
+    def __len__(self) -> int:
+        return len(self.columns['species'])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    @classmethod
+    def from_structures(cls, structure_ids: List[Union[int, str]],
+                        material_ids: List[str] = None,
+                        n_cores: int = N_CORES,
+                        **kwargs):
+        """
+        Runs the Voronoi analysis over many structures in parallel and collects
+        the polyhedra in a single table.
+
+        :param structure_ids: the cif files or COD ids of the structures
+        :type List[Union[int, str]]:
+
+        :param material_ids: Optional, the id of each material. Defaults to structure_ids.
+        :type List[str]:
+
+        :param n_cores: Optional, number of worker processes.
+        :type int:
+
+        :param kwargs: passed to VoronoiStructure, e.g. neighbor_tol or image_cutoff.
+
+        :return: the polyhedron table
+        :rtype: PolyhedronTable
+        """
+        if material_ids is None:
+            material_ids = [str(structure_id) for structure_id in structure_ids]
+
+        task = partial(_voronoi_task, **kwargs)
+        if n_cores == 1:
+            results = [task(structure_id) for structure_id in structure_ids]
+        else:
+            with Pool(n_cores) as p:
+                results = p.map(task, structure_ids)
+
+        columns = {name: [] for name in SCALAR_COLUMNS + RAGGED_COLUMNS}
+        for material_index, result in enumerate(results):
+            if result is None:
+                continue
+            n_polyhedra = len(result['species'])
+            columns['material_index'].append(np.full(n_polyhedra, material_index, dtype=np.int32))
+            for name in SCALAR_COLUMNS[1:]:
+                columns[name].append(result[name])
+            for name in RAGGED_COLUMNS:
+                columns[name].extend(result[name])
+
+        table_columns = {}
+        for name in SCALAR_COLUMNS:
+            table_columns[name] = np.concatenate(columns[name]) if columns[name] else np.zeros(0)
+        for name in RAGGED_COLUMNS:
+            counts = np.array([len(values) for values in columns[name]], dtype=np.int64)
+            table_columns[name + '_offsets'] = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            table_columns[name] = np.concatenate(columns[name]) if columns[name] else np.zeros(0)
+
+        return cls(table_columns, material_ids)
+
+    def save(self, directory: str):
+        """
+        Saves every column as a .npy file in directory.
+
+        :param directory: the output directory
+        :type str:
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name, values in self.columns.items():
+            np.save(os.path.join(directory, name + '.npy'), values)
+        with open(os.path.join(directory, 'material_ids.json'), 'w') as f:
+            json.dump(self.material_ids.tolist(), f)
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: str = 'r'):
+        """
+        Loads a table saved with save.
+
+        :param directory: the table directory
+        :type str:
+
+        :param mmap_mode: Optional, numpy memory-map mode; None loads the columns into memory.
+        :type str:
+
+        :return: the polyhedron table
+        :rtype: PolyhedronTable
+        """
+        columns = {}
+        for file in os.listdir(directory):
+            if file.endswith('.npy'):
+                columns[file[:-4]] = np.load(os.path.join(directory, file), mmap_mode=mmap_mode)
+        with open(os.path.join(directory, 'material_ids.json')) as f:
+            material_ids = json.load(f)
+        return cls(columns, material_ids)
+
+    def get_ragged(self, name: str, index: int) -> np.ndarray:
+        """
+        :return: row index of the ragged column name
+        :rtype: np.ndarray
+        """
+        offsets = self.columns[name + '_offsets']
+        return self.columns[name][offsets[index]:offsets[index + 1]]
+
+    def select(self, species: Union[int, List[int]] = None,
+               coordination: Union[int, List[int]] = None,
+               min_volume: float = None,
+               max_volume: float = None) -> np.ndarray:
+        """
+        Vectorized query on the scalar columns.
+
+        :param species: Optional, atomic number(s) of the center atom
+        :param coordination: Optional, coordination number(s)
+        :param min_volume: Optional, minimum Voronoi volume
+        :param max_volume: Optional, maximum Voronoi volume
+
+        :return: the row indices of the matching polyhedra
+        :rtype: np.ndarray
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if species is not None:
+            mask &= np.isin(self.columns['species'], species)
+        if coordination is not None:
+            mask &= np.isin(self.columns['coordination'], coordination)
+        if min_volume is not None:
+            mask &= self.columns['volume'] >= min_volume
+        if max_volume is not None:
+            mask &= self.columns['volume'] <= max_volume
+        return np.nonzero(mask)[0]
@@ -5,6 +5,7 @@ from glob import glob
 
 from multiprocessing import Pool
 from matgraphdb.utils import DATA_DIR, MP_API_KEY
+from matgraphdb.database.json.dft_calc.calc_tracker import CALC_SUBDIR
 
 from mp_api.client import MPRester
 
@@ -13,7 +14,8 @@ from functools import partial
 def process_entry(file,save_dir=os.path.join(DATA_DIR,'data','raw','mp_database_nelements_7_calcs')):
     calcs_database_dir=save_dir
     material_id=file.split(os.sep)[-1].split('.')[0]
-    calcs_dir=os.path.join(calcs_database_dir,material_id,'static')
+    # The chargemol calculation is staged on top of these inputs, see chargemol_calc_setup
+    calcs_dir=os.path.join(calcs_database_dir,material_id,CALC_SUBDIR)
     os.makedirs(calcs_dir,exist_ok=True)
     try:
         with MPRester(MP_API_KEY) as mpr:
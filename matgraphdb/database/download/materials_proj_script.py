@@ -5,6 +5,7 @@ import json
 from mp_api.client import MPRester
 
 from matgraphdb.utils import DATA_DIR, MP_API_KEY
+from matgraphdb.database.download.parallel_download import download_materials, sync_materials, FIELDS_TO_INCLUDE
 
 
 
@@ -215,43 +216,15 @@ from matgraphdb.utils import DATA_DIR, MP_API_KEY
 
 
 
-fileds_to_include=['material_id','nsites','elements','nelements','composition',
-                   'composition_reduced','formula_pretty','volume',
-                   'density','density_atomic','symmetry','structure',
-                   'energy_per_atom','formation_energy_per_atom','energy_above_hull','is_stable',
-                   'band_gap','cbm','vbm','is_stable','efermi','is_gap_direct','is_metal',
-                   'is_magnetic','ordering','total_magnetization','total_magnetization_normalized_vol',
-                   'num_magnetic_sites','num_unique_magnetic_sites',
-                   'k_voigt','k_reuss','k_vrh','g_voigt','g_reuss','g_vrh',
-                   'universal_anisotropy','homogeneous_poisson','e_total','e_ionic','e_electronic']
-
-with MPRester(MP_API_KEY) as mpr:
-    summary_docs = mpr.summary._search( nelements=7,
-                                       energy_above_hull_min=0, 
-                                       energy_above_hull_max=0.05, 
-                                       fields=fileds_to_include)
-
-print('------------------------------------------------')
-print("Generating directory json files database")
-print('------------------------------------------------')
-print('------------------------------------------------')
-json_database_dir=os.path.join(DATA_DIR,'raw',f'mp_database_nelements_7')
-os.makedirs(json_database_dir,exist_ok=True)
-shutil.rmtree(json_database_dir)
-for doc in summary_docs:
-    summary_doc_dict = doc.dict()
-    mp_id=summary_doc_dict['material_id']
-
-    json_file=os.path.join(json_database_dir,f'{mp_id}.json')
-
-    json_database_entry={}
-    for field_name in fileds_to_include:
-        json_database_entry.update({field_name:summary_doc_dict[field_name]})
-
-    if not os.path.exists(os.path.dirname(json_file)):
-        os.makedirs(os.path.dirname(json_file))
-        
-    with open(json_file, 'w') as f:
-        json.dump(json_database_entry, f, indent=4)
-print('------------------------------------------------')
+if __name__=='__main__':
+    json_database_dir=os.path.join(DATA_DIR,'raw',f'mp_database_nelements_7')
+    criteria={'nelements':7,
+              'energy_above_hull_min':0,
+              'energy_above_hull_max':0.05}
 
+    if os.path.exists(os.path.join(json_database_dir,'manifest.json')):
+        # Refresh, only new or changed materials are fetched and rewritten. See manifest['stale'] for the ones to re-enrich
+        sync_materials(output_dir=json_database_dir, criteria=criteria, fields=FIELDS_TO_INCLUDE)
+    else:
+        # Paged, concurrent and resumable. Rerunning after an interruption only fetches the missing pages
+        download_materials(output_dir=json_database_dir, criteria=criteria, fields=FIELDS_TO_INCLUDE)
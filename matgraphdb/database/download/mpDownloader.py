@@ -14,6 +14,7 @@ import pymatgen.analysis.local_env as pm
 from pymatgen.io.cif import CifWriter
 
 from matgraphdb.utils import LOGGER, ROOT
+from matgraphdb.database.download.parallel_download import MPClient, screen_dimensionality
 
 class MPDownloader:
 
@@ -71,20 +72,14 @@ class MPDownloader:
                 material_ids.append(str(doc.material_id))
                 structures.append(doc.structure)
 
-            # Used to screen 3d dimensional material
+            # Used to screen 3d dimensional material, one robocrys request per page of material ids
+            dimensionalities = screen_dimensionality(MPClient(mpr=mpr), material_ids)
             filtered_material_ids=[]
             filtered_structures=[]
             for i,material_id in enumerate(material_ids):
-                try:
-                    robocrys_docs = mpr.robocrys._search( material_ids = [material_id], fields = ['condensed_structure'])[0]
-                    if robocrys_docs.condensed_structure.dimensionality == 3:
-                        filtered_material_ids.append(material_id)
-                        filtered_structures.append(structures[i])
-                except Exception as e:
-                    print(e)
-                    print(material_id)
-
-                    continue
+                if dimensionalities[material_id] == 3:
+                    filtered_material_ids.append(material_id)
+                    filtered_structures.append(structures[i])
             n_3d_material = len(filtered_material_ids)
 
             print("Found {0} possible 3d materials".format(n_3d_material))
@@ -0,0 +1,407 @@
+import os
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from monty.json import MontyEncoder
+
+from matgraphdb.utils import MP_API_KEY, LOGGER, timeit
+
+FIELDS_TO_INCLUDE=['material_id','nsites','elements','nelements','composition',
+                   'composition_reduced','formula_pretty','volume',
+                   'density','density_atomic','symmetry','structure',
+                   'energy_per_atom','formation_energy_per_atom','energy_above_hull','is_stable',
+                   'band_gap','cbm','vbm','efermi','is_gap_direct','is_metal',
+                   'is_magnetic','ordering','total_magnetization','total_magnetization_normalized_vol',
+                   'num_magnetic_sites','num_unique_magnetic_sites',
+                   'k_voigt','k_reuss','k_vrh','g_voigt','g_reuss','g_vrh',
+                   'universal_anisotropy','homogeneous_poisson','e_total','e_ionic','e_electronic']
+MANIFEST_FILE='manifest.json'
+# Ids of the downloaded materials, one per line, appended after every page
+DOWNLOADED_FILE='downloaded.txt'
+# Number of material ids per summary or robocrys request
+PAGE_SIZE=500
+# Number of requests in flight
+MAX_WORKERS=8
+
+
+def _to_dict(doc):
+    # Documents of mp_api are pydantic models holding pymatgen objects
+    doc_dict = doc.model_dump() if hasattr(doc, 'model_dump') else doc.dict()
+    return json.loads(json.dumps(doc_dict, cls=MontyEncoder))
+
+
+class MPClient:
+    """
+    Thin wrapper of the Materials Project api returning jsonable dictionaries.
+
+    Pass mpr to reuse an open MPRester, it is then left open. Otherwise the client opens
+    its own, closed by close or on leaving a with block.
+    """
+    def __init__(self, apikey=MP_API_KEY, mpr=None):
+        self._owns_mpr = mpr is None
+        if mpr is None:
+            from mp_api.client import MPRester
+            mpr = MPRester(apikey)
+        self.mpr = mpr
+
+    def close(self):
+        if self._owns_mpr:
+            self.mpr.__exit__(None, None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def search_ids(self, criteria):
+        docs = self.mpr.summary._search(**criteria, fields=['material_id'])
+        return sorted(str(doc.material_id) for doc in docs)
+
+    def search_updates(self, criteria):
+        docs = self.mpr.summary._search(**criteria, fields=['material_id','last_updated'])
+        return [{'material_id': str(doc.material_id), 'last_updated': str(doc.last_updated)} for doc in docs]
+
+    def search_summary(self, material_ids, fields):
+        docs = self.mpr.summary._search(material_ids=material_ids, fields=fields)
+        return [_to_dict(doc) for doc in docs]
+
+    def search_robocrys(self, material_ids):
+        docs = self.mpr.robocrys._search(material_ids=material_ids, fields=['material_id','condensed_structure'])
+        return [{'material_id': str(doc.material_id),
+                 'dimensionality': doc.condensed_structure.dimensionality} for doc in docs]
+
+
+def _request_key(method, *args):
+    return hashlib.sha256(json.dumps([method, *args], sort_keys=True).encode()).hexdigest()
+
+
+class RecordingClient:
+    """
+    Wraps a client and records every response to recording_dir, so the same run can be
+    replayed offline with RecordedClient.
+    """
+    def __init__(self, client, recording_dir):
+        self.client = client
+        self.recording_dir = recording_dir
+        os.makedirs(recording_dir, exist_ok=True)
+
+    def _record(self, method, *args):
+        response = getattr(self.client, method)(*args)
+        _write_json_atomic(os.path.join(self.recording_dir, _request_key(method, *args) + '.json'), response)
+        return response
+
+    def search_ids(self, criteria):
+        return self._record('search_ids', criteria)
+
+    def search_updates(self, criteria):
+        return self._record('search_updates', criteria)
+
+    def search_summary(self, material_ids, fields):
+        return self._record('search_summary', material_ids, fields)
+
+    def search_robocrys(self, material_ids):
+        return self._record('search_robocrys', material_ids)
+
+
+class RecordedClient:
+    """
+    Offline stand-in replaying the responses recorded by RecordingClient.
+    """
+    def __init__(self, recording_dir):
+        self.recording_dir = recording_dir
+
+    def _replay(self, method, *args):
+        file = os.path.join(self.recording_dir, _request_key(method, *args) + '.json')
+        if not os.path.exists(file):
+            raise KeyError(f"No recorded response for {method}")
+        with open(file) as f:
+            return json.load(f)
+
+    def search_ids(self, criteria):
+        return self._replay('search_ids', criteria)
+
+    def search_updates(self, criteria):
+        return self._replay('search_updates', criteria)
+
+    def search_summary(self, material_ids, fields):
+        return self._replay('search_summary', material_ids, fields)
+
+    def search_robocrys(self, material_ids):
+        return self._replay('search_robocrys', material_ids)
+
+
+def _write_json_atomic(file, data, indent=None):
+    # Written to a temporary file then renamed, so an interrupted run never leaves a partial file
+    tmp_file = f'{file}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f, indent=indent)
+    os.replace(tmp_file, file)
+
+
+def load_manifest(output_dir):
+    file = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(file):
+        return None
+    with open(file) as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir, manifest):
+    _write_json_atomic(os.path.join(output_dir, MANIFEST_FILE), manifest, indent=4)
+
+
+def load_downloaded(output_dir):
+    """
+    Returns the ids recorded in output_dir/downloaded.txt. A line cut short by an interrupted
+    write has no newline and is ignored.
+    """
+    file = os.path.join(output_dir, DOWNLOADED_FILE)
+    if not os.path.exists(file):
+        return set()
+    with open(file) as f:
+        return set(f.read().split('\n')[:-1])
+
+
+@contextmanager
+def _open_client(client):
+    # A client passed in is left open, the default MPClient is closed on exit
+    if client is not None:
+        yield client
+        return
+    with MPClient() as client:
+        yield client
+
+
+def _pages(material_ids, page_size):
+    return [material_ids[i:i + page_size] for i in range(0, len(material_ids), page_size)]
+
+
+def screen_dimensionality(client, material_ids, dimensionality=3, page_size=PAGE_SIZE, max_workers=MAX_WORKERS):
+    """
+    Looks up the robocrys dimensionality of many materials with one request per page of ids.
+
+    Args:
+        client: An MPClient or RecordedClient.
+        material_ids (list): The material ids.
+        dimensionality (int): The dimensionality to keep.
+        page_size (int): Number of material ids per request.
+        max_workers (int): Number of requests in flight.
+
+    Returns:
+        dict: Material id to its dimensionality, None where robocrys has no document.
+    """
+    def task(page):
+        try:
+            return client.search_robocrys(page)
+        except Exception as e:
+            LOGGER.error(f"Error screening {len(page)} materials starting at {page[0]}: {e}")
+            return []
+
+    dimensionalities = {material_id: None for material_id in material_ids}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for docs in executor.map(task, _pages(material_ids, page_size)):
+            for doc in docs:
+                dimensionalities[doc['material_id']] = doc['dimensionality']
+    return dimensionalities
+
+
+@timeit
+def download_materials(output_dir, criteria, fields=FIELDS_TO_INCLUDE, client=None, dimensionality=None,
+                       page_size=PAGE_SIZE, max_workers=MAX_WORKERS):
+    """
+    Downloads the summary documents of every material matching criteria into
+    output_dir/<material_id>.json.
+
+    The material ids are fetched first, then optionally screened by robocrys
+    dimensionality, and the documents are fetched in pages of page_size ids with
+    max_workers requests in flight. Each document is written atomically. The manifest
+    is written once with the material ids, and the ids of each finished page are appended
+    to output_dir/downloaded.txt, so an interrupted download resumes with the pages that
+    are missing.
+
+    Args:
+        output_dir (str): The json database directory.
+        criteria (dict): The summary search criteria, e.g. {'nelements': 2, 'energy_above_hull_max': 0.05}.
+        fields (list): The summary fields to store.
+        client: An MPClient or a RecordedClient for offline runs. Defaults to an MPClient closed on return.
+        dimensionality (int): Optional, only keep materials with this robocrys dimensionality.
+        page_size (int): Number of material ids per request.
+        max_workers (int): Number of requests in flight.
+
+    Returns:
+        dict: The manifest, with the downloaded ids under 'downloaded'.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    downloaded_file = os.path.join(output_dir, DOWNLOADED_FILE)
+
+    with _open_client(client) as client:
+        manifest = load_manifest(output_dir)
+        if manifest is None or manifest.get('criteria') != criteria or manifest.get('dimensionality') != dimensionality or 'material_ids' not in manifest:
+            material_ids = client.search_ids(criteria)
+            LOGGER.info(f"Found {len(material_ids)} possible materials")
+            if dimensionality is not None:
+                dimensionalities = screen_dimensionality(client, material_ids, page_size=page_size, max_workers=max_workers)
+                material_ids = [material_id for material_id in material_ids if dimensionalities[material_id] == dimensionality]
+                LOGGER.info(f"Found {len(material_ids)} materials of dimensionality {dimensionality}")
+            manifest = dict(manifest or {}, criteria=criteria, dimensionality=dimensionality, fields=fields,
+                            material_ids=material_ids)
+            manifest.pop('downloaded', None)
+            save_manifest(output_dir, manifest)
+            if os.path.exists(downloaded_file):
+                os.remove(downloaded_file)
+
+        # Manifests written before downloaded.txt kept the downloaded ids in the manifest
+        downloaded = load_downloaded(output_dir) | set(manifest.pop('downloaded', []))
+        # Rewritten once per run, dropping a line cut short so the pages appended next start on a new line
+        tmp_file = f'{downloaded_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(''.join(f"{material_id}\n" for material_id in sorted(downloaded)))
+        os.replace(tmp_file, downloaded_file)
+        todo = [material_id for material_id in manifest['material_ids'] if material_id not in downloaded]
+        LOGGER.info(f"{len(downloaded)} materials already downloaded, {len(todo)} to download")
+
+        lock = threading.Lock()
+
+        def task(page):
+            try:
+                docs = client.search_summary(page, fields)
+            except Exception as e:
+                LOGGER.error(f"Error downloading {len(page)} materials starting at {page[0]}: {e}")
+                return
+            for doc in docs:
+                json_database_entry = {field_name: doc.get(field_name) for field_name in fields}
+                _write_json_atomic(os.path.join(output_dir, f"{doc['material_id']}.json"), json_database_entry, indent=4)
+            with lock:
+                with open(downloaded_file, 'a') as f:
+                    f.write(''.join(f"{doc['material_id']}\n" for doc in docs))
+                downloaded.update(doc['material_id'] for doc in docs)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(task, _pages(todo, page_size)))
+
+    n_missing = len(set(manifest['material_ids']) - downloaded)
+    if n_missing:
+        LOGGER.error(f"{n_missing} materials are not downloaded, rerun to resume")
+    manifest['downloaded'] = sorted(downloaded)
+    return manifest
+
+
+def content_hash(entry):
+    """
+    Hash of a material entry, independent of the key order.
+    """
+    return hashlib.sha256(json.dumps(entry, sort_keys=True).encode()).hexdigest()
+
+
+@timeit
+def sync_materials(output_dir, criteria, fields=FIELDS_TO_INCLUDE, client=None,
+                   page_size=PAGE_SIZE, max_workers=MAX_WORKERS):
+    """
+    Brings a json database up to date with the Materials Project by fetching only new
+    and changed materials.
+
+    The manifest keeps the content hash and the last_updated stamp of every material.
+    Only the ids and last_updated stamps of all matching materials are requested; full
+    documents are fetched for materials that are new or whose stamp changed, and a file
+    is rewritten only if its content hash changed. The keys added by the mat_calc tasks
+    are dropped from rewritten files, so tasks run with from_scratch=False recompute
+    them, and the rewritten and new ids are listed in manifest['stale'] until
+    clear_stale is called. Materials no longer matching are listed in manifest['removed']
+    but their files are kept.
+
+    Args:
+        output_dir (str): The json database directory.
+        criteria (dict): The summary search criteria.
+        fields (list): The summary fields to store.
+        client: An MPClient or a RecordedClient for offline runs. Defaults to an MPClient closed on return.
+        page_size (int): Number of material ids per request.
+        max_workers (int): Number of requests in flight.
+
+    Returns:
+        dict: The manifest.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    with _open_client(client) as client:
+        manifest = load_manifest(output_dir) or {'criteria': criteria, 'fields': fields}
+        materials = manifest.setdefault('materials', {})
+        stale = set(manifest.get('stale', []))
+
+        remote = {update['material_id']: update['last_updated'] for update in client.search_updates(criteria)}
+
+        # Materials downloaded before the manifest tracked hashes are hashed from their files
+        for material_id in remote:
+            file = os.path.join(output_dir, f'{material_id}.json')
+            if material_id not in materials and os.path.exists(file):
+                with open(file) as f:
+                    db = json.load(f)
+                materials[material_id] = {'hash': content_hash({field_name: db.get(field_name) for field_name in fields}),
+                                          'last_updated': None}
+
+        todo = [material_id for material_id, last_updated in remote.items()
+                if material_id not in materials or materials[material_id]['last_updated'] != last_updated
+                or not os.path.exists(os.path.join(output_dir, f'{material_id}.json'))]
+        removed = sorted(material_id for material_id in materials if material_id not in remote)
+        LOGGER.info(f"{len(remote)} materials match, {len(todo)} new or updated, {len(removed)} no longer match")
+
+        lock = threading.Lock()
+        n_rewritten = [0]
+
+        def task(page):
+            try:
+                docs = client.search_summary(page, fields)
+            except Exception as e:
+                LOGGER.error(f"Error downloading {len(page)} materials starting at {page[0]}: {e}")
+                return
+            for doc in docs:
+                material_id = doc['material_id']
+                entry = {field_name: doc.get(field_name) for field_name in fields}
+                entry_hash = content_hash(entry)
+                if material_id not in materials or materials[material_id]['hash'] != entry_hash:
+                    # Rewriting drops the keys computed from the old document
+                    _write_json_atomic(os.path.join(output_dir, f'{material_id}.json'), entry, indent=4)
+                    with lock:
+                        stale.add(material_id)
+                        n_rewritten[0] += 1
+                with lock:
+                    materials[material_id] = {'hash': entry_hash, 'last_updated': remote[material_id]}
+            with lock:
+                manifest['stale'] = sorted(stale)
+                save_manifest(output_dir, manifest)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(task, _pages(todo, page_size)))
+
+    manifest['criteria'] = criteria
+    manifest['removed'] = removed
+    manifest['stale'] = sorted(stale)
+    save_manifest(output_dir, manifest)
+    LOGGER.info(f"Rewrote {n_rewritten[0]} materials, {len(stale)} materials are stale")
+    return manifest
+
+
+def get_stale_files(output_dir):
+    """
+    Returns the json files of the materials whose mat_calc results are stale, e.g. to
+    pass to process_database(func, database_files=...).
+    """
+    manifest = load_manifest(output_dir) or {}
+    return [os.path.join(output_dir, f'{material_id}.json') for material_id in manifest.get('stale', [])]
+
+
+def clear_stale(output_dir, material_ids=None):
+    """
+    Marks materials as enriched again, all of them if material_ids is None.
+    """
+    manifest = load_manifest(output_dir)
+    if manifest is None:
+        return
+    if material_ids is None:
+        manifest['stale'] = []
+    else:
+        manifest['stale'] = sorted(set(manifest.get('stale', [])) - set(material_ids))
+    save_manifest(output_dir, manifest)
@@ -0,0 +1,208 @@
+import io
+import os
+import json
+from glob import glob
+
+import numpy as np
+import pandas as pd
+
+from matgraphdb.utils import ENCODING_DIR
+
+ENCODINGS_FILE='encodings.npy'
+IDS_FILE='material_ids.json'
+METADATA_FILE='metadata.json'
+# Significant digits written per value in Neo4j float[] columns, enough for float32
+NEO4J_PRECISION=8
+NEO4J_ARRAY_DELIMITER=';'
+
+
+def _normalize_id(material_id):
+    # The json database uses mp-1000, the graph csvs use mp_1000
+    return str(material_id).replace('-','_')
+
+
+def format_neo4j_arrays(encodings, precision=NEO4J_PRECISION, delimiter=NEO4J_ARRAY_DELIMITER):
+    """
+    Serializes the rows of a matrix into Neo4j float[] csv values, e.g. '0.1;0.2;0.3'.
+    Rows containing a NaN are written as empty strings, which neo4j-admin imports as missing.
+
+    Args:
+        encodings (np.ndarray): The matrix, one row per node.
+        precision (int): Number of significant digits per value.
+        delimiter (str): The array delimiter of the import.
+
+    Returns:
+        list: One string per row.
+    """
+    encodings = np.asarray(encodings)
+    if encodings.ndim != 2 or encodings.shape[1] == 0:
+        return ['']*len(encodings)
+    valid = ~np.isnan(encodings).any(axis=1)
+    values = np.full(len(encodings), '', dtype=object)
+    if valid.any():
+        # One formatting pass over the whole matrix instead of a join per row
+        buffer = io.StringIO()
+        np.savetxt(buffer, encodings[valid], fmt=f'%.{precision}g', delimiter=delimiter)
+        values[valid] = buffer.getvalue().splitlines()
+    return values.tolist()
+
+
+class EncodingStore:
+    def __init__(self, encodings, material_ids, metadata=None, directory=None):
+        """
+        A matrix of material encodings, one float32 row per material, with the material
+        id of every row and metadata recording the model and the dimension. On disk it is
+        a directory holding encodings.npy, material_ids.json and metadata.json, so the
+        matrix can be memory-mapped instead of parsed.
+
+        Args:
+            encodings (np.ndarray): The (n_materials, dimension) matrix.
+            material_ids (list): The material id of each row.
+            metadata (dict): Optional, at least 'model' and 'dimension'.
+            directory (str): Optional, the directory the store was loaded from.
+        """
+        self.encodings = encodings
+        self.material_ids = list(material_ids)
+        self.metadata = metadata or {}
+        self.directory = directory
+        self._index = None
+
+    def __len__(self):
+        return len(self.material_ids)
+
+    @property
+    def name(self):
+        return self.metadata.get('model')
+
+    @property
+    def dimension(self):
+        return self.encodings.shape[1]
+
+    @property
+    def index(self):
+        """Material id (with '-' replaced by '_') to row."""
+        if self._index is None:
+            self._index = {_normalize_id(material_id): i for i, material_id in enumerate(self.material_ids)}
+        return self._index
+
+    @classmethod
+    def save(cls, directory, encodings, material_ids, model, **metadata):
+        """
+        Writes a store. Files are written then renamed, so readers never see a partial store.
+
+        Args:
+            directory (str): The store directory.
+            encodings (np.ndarray): The (n_materials, dimension) matrix.
+            material_ids (list): The material id of each row.
+            model (str): Name of the model that produced the encodings.
+            metadata: Extra metadata to record.
+
+        Returns:
+            EncodingStore: The saved store.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32)
+        material_ids = [str(material_id) for material_id in material_ids]
+        if len(encodings) != len(material_ids):
+            raise ValueError(f"{len(encodings)} encodings for {len(material_ids)} material ids")
+
+        metadata = dict(metadata, model=model, dimension=int(encodings.shape[1]),
+                        n_materials=len(material_ids), dtype='float32')
+
+        os.makedirs(directory, exist_ok=True)
+        tmp_file = os.path.join(directory, 'encodings.tmp.npy')
+        np.save(tmp_file, encodings)
+        os.replace(tmp_file, os.path.join(directory, ENCODINGS_FILE))
+        for filename, data in [(IDS_FILE, material_ids), (METADATA_FILE, metadata)]:
+            tmp_file = os.path.join(directory, filename + '.tmp')
+            with open(tmp_file, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_file, os.path.join(directory, filename))
+        return cls(encodings, material_ids, metadata, directory=directory)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Loads a store.
+
+        Args:
+            directory (str): The store directory, or a store name in ENCODING_DIR.
+            mmap_mode (str): numpy memory-map mode. None loads the matrix into memory.
+
+        Returns:
+            EncodingStore: The store.
+        """
+        if not os.path.isdir(directory):
+            directory = os.path.join(ENCODING_DIR, directory)
+        encodings = np.load(os.path.join(directory, ENCODINGS_FILE), mmap_mode=mmap_mode)
+        with open(os.path.join(directory, IDS_FILE)) as f:
+            material_ids = json.load(f)
+        metadata = {}
+        if os.path.exists(os.path.join(directory, METADATA_FILE)):
+            with open(os.path.join(directory, METADATA_FILE)) as f:
+                metadata = json.load(f)
+        metadata.setdefault('model', os.path.basename(os.path.normpath(directory)))
+        return cls(encodings, material_ids, metadata, directory=directory)
+
+    @classmethod
+    def from_csv(cls, csv_file, directory=None, model=None):
+        """
+        Converts an encoding csv (material id index, one column per dimension) into a store.
+
+        Args:
+            csv_file (str): The csv file.
+            directory (str): Optional, where to save the store. Defaults to ENCODING_DIR/<model>.
+            model (str): Optional, the model name. Defaults to the csv file name.
+
+        Returns:
+            EncodingStore: The saved store.
+        """
+        if model is None:
+            model = os.path.splitext(os.path.basename(csv_file))[0]
+        if directory is None:
+            directory = os.path.join(ENCODING_DIR, model)
+        df = pd.read_csv(csv_file, index_col=0)
+        return cls.save(directory, df.to_numpy(dtype=np.float32), df.index.astype(str).tolist(), model=model)
+
+    def rows(self, material_ids):
+        """
+        Returns the row of each material id, -1 for materials without an encoding.
+        """
+        index = self.index
+        return np.array([index.get(_normalize_id(material_id), -1) for material_id in material_ids], dtype=np.int64)
+
+    def align(self, material_ids):
+        """
+        Returns the encodings in the order of material_ids, NaN rows for missing materials.
+
+        Args:
+            material_ids (list): The material ids.
+
+        Returns:
+            np.ndarray: The (len(material_ids), dimension) float32 matrix.
+        """
+        rows = self.rows(material_ids)
+        aligned = np.full((len(rows), self.dimension), np.nan, dtype=np.float32)
+        found = rows >= 0
+        aligned[found] = self.encodings[rows[found]]
+        return aligned
+
+    def to_neo4j_arrays(self, material_ids=None, precision=NEO4J_PRECISION):
+        """
+        Serializes the encodings into Neo4j float[] csv values, see format_neo4j_arrays.
+
+        Args:
+            material_ids (list): Optional, the order of the rows. Defaults to the store order.
+            precision (int): Number of significant digits per value.
+
+        Returns:
+            list: One string per material, empty for missing materials.
+        """
+        encodings = self.encodings if material_ids is None else self.align(material_ids)
+        return format_neo4j_arrays(encodings, precision=precision)
+
+
+def list_encoding_stores(encoding_dir=ENCODING_DIR):
+    """
+    Returns the directories of every store in encoding_dir.
+    """
+    return sorted(os.path.dirname(file) for file in glob(os.path.join(encoding_dir, '*', ENCODINGS_FILE)))
@@ -0,0 +1,226 @@
+import os
+import shutil
+import threading
+from glob import glob
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from matgraphdb.utils import MP_DIR, DB_CALC_DIR, LOGGER, timeit
+from matgraphdb.database.json.dft_calc.calc_tracker import CALC_SUBDIR
+
+PSEUDOS_DIR=os.path.join("/users/lllang/SCRATCH",'PP_Vasp','potpaw_PBE.52')
+CHARGEMOL_FILE_DIR=os.path.join(MP_DIR,'calculations','calculation_files','chargemol')
+# Assembled POTCARs, one file per element sequence. Must be on the filesystem of the calc dirs so they can be hard-linked
+POTCAR_CACHE_DIR=os.path.join(os.path.dirname(DB_CALC_DIR),'potcar_cache')
+# Templates identical in every calc dir are hard-linked. run.slurm is copied, it is rewritten per directory
+LINKED_TEMPLATES=['INCAR','KPOINTS','job_control.txt']
+COPIED_TEMPLATES=['run.slurm']
+# Staging is filesystem bound, so threads are enough
+MAX_WORKERS=32
+
+
+def read_poscar_elements(poscar_file):
+    """Returns the element symbols of the species line of a POSCAR."""
+    with open(poscar_file) as f:
+        lines=f.readlines()
+    return lines[5].split()
+
+def _write_bytes(data, file):
+    # Write then rename, so a concurrent reader never sees a partial file
+    tmp_file=file + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_file,'wb') as f:
+        f.write(data)
+    os.replace(tmp_file, file)
+
+def link_file(src, dst, link=True):
+    """
+    Places src at dst as a hard link, or a copy if linking is not possible (e.g. across filesystems).
+    An existing dst is replaced. Linked files share one inode, so they must be replaced, never edited in place.
+
+    Args:
+        src (str): The source file.
+        dst (str): The destination file.
+        link (bool): False always copies.
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+    tmp_file=dst + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        if not link:
+            raise OSError
+        os.link(src, tmp_file)
+    except OSError:
+        shutil.copyfile(src, tmp_file)
+    os.replace(tmp_file, dst)
+
+
+class PotcarCache:
+    def __init__(self, pseudos_dir=PSEUDOS_DIR, cache_dir=POTCAR_CACHE_DIR, fallback_sv=True):
+        """
+        Caches the POTCAR of every element and the assembled POTCAR of every element sequence,
+        so each pseudopotential file is read once no matter how many materials use it.
+        Safe to share between threads.
+
+        Args:
+            pseudos_dir (str): The pseudopotential directory, e.g. potpaw_PBE.52.
+            cache_dir (str): Where the assembled POTCARs are written.
+            fallback_sv (bool): Use the <symbol>_sv pseudopotential when <symbol> has none.
+                False raises FileNotFoundError instead.
+        """
+        self.pseudos_dir=pseudos_dir
+        self.cache_dir=cache_dir
+        self.fallback_sv=fallback_sv
+        self._elements={}
+        self._potcars={}
+        self._files={}
+        # Reentrant, potcar_file and potcar hold it while assembling from element_potcar
+        self._lock=threading.RLock()
+
+    def __len__(self):
+        return len(self._potcars)
+
+    def pseudo_file(self, symbol):
+        pseudo_file=os.path.join(self.pseudos_dir,symbol,'POTCAR')
+        if self.fallback_sv and not os.path.exists(pseudo_file):
+            pseudo_file=os.path.join(self.pseudos_dir,symbol+'_sv','POTCAR')
+        return pseudo_file
+
+    def element_potcar(self, symbol):
+        """Returns the POTCAR bytes of one element, see pseudo_file."""
+        with self._lock:
+            data=self._elements.get(symbol)
+            if data is None:
+                with open(self.pseudo_file(symbol),'rb') as f:
+                    data=f.read()
+                # The Zr_sv POTCAR of potpaw_PBE.52 has a broken element name on its fourth line
+                if symbol=='Zr_sv':
+                    lines=data.splitlines(keepends=True)
+                    lines[3]=lines[3].replace(b'r',b'Zr')
+                    data=b''.join(lines)
+                self._elements[symbol]=data
+        return data
+
+    def potcar(self, symbols):
+        """Returns the assembled POTCAR bytes of an element sequence."""
+        key=tuple(symbols)
+        with self._lock:
+            data=self._potcars.get(key)
+            if data is None:
+                data=b''.join(self.element_potcar(symbol) for symbol in key)
+                self._potcars[key]=data
+        return data
+
+    def potcar_file(self, symbols):
+        """Returns the cache file holding the assembled POTCAR of an element sequence, writing it once."""
+        key=tuple(symbols)
+        file=self._files.get(key)
+        if file is None:
+            with self._lock:
+                file=self._files.get(key)
+                if file is None:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    file=os.path.join(self.cache_dir,'POTCAR_PBE_' + '_'.join(key))
+                    _write_bytes(self.potcar(key), file)
+                    self._files[key]=file
+        return file
+
+
+def stage_potcar_task(calc_dir, potcar_cache):
+    """
+    Writes the POTCAR of a calc dir to calc_dir/potcar/POTCAR_PBE, from the elements of calc_dir/POSCAR.
+    The local potcar directory is kept in case we have to switch pseudopotentials in future, so it is
+    a copy of the cached POTCAR, never a link that an edit in place would change for every material.
+
+    Returns:
+        str: The POTCAR file.
+    """
+    elements=read_poscar_elements(os.path.join(calc_dir,'POSCAR'))
+    potcar_dir=os.path.join(calc_dir,'potcar')
+    os.makedirs(potcar_dir, exist_ok=True)
+    potcar_file=os.path.join(potcar_dir,'POTCAR_PBE')
+    link_file(potcar_cache.potcar_file(elements), potcar_file, link=False)
+    return potcar_file
+
+def stage_calc_dir_task(calc_dir, potcar_cache, template_dir=CHARGEMOL_FILE_DIR, subdir=CALC_SUBDIR,
+                        templates=None, link=True):
+    """
+    Stages one calculation, calc_dir/<subdir> with the INCAR, KPOINTS, POTCAR, POSCAR, job_control.txt
+    and run.slurm files. The POTCAR is the material's calc_dir/potcar/POTCAR_PBE, which is only
+    assembled from the POSCAR elements when it is missing, so a switched pseudopotential is kept.
+
+    Args:
+        calc_dir (str): The material calc dir, holding the POSCAR.
+        potcar_cache (PotcarCache): The shared POTCAR cache.
+        template_dir (str): The directory of the template files.
+        subdir (str): The calculation directory inside calc_dir.
+        templates (dict): Optional, the template files already read, used for the copied templates.
+        link (bool): Hard-link identical files instead of copying them.
+
+    Returns:
+        bool: True if the directory was staged.
+    """
+    mpid=calc_dir.split(os.sep)[-1]
+    try:
+        potcar_file=os.path.join(calc_dir,'potcar','POTCAR_PBE')
+        if not os.path.exists(potcar_file):
+            potcar_file=stage_potcar_task(calc_dir, potcar_cache)
+
+        stage_dir=os.path.join(calc_dir,subdir)
+        os.makedirs(stage_dir, exist_ok=True)
+        for name in LINKED_TEMPLATES:
+            link_file(os.path.join(template_dir,name), os.path.join(stage_dir,name), link=link)
+        for name in COPIED_TEMPLATES:
+            if templates is not None and name in templates:
+                _write_bytes(templates[name], os.path.join(stage_dir,name))
+            else:
+                link_file(os.path.join(template_dir,name), os.path.join(stage_dir,name), link=False)
+        link_file(potcar_file, os.path.join(stage_dir,'POTCAR'), link=link)
+        link_file(os.path.join(calc_dir,'POSCAR'), os.path.join(stage_dir,'POSCAR'), link=link)
+        return True
+    except Exception as e:
+        LOGGER.error(f"Error processing file {mpid}: {e}")
+        return False
+
+@timeit
+def stage_calc_dirs(calc_dirs=None, template_dir=CHARGEMOL_FILE_DIR, subdir=CALC_SUBDIR, pseudos_dir=PSEUDOS_DIR,
+                    cache_dir=POTCAR_CACHE_DIR, link=True, max_workers=MAX_WORKERS):
+    """
+    Stages the calculation directories of the database from a thread pool. Missing POTCARs are
+    assembled once per element sequence, and templates identical across directories are hard-linked.
+
+    Args:
+        calc_dirs (list): Optional, the material calc dirs. Defaults to every mp-* dir in DB_CALC_DIR.
+        template_dir (str): The directory of the template files.
+        subdir (str): The calculation directory inside each calc dir.
+        pseudos_dir (str): The pseudopotential directory.
+        cache_dir (str): Where the assembled POTCARs are written.
+        link (bool): Hard-link identical files instead of copying them.
+        max_workers (int): Number of threads.
+
+    Returns:
+        list: True for every staged directory, in the order of calc_dirs.
+    """
+    if calc_dirs is None:
+        calc_dirs=sorted(glob(DB_CALC_DIR + os.sep + 'mp-*'))
+
+    LOGGER.info('#'*100)
+    LOGGER.info(f"Staging {len(calc_dirs)} {subdir} calculation directories")
+    LOGGER.info('#'*100)
+
+    templates={}
+    for name in COPIED_TEMPLATES:
+        with open(os.path.join(template_dir,name),'rb') as f:
+            templates[name]=f.read()
+
+    potcar_cache=PotcarCache(pseudos_dir=pseudos_dir, cache_dir=cache_dir)
+    task=partial(stage_calc_dir_task, potcar_cache=potcar_cache, template_dir=template_dir,
+                 subdir=subdir, templates=templates, link=link)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results=list(executor.map(task, calc_dirs))
+
+    LOGGER.info(f"Staged {sum(results)}/{len(calc_dirs)} directories, {len(potcar_cache)} missing POTCARs assembled")
+    return results
+
+
+if __name__=='__main__':
+    stage_calc_dirs()
@@ -0,0 +1,219 @@
+import os
+import time
+import sqlite3
+import subprocess
+from contextlib import closing
+
+from matgraphdb.utils import DB_CALC_DIR, LOGGER
+
+STAGES=('staged','submitted','running','done','failed','parsed')
+# The calculation directory inside each calc dir, staged by generate_chargemol or chargemol_calc_setup
+# and run by the job arrays. Staging, launch, parse and status checks all use this one directory, in one database
+CALC_SUBDIR='chargemol'
+# Stages with a finished chargemol calculation
+FINISHED_STAGES=('done','parsed')
+# Written by chargemol when a calculation finished
+BOND_ORDER_FILE='DDEC6_even_tempered_bond_orders.xyz'
+# Files showing a calculation was run, written by vasp and chargemol
+RUN_FILES=('OSZICAR','OUTCAR','chargemol_debug.txt')
+
+SCHEMA="""
+CREATE TABLE IF NOT EXISTS calcs (
+    mpid TEXT PRIMARY KEY,
+    calc_dir TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    job_id TEXT,
+    updated REAL,
+    dir_mtime_ns INTEGER,
+    has_wavecar INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS calcs_stage ON calcs (stage);
+"""
+
+
+def active_slurm_jobs(user=None):
+    """
+    Returns the ids of the jobs of a user still pending or running, array tasks reduced to their array job id.
+    """
+    user=user or os.environ.get('USER')
+    result=subprocess.run(['squeue','-h','-u',user,'-o','%i'], capture_output=True, text=True, check=True)
+    return {line.split('_')[0] for line in result.stdout.split()}
+
+
+class CalcTracker:
+    def __init__(self, calc_path=DB_CALC_DIR, subdir=CALC_SUBDIR, db_file=None):
+        """
+        Records the stage of every calculation in a SQLite database, so status queries,
+        relaunch lists and cleanups do not walk the calculation directories.
+
+        The launch step marks calculations submitted and the parse step marks them parsed.
+        reconcile picks up what happened on disk in between.
+
+        Args:
+            calc_path (str): The directory holding the mp-* calc dirs.
+            subdir (str): The calculation directory inside each calc dir. Defaults to CALC_SUBDIR.
+            db_file (str): Optional, the database file. Defaults to <subdir>_calc_state.sqlite next to calc_path.
+        """
+        self.calc_path=calc_path
+        self.subdir=subdir
+        if db_file is None:
+            db_file=os.path.join(os.path.dirname(os.path.normpath(calc_path)), f'{subdir}_calc_state.sqlite')
+        self.db_file=db_file
+        with closing(self._connect()) as connection, connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        # Launch, parse and reconcile may run at the same time, so writers wait for the lock
+        return sqlite3.connect(self.db_file, timeout=60)
+
+    def _mpid(self, calc_dir):
+        calc_dir=os.path.normpath(calc_dir)
+        if os.path.basename(calc_dir)==self.subdir:
+            calc_dir=os.path.dirname(calc_dir)
+        return os.path.basename(calc_dir)
+
+    def set_stage(self, calc_dirs, stage, job_id=None):
+        """
+        Sets the stage of calculations.
+
+        Args:
+            calc_dirs (list): The calc dirs, their calculation directories or mpids.
+            stage (str): One of STAGES.
+            job_id (str): Optional, the job running the calculations.
+        """
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage {stage}, expected one of {STAGES}")
+        now=time.time()
+        rows=[]
+        for calc_dir in calc_dirs:
+            mpid=self._mpid(calc_dir)
+            rows.append((mpid, os.path.join(self.calc_path, mpid, self.subdir), stage, job_id, now))
+        with closing(self._connect()) as connection, connection:
+            connection.executemany("""
+                INSERT INTO calcs (mpid, calc_dir, stage, job_id, updated) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(mpid) DO UPDATE SET stage=excluded.stage, updated=excluded.updated,
+                    job_id=COALESCE(excluded.job_id, calcs.job_id)
+                """, rows)
+
+    def _infer_stage(self, names, previous):
+        if BOND_ORDER_FILE in names:
+            return 'parsed' if previous=='parsed' else 'done'
+        if previous in ('submitted','running'):
+            return 'running' if any(name in names for name in RUN_FILES) else previous
+        if previous=='failed' or any(name in names for name in RUN_FILES):
+            # Ran before without producing bond orders
+            return 'failed'
+        return 'staged'
+
+    def reconcile(self, active_job_ids=None):
+        """
+        Updates the stages from the calculation directories. The top directory is listed with
+        os.scandir and each calculation directory is stat-ed once. Only directories whose
+        modification time changed since the last scan are listed.
+
+        Args:
+            active_job_ids (set): Optional, the job ids still queued or running, e.g. from
+                active_slurm_jobs. Submitted or running calculations of other jobs did not
+                produce bond orders and are marked failed.
+
+        Returns:
+            int: Number of calculation directories listed.
+        """
+        with closing(self._connect()) as connection:
+            known={mpid: (stage, dir_mtime_ns) for mpid, stage, dir_mtime_ns
+                   in connection.execute("SELECT mpid, stage, dir_mtime_ns FROM calcs")}
+
+        now=time.time()
+        rows=[]
+        with os.scandir(self.calc_path) as entries:
+            for entry in entries:
+                if not entry.name.startswith('mp-') or not entry.is_dir():
+                    continue
+                calc_dir=os.path.join(entry.path, self.subdir)
+                try:
+                    mtime_ns=os.stat(calc_dir).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                previous, previous_mtime_ns=known.get(entry.name, (None, None))
+                if mtime_ns==previous_mtime_ns:
+                    continue
+                with os.scandir(calc_dir) as files:
+                    names={file.name for file in files}
+                rows.append((entry.name, calc_dir, self._infer_stage(names, previous), now,
+                             mtime_ns, int('WAVECAR' in names)))
+
+        with closing(self._connect()) as connection, connection:
+            connection.executemany("""
+                INSERT INTO calcs (mpid, calc_dir, stage, updated, dir_mtime_ns, has_wavecar) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(mpid) DO UPDATE SET stage=excluded.stage, updated=excluded.updated,
+                    dir_mtime_ns=excluded.dir_mtime_ns, has_wavecar=excluded.has_wavecar
+                """, rows)
+            if active_job_ids is not None:
+                active_job_ids=[str(job_id) for job_id in active_job_ids]
+                connection.execute(f"""
+                    UPDATE calcs SET stage='failed', updated=?
+                    WHERE stage IN ('submitted','running')
+                    AND (job_id IS NULL OR job_id NOT IN ({','.join('?'*len(active_job_ids))}))
+                    """, [now, *active_job_ids])
+
+        LOGGER.info(f"Reconciled {self.calc_path}: {len(rows)} changed calculation directories")
+        return len(rows)
+
+    def counts(self):
+        """Returns the number of calculations in each stage."""
+        with closing(self._connect()) as connection:
+            counts=dict(connection.execute("SELECT stage, COUNT(*) FROM calcs GROUP BY stage"))
+        return {stage: counts.get(stage, 0) for stage in STAGES}
+
+    def report(self):
+        counts=self.counts()
+        LOGGER.info(f"Calculations in {self.calc_path}: " + ', '.join(f"{stage} {n}" for stage, n in counts.items()))
+        return counts
+
+    def calc_dirs(self, stages=STAGES):
+        """Returns the calculation directories in the given stages, sorted by mpid."""
+        with closing(self._connect()) as connection:
+            rows=connection.execute(f"SELECT calc_dir FROM calcs WHERE stage IN ({','.join('?'*len(stages))}) ORDER BY mpid",
+                                    list(stages)).fetchall()
+        return [row[0] for row in rows]
+
+    def relaunch_list(self, stages=('staged','failed')):
+        """Returns the calculation directories to launch, those not run yet or failed."""
+        return self.calc_dirs(stages)
+
+    def remove_wavecars(self, stages=FINISHED_STAGES):
+        """
+        Removes the WAVECAR files of the calculations in the given stages, as recorded by the last reconcile.
+
+        Returns:
+            int: Number of files removed.
+        """
+        with closing(self._connect()) as connection:
+            calc_dirs=[row[0] for row in connection.execute(
+                f"SELECT calc_dir FROM calcs WHERE has_wavecar=1 AND stage IN ({','.join('?'*len(stages))})", list(stages))]
+
+        rows=[]
+        n_removed=0
+        for calc_dir in calc_dirs:
+            try:
+                os.remove(os.path.join(calc_dir,'WAVECAR'))
+                n_removed+=1
+            except FileNotFoundError:
+                pass
+            # Removing the file changed the directory, record it so the next reconcile does not list it again
+            try:
+                mtime_ns=os.stat(calc_dir).st_mtime_ns
+            except FileNotFoundError:
+                mtime_ns=None
+            rows.append((mtime_ns, calc_dir))
+
+        with closing(self._connect()) as connection, connection:
+            connection.executemany("UPDATE calcs SET has_wavecar=0, dir_mtime_ns=? WHERE calc_dir=?", rows)
+        LOGGER.info(f"Removed {n_removed} WAVECAR files")
+        return n_removed
+
+
+if __name__=='__main__':
+    tracker=CalcTracker()
+    tracker.reconcile()
+    tracker.report()
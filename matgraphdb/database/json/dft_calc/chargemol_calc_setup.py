@@ -2,120 +2,78 @@ import os
 import json
 import shutil
 from glob import glob
-
-from matgraphdb.utils import MP_DIR,DB_CALC_DIR
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from matgraphdb.utils import MP_DIR,DB_CALC_DIR,LOGGER
+from matgraphdb.database.json.dft_calc.calc_dir_builder import PotcarCache, link_file, PSEUDOS_DIR, MAX_WORKERS
+from matgraphdb.database.json.dft_calc.calc_tracker import CALC_SUBDIR
+
+def stage_template_task(calc_dir, template_file, backup_name=None, link=True):
+    scf_dir=os.path.join(calc_dir,CALC_SUBDIR)
+    file=os.path.join(scf_dir,os.path.basename(template_file))
+
+    mpid=calc_dir.split(os.sep)[-1]
+
+    # Rename existing file, e.g. INCAR to INCAR_old
+    backup_file=None
+    if backup_name is not None and os.path.exists(file):
+        backup_file=os.path.join(scf_dir,backup_name)
+        os.rename(file, backup_file)
+
+    try:
+        link_file(template_file, file, link=link)
+    except OSError as e:
+        LOGGER.error(f"Error processing file {mpid}: {e}")
+        # Put the previous file back, so the dir is not left without it
+        if backup_file is not None:
+            os.rename(backup_file, file)
+
+def stage_template(calc_dirs, template_file, backup_name=None, link=True, max_workers=MAX_WORKERS):
+    task=partial(stage_template_task, template_file=template_file, backup_name=backup_name, link=link)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(task, calc_dirs))
 
 def generate_batch_scripts(calc_dirs,calc_file_dir):
-    for calc_dir in calc_dirs[:]:
-        scf_dir=os.path.join(calc_dir,'static')
-
-        if os.path.exists(os.path.join(scf_dir,'run.slurm')):
-            os.remove(os.path.join(scf_dir,'run.slurm'))
-
-        try:
-            shutil.copy(os.path.join(calc_file_dir,'run.slurm'), os.path.join(scf_dir,'run.slurm'))
-        except:
-            pass
-
-def generate_potcar(calc_dirs,pseudos_dir):
-
-    for calc_dir in calc_dirs[:]:
-        scf_dir=os.path.join(calc_dir,'static')
-        potcar_file=os.path.join(scf_dir,'POTCAR')
-        incomplete_dir=os.path.dirname(os.path.dirname(calc_dir))
-        incomplete_dir=os.path.join(incomplete_dir,'incomplete_database')
-
-        # # Remove pre-existing potcar file
-        if os.path.exists(potcar_file):
-            os.remove(potcar_file)
-
-        try:
-            with open(os.path.join(scf_dir,'POTCAR_files.json'),'r') as f:
-                data = json.load(f)
-            functional=data['functional']
-            symbols=data['symbols']
-            tmp_potcar=''
-
-            # Loop through element symbols
-            for symbol in symbols:
-                pseudo_file=os.path.join(pseudos_dir,symbol,'POTCAR')
-
-                # open pseudo file and add it to potcar string
-                if symbol=='Zr_sv':
-                    with open(pseudo_file,'r') as f:
-                        lines=f.readlines()
-                        new_line=lines[3].replace('r','Zr')
-                        lines[3]=new_line
-                        tmp_text=''.join(lines)
-                        tmp_potcar+=tmp_text
-                        tmp_potcar+=''
-                else:
-                    with open(pseudo_file,'r') as f:
-                        tmp_potcar+=f.read()
-                        tmp_potcar+=''
-
-            # Save file in new POTCAR file
-            with open(potcar_file,'w') as potcar:
-                potcar.write(tmp_potcar)
-
-        except Exception as e:
-            shutil.move(calc_dir, incomplete_dir)
-            print(e)
-            pass
+    # Copied, not linked, since run.slurm is rewritten per directory
+    stage_template(calc_dirs, os.path.join(calc_file_dir,'run.slurm'), link=False)
+
+def generate_potcar_task(calc_dir, potcar_cache):
+    scf_dir=os.path.join(calc_dir,CALC_SUBDIR)
+    potcar_file=os.path.join(scf_dir,'POTCAR')
+    incomplete_dir=os.path.dirname(os.path.dirname(calc_dir))
+    incomplete_dir=os.path.join(incomplete_dir,'incomplete_database')
+
+    try:
+        with open(os.path.join(scf_dir,'POTCAR_files.json'),'r') as f:
+            data = json.load(f)
+        functional=data['functional']
+        symbols=data['symbols']
+
+        # Replaces any pre-existing potcar file with the assembled POTCAR of the symbols
+        link_file(potcar_cache.potcar_file(symbols), potcar_file)
+
+    except Exception as e:
+        shutil.move(calc_dir, incomplete_dir)
+        print(e)
+        pass
+
+def generate_potcar(calc_dirs,pseudos_dir,max_workers=MAX_WORKERS):
+    # Each pseudopotential is read once and each element sequence assembled once.
+    # The symbols come from the Materials Project inputs, a missing pseudopotential moves the dir
+    # to incomplete_database instead of falling back to <symbol>_sv
+    potcar_cache=PotcarCache(pseudos_dir=pseudos_dir, fallback_sv=False)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(partial(generate_potcar_task, potcar_cache=potcar_cache), calc_dirs))
 
 def generate_incar(calc_dirs,calc_file_dir):
-    template_incar_file=os.path.join(calc_file_dir,'INCAR')
-
-    for calc_dir in calc_dirs[:]:
-        scf_dir=os.path.join(calc_dir,'static')
-        incar_file=os.path.join(scf_dir,'INCAR')
-
-        
-        # Rename existing INCAR file to INCAR_old
-        incar_old_file=os.path.join(scf_dir,'INCAR_old')
-        if os.path.exists(incar_file):
-            os.rename(incar_file, incar_old_file)
-
-        # Copy template INCAR file to calc dir
-        try:
-            shutil.copy(template_incar_file, incar_file)
-        except:
-            pass
-    
+    stage_template(calc_dirs, os.path.join(calc_file_dir,'INCAR'), backup_name='INCAR_old')
 
 def generate_kpoints(calc_dirs,calc_file_dir):
-    template_incar_file=os.path.join(calc_file_dir,'KPOINTS')
-
-    for calc_dir in calc_dirs[:]:
-        scf_dir=os.path.join(calc_dir,'static')
-        incar_file=os.path.join(scf_dir,'KPOINTS')
-
-        # Rename existing INCAR file to INCAR_old
-        incar_old_file=os.path.join(scf_dir,'KPOINTS_old')
-        if os.path.exists(incar_file):
-            os.rename(incar_file, incar_old_file)
-
-        # Copy template INCAR file to calc dir
-        try:
-            shutil.copy(template_incar_file, incar_file)
-        except:
-            pass
+    stage_template(calc_dirs, os.path.join(calc_file_dir,'KPOINTS'), backup_name='KPOINTS_old')
 
 def generate_job_control(calc_dirs,calc_file_dir):
-    template_file=os.path.join(calc_file_dir,'job_control.txt')
-
-    for calc_dir in calc_dirs[:]:
-        scf_dir=os.path.join(calc_dir,'static')
-        copy_file=os.path.join(scf_dir,'job_control.txt')
-
-        # # Remove pre-existing potcar file
-        if os.path.exists(copy_file):
-            os.remove(copy_file)
-
-        try:
-            shutil.copy(template_file, copy_file)
-        except:
-            pass
+    stage_template(calc_dirs, os.path.join(calc_file_dir,'job_control.txt'))
 
         
 
@@ -123,7 +81,7 @@ def chargemol_calc_setup():
     calc_file_dir=os.path.join(MP_DIR,'calculations','calculation_files','chargemol')
     calc_dirs=glob(DB_CALC_DIR + '/mp-*') 
 
-    pseudos_dir=os.path.join("/users/lllang/SCRATCH",'PP_Vasp','potpaw_PBE.52')
+    pseudos_dir=PSEUDOS_DIR
 
     calc_dir=os.path.join(MP_DIR,'calculations','database')
     print(len(os.listdir(calc_dir)))
@@ -139,4 +97,4 @@ def chargemol_calc_setup():
     
 
 if __name__=='__main__':
-    chargemol_calc_setup()
\ No newline at end of file
+    chargemol_calc_setup()
@@ -1,28 +1,22 @@
 import os 
 import shutil
-from glob import glob
 
-from matgraphdb.utils import LOG_DIR,MP_DIR,DB_CALC_DIR
+from matgraphdb.utils import LOG_DIR,DB_CALC_DIR
+from matgraphdb.database.json.dft_calc.calc_tracker import CalcTracker, STAGES, FINISHED_STAGES
 
 
 def check_chargmol_calcs():
-    calc_file_dir=os.path.join(MP_DIR,'calculations','calculation_files','chargemol')
-    calc_dirs=glob(DB_CALC_DIR + '/mp-*') 
-
     print(f'Checking calcs located : {DB_CALC_DIR}')
-    failed_calcs=[]
-    successful_calcs=[]
-    for calc_dir in calc_dirs:
-
-        mpid=calc_dir.split(os.sep)[-1]
-        scf_dir=os.path.join(calc_dir,'static')
 
-        bond_order_file=os.path.join(scf_dir,'DDEC6_even_tempered_bond_orders.xyz')
+    # Only lists the calculation directories changed since the last check
+    tracker=CalcTracker(calc_path=DB_CALC_DIR)
+    tracker.reconcile()
+    tracker.report()
 
-        if not os.path.exists(bond_order_file):
-            failed_calcs.append(mpid)
-        else:
-            successful_calcs.append(mpid)
+    failed_calcs=[os.path.basename(os.path.dirname(calc_dir)) 
+                  for calc_dir in tracker.calc_dirs(stages=[stage for stage in STAGES if stage not in FINISHED_STAGES])]
+    successful_calcs=[os.path.basename(os.path.dirname(calc_dir)) 
+                      for calc_dir in tracker.calc_dirs(stages=FINISHED_STAGES)]
 
     log_dir=os.path.join(LOG_DIR,'calculations','chargemol','nelements_3')
 
@@ -41,4 +35,4 @@ def check_chargmol_calcs():
 
 
 if __name__=='__main__':
-    check_chargmol_calcs()
\ No newline at end of file
+    check_chargmol_calcs()
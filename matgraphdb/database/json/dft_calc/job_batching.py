@@ -0,0 +1,368 @@
+import os
+import json
+import math
+import heapq
+import subprocess
+from datetime import datetime
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from matgraphdb.utils import MP_DIR, LOGGER
+from matgraphdb.database.json.dft_calc.calc_dir_builder import MAX_WORKERS
+from matgraphdb.database.json.dft_calc.calc_tracker import CALC_SUBDIR
+
+BATCH_DIR=os.path.join(MP_DIR,'calculations','batches')
+MANIFEST_FILE='manifest.json'
+# Estimated wall time in seconds per unit of cost (n_kpoints * nsites**2) on one task of the partition.
+# A rough value for 16 cores, fit it to finished calculations with calibrate_seconds_per_cost
+SECONDS_PER_COST=0.1
+# Fraction of the partition time limit a batch is planned to fill, the rest is a safety margin
+TIME_FILL=0.75
+# Slurm rejects array indices above MaxArraySize, 1001 by default
+MAX_ARRAY_SIZE=1000
+# Number of array tasks allowed to run at once, the %N of --array
+MAX_CONCURRENT_TASKS=200
+# Written by chargemol when a calculation finished
+BOND_ORDER_FILE='DDEC6_even_tempered_bond_orders.xyz'
+SETUP_COMMANDS=['source ~/.bashrc',
+                'module load atomistic/vasp/6.2.1_intel22_impi22',
+                'export NUM_CORES=$((SLURM_JOB_NUM_NODES * SLURM_CPUS_ON_NODE))']
+CHARGEMOL_COMMANDS=['mpirun -np $NUM_CORES vasp_std',
+                    'export OMP_NUM_THREADS=$NUM_CORES',
+                    '~/SCRATCH/Codes/chargemol_09_26_2017/chargemol_FORTRAN_09_26_2017/compiled_binaries'
+                    '/linux/Chargemol_09_26_2017_linux_parallel> chargemol_debug.txt 2>&1']
+
+
+def read_poscar(poscar_file):
+    """Returns the lattice matrix and the number of sites of a POSCAR."""
+    with open(poscar_file) as f:
+        lines=f.readlines()
+    scale=abs(float(lines[1].split()[0]))
+    lattice=scale*np.array([[float(x) for x in line.split()[:3]] for line in lines[2:5]])
+    nsites=sum(int(x) for x in lines[6].split())
+    return lattice, nsites
+
+def read_kpoints(kpoints_file, lattice):
+    """
+    Returns the number of k-points of a KPOINTS file, before symmetry reduction.
+    Handles explicit lists, Gamma/Monkhorst-Pack grids and fully automatic (length) grids.
+    """
+    with open(kpoints_file) as f:
+        lines=f.readlines()
+    n_kpoints=int(lines[1].split()[0])
+    if n_kpoints > 0:
+        return n_kpoints
+
+    mode=lines[2].strip()[:1].lower()
+    if mode=='a':
+        length=float(lines[3].split()[0])
+        reciprocal_lengths=np.linalg.norm(np.linalg.inv(lattice).T, axis=1)
+        grid=[max(1, int(length*b + 0.5)) for b in reciprocal_lengths]
+    else:
+        grid=[int(x) for x in lines[3].split()[:3]]
+    return int(np.prod(grid))
+
+def estimate_cost_task(calc_dir):
+    """
+    Estimates the relative cost of the calculation in calc_dir as n_kpoints * nsites**2.
+    The number of plane waves and of bands both grow with the number of sites, so the cost
+    per k-point grows at least quadratically.
+
+    Returns:
+        float: The cost, None if the POSCAR or KPOINTS could not be read.
+    """
+    mpid=calc_dir.split(os.sep)[-2] if os.path.basename(calc_dir)==CALC_SUBDIR else calc_dir.split(os.sep)[-1]
+    try:
+        lattice, nsites=read_poscar(os.path.join(calc_dir,'POSCAR'))
+        n_kpoints=read_kpoints(os.path.join(calc_dir,'KPOINTS'), lattice)
+        return float(n_kpoints*nsites**2)
+    except Exception as e:
+        LOGGER.error(f"Error processing file {mpid}: {e}")
+        return None
+
+def pack_batches(costs, n_batches):
+    """
+    Packs items into n_batches of balanced total cost, longest processing time first.
+    Each item goes to the batch with the lowest total cost so far.
+
+    Args:
+        costs (list): The cost of each item.
+        n_batches (int): The number of batches.
+
+    Returns:
+        list: The item indices of each batch, in descending cost.
+    """
+    n_batches=max(1, min(n_batches, len(costs)))
+    heap=[(0.0, i_batch) for i_batch in range(n_batches)]
+    batches=[[] for _ in range(n_batches)]
+    for i in sorted(range(len(costs)), key=lambda i: -costs[i]):
+        total, i_batch=heapq.heappop(heap)
+        batches[i_batch].append(i)
+        heapq.heappush(heap, (total + costs[i], i_batch))
+    return [batch for batch in batches if batch]
+
+def pack_batches_by_budget(costs, budget):
+    """
+    Packs items into the fewest balanced batches (see pack_batches) whose total cost stays
+    within budget. Items costing more than the budget get a batch of their own.
+
+    Args:
+        costs (list): The cost of each item.
+        budget (float): The maximum total cost of a batch.
+
+    Returns:
+        list: The item indices of each batch.
+    """
+    oversized=[[i] for i in range(len(costs)) if costs[i] > budget]
+    rest=[i for i in range(len(costs)) if costs[i] <= budget]
+    if not rest:
+        return oversized
+
+    rest_costs=[costs[i] for i in rest]
+    n_batches=max(1, math.ceil(sum(rest_costs) / budget))
+    while True:
+        batches=pack_batches(rest_costs, n_batches)
+        if all(sum(rest_costs[i] for i in batch) <= budget for batch in batches):
+            return oversized + [[rest[i] for i in batch] for batch in batches]
+        n_batches=max(n_batches + 1, math.ceil(n_batches*1.05))
+
+def parse_time_limit(time_limit):
+    """Returns the seconds of a slurm time limit, e.g. '24:00:00', '1-12:00:00' or '90'."""
+    days=0
+    if '-' in time_limit:
+        days, time_limit=time_limit.split('-')
+        days=int(days)
+    fields=[int(x) for x in time_limit.split(':')]
+    if len(fields)==1:
+        # Minutes only, except after a day count where it is hours
+        seconds=fields[0]*3600 if days else fields[0]*60
+    elif len(fields)==2:
+        seconds=fields[0]*3600 + fields[1]*60 if days else fields[0]*60 + fields[1]
+    else:
+        seconds=fields[0]*3600 + fields[1]*60 + fields[2]
+    return days*86400 + seconds
+
+def calibrate_seconds_per_cost(calc_dirs):
+    """
+    Fits SECONDS_PER_COST to finished calculations, the median of the vasp elapsed time
+    (from the OUTCAR) over the estimated cost.
+
+    Returns:
+        float: The seconds per unit of cost, None if no calculation had both.
+    """
+    ratios=[]
+    for calc_dir in calc_dirs:
+        cost=estimate_cost_task(calc_dir)
+        outcar=os.path.join(calc_dir,'OUTCAR')
+        if not cost or not os.path.exists(outcar):
+            continue
+        with open(outcar) as f:
+            for line in f:
+                if 'Elapsed time (sec):' in line:
+                    ratios.append(float(line.split(':')[1])/cost)
+                    break
+    return float(np.median(ratios)) if ratios else None
+
+def _batch_file(batch_dir, task_id):
+    return os.path.join(batch_dir, f'batch_{task_id:05d}.txt')
+
+def array_script(batch_dir, first_task, n_tasks, partition_info=('comm_small_day','24:00:00','16', '1'),
+                 max_concurrent=MAX_CONCURRENT_TASKS, setup_commands=SETUP_COMMANDS, commands=CHARGEMOL_COMMANDS,
+                 done_file=BOND_ORDER_FILE):
+    """
+    Returns a slurm job array script. Task i runs every calculation listed in batch_<first_task + i>.txt,
+    one after the other, skipping those that already wrote done_file.
+    """
+    lines=['#!/bin/bash',
+           '#SBATCH -J mp_database_chargemol',
+           f'#SBATCH --nodes={partition_info[3]}',
+           f'#SBATCH -c {partition_info[2]}',
+           f'#SBATCH -p {partition_info[0]}',
+           f'#SBATCH -t {partition_info[1]}',
+           f'#SBATCH --array=0-{n_tasks - 1}%{max_concurrent}',
+           f'#SBATCH --output={batch_dir}/logs/jobOutput_%A_%a.out',
+           f'#SBATCH --error={batch_dir}/logs/jobError_%A_%a.err',
+           '']
+    lines.extend(setup_commands)
+    lines.extend(['',
+                  f'TASK_ID=$((SLURM_ARRAY_TASK_ID + {first_task}))',
+                  f'BATCH_FILE={batch_dir}/batch_$(printf %05d $TASK_ID).txt',
+                  # Read the list up front, mpirun would otherwise consume the loop's stdin
+                  'mapfile -t CALC_DIRS < "$BATCH_FILE"',
+                  'for CALC_DIR in "${CALC_DIRS[@]}"; do',
+                  f'    if [ -f "$CALC_DIR/{done_file}" ]; then',
+                  '        continue',
+                  '    fi',
+                  '    cd "$CALC_DIR" || continue',
+                  '    echo "CALC_DIR: $CALC_DIR"',
+                  '    echo "NCORES: $((NUM_CORES))"'])
+    lines.extend('    ' + command for command in commands)
+    lines.extend(['done',
+                  '',
+                  'echo "run complete on `hostname`: `date`" 1>&2',
+                  ''])
+    return '\n'.join(lines)
+
+def write_job_arrays(calc_dirs, name=None, batch_root=BATCH_DIR, seconds_per_cost=SECONDS_PER_COST, time_fill=TIME_FILL,
+                     max_array_size=MAX_ARRAY_SIZE, partition_info=('comm_small_day','24:00:00','16', '1'),
+                     max_concurrent=MAX_CONCURRENT_TASKS, setup_commands=SETUP_COMMANDS,
+                     commands=CHARGEMOL_COMMANDS, max_workers=MAX_WORKERS):
+    """
+    Packs calculations into slurm job arrays instead of one job per calculation.
+
+    The cost of each calculation is estimated from its POSCAR and KPOINTS and converted to
+    seconds with seconds_per_cost. The calculations are packed into the fewest batches of
+    balanced total cost whose estimated time fits in time_fill of the partition time limit,
+    so a task is not killed partway through its list. Calculations estimated longer than
+    that run alone, and are logged. Every batch is one array task. Arrays hold at most
+    max_array_size tasks. The batches, their costs and estimated times and the array
+    scripts are recorded in batch_root/<name>/manifest.json.
+
+    Args:
+        calc_dirs (list): The calculation directories, e.g. the failed chargemol dirs.
+        name (str): Optional, the batch directory name. Defaults to a timestamp.
+        batch_root (str): The directory holding every batch directory.
+        seconds_per_cost (float): Estimated wall time per unit of cost, see calibrate_seconds_per_cost.
+        time_fill (float): Fraction of the partition time limit a batch may fill.
+        max_array_size (int): Maximum number of tasks per array.
+        partition_info (tuple): (partition, time, cpus per task, nodes), as in add_chargemol_slurm_script.
+        max_concurrent (int): Maximum number of tasks of an array running at once.
+        setup_commands (list): Shell commands run once per task, before the calculations.
+        commands (list): Shell commands run in each calculation directory.
+        max_workers (int): Number of threads estimating the costs.
+
+    Returns:
+        dict: The manifest.
+    """
+    if name is None:
+        name=datetime.now().strftime('%Y%m%d_%H%M%S')
+    batch_dir=os.path.join(batch_root, name)
+    os.makedirs(os.path.join(batch_dir,'logs'), exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        costs=list(executor.map(estimate_cost_task, calc_dirs))
+    # Unreadable calculations are still launched, with the median cost
+    known_costs=[cost for cost in costs if cost is not None]
+    default_cost=float(np.median(known_costs)) if known_costs else 1.0
+    costs=[default_cost if cost is None else cost for cost in costs]
+
+    time_limit=parse_time_limit(partition_info[1])
+    budget=time_fill*time_limit/seconds_per_cost
+    for calc_dir, cost in zip(calc_dirs, costs):
+        if cost*seconds_per_cost > time_limit:
+            LOGGER.warning(f"{calc_dir} is estimated at {cost*seconds_per_cost:.0f}s, over the {partition_info[1]} time limit")
+
+    batches=[]
+    for task_id, indices in enumerate(pack_batches_by_budget(costs, budget)):
+        batch_calc_dirs=[calc_dirs[i] for i in indices]
+        with open(_batch_file(batch_dir, task_id),'w') as f:
+            f.write('\n'.join(batch_calc_dirs) + '\n')
+        cost=sum(costs[i] for i in indices)
+        batches.append({'task_id': task_id,
+                        'calc_dirs': batch_calc_dirs,
+                        'cost': cost,
+                        'estimated_seconds': cost*seconds_per_cost})
+
+    arrays=[]
+    for i_array, first_task in enumerate(range(0, len(batches), max_array_size)):
+        n_tasks=min(max_array_size, len(batches) - first_task)
+        script=os.path.join(batch_dir, f'array_{i_array:03d}.slurm')
+        with open(script,'w') as f:
+            f.write(array_script(batch_dir, first_task, n_tasks, partition_info=partition_info,
+                                 max_concurrent=max_concurrent, setup_commands=setup_commands, commands=commands))
+        arrays.append({'array': i_array, 'script': script, 'first_task': first_task,
+                       'n_tasks': n_tasks, 'job_id': None})
+
+    manifest={'name': name,
+              'batch_dir': batch_dir,
+              'created': datetime.now().isoformat(),
+              'partition_info': list(partition_info),
+              'seconds_per_cost': seconds_per_cost,
+              'n_calcs': len(calc_dirs),
+              'batches': batches,
+              'arrays': arrays}
+    save_manifest(batch_dir, manifest)
+
+    LOGGER.info(f"Packed {len(calc_dirs)} calculations into {len(batches)} tasks in {len(arrays)} job arrays: {batch_dir}")
+    return manifest
+
+def load_manifest(batch_dir):
+    with open(os.path.join(batch_dir, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+def save_manifest(batch_dir, manifest):
+    tmp_file=os.path.join(batch_dir, MANIFEST_FILE + '.tmp')
+    with open(tmp_file,'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, os.path.join(batch_dir, MANIFEST_FILE))
+
+
+class SlurmExecutor:
+    """Submits job arrays with sbatch."""
+
+    def submit(self, script, n_tasks):
+        result=subprocess.run(['sbatch','--parsable',script], capture_output=True, text=True, check=True)
+        # --parsable prints jobid or jobid;cluster
+        return result.stdout.strip().split(';')[0]
+
+
+class LocalExecutor:
+    def __init__(self, max_workers=4, cpus_per_task=1):
+        """
+        Runs job arrays on this machine, for testing the batching without a scheduler.
+        Every array task runs the array script with bash and the SLURM_* variables it reads.
+
+        Args:
+            max_workers (int): Number of tasks running at once.
+            cpus_per_task (int): Value of SLURM_CPUS_ON_NODE.
+        """
+        self.max_workers=max_workers
+        self.cpus_per_task=cpus_per_task
+        self.returncodes={}
+        self._n_jobs=0
+
+    def _run_task(self, script, task_id):
+        env=dict(os.environ, SLURM_ARRAY_TASK_ID=str(task_id), SLURM_JOB_NUM_NODES='1',
+                 SLURM_CPUS_ON_NODE=str(self.cpus_per_task))
+        return subprocess.run(['bash', script], env=env, capture_output=True, text=True).returncode
+
+    def submit(self, script, n_tasks):
+        self._n_jobs+=1
+        job_id=f'local-{self._n_jobs}'
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            self.returncodes[job_id]=list(executor.map(partial(self._run_task, script), range(n_tasks)))
+        return job_id
+
+
+def submit_job_arrays(batch_dir, executor=None, tracker=None):
+    """
+    Submits the arrays of a batch directory not submitted yet, recording their job ids in the manifest.
+
+    Args:
+        batch_dir (str): The batch directory written by write_job_arrays.
+        executor (object): Optional, SlurmExecutor (default) or LocalExecutor.
+        tracker (CalcTracker): Optional, marks the calculations of each array submitted with its job id.
+
+    Returns:
+        list: The job ids of the submitted arrays.
+    """
+    if executor is None:
+        executor=SlurmExecutor()
+    manifest=load_manifest(batch_dir)
+    job_ids=[]
+    for array in manifest['arrays']:
+        if array['job_id'] is not None:
+            continue
+        array['job_id']=executor.submit(array['script'], array['n_tasks'])
+        array['submitted']=datetime.now().isoformat()
+        if tracker is not None:
+            batches=manifest['batches'][array['first_task']:array['first_task'] + array['n_tasks']]
+            tracker.set_stage([calc_dir for batch in batches for calc_dir in batch['calc_dirs']],
+                              'submitted', job_id=array['job_id'])
+        job_ids.append(array['job_id'])
+        # Saved after every array, so a failed submission does not resubmit the earlier ones
+        save_manifest(batch_dir, manifest)
+    LOGGER.info(f"Submitted {len(job_ids)} job arrays from {batch_dir}")
+    return job_ids
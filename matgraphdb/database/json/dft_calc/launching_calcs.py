@@ -1,29 +1,30 @@
-import os
 import subprocess
 
-from matgraphdb.database.json.manager import DatabaseManager
+from matgraphdb.database.json.dft_calc.calc_tracker import CalcTracker, active_slurm_jobs
+from matgraphdb.database.json.dft_calc.job_batching import write_job_arrays, submit_job_arrays
 
 def launch_calcs(slurm_scripts=[]):
     if slurm_scripts != []:
         for slurm_script in slurm_scripts:
             result = subprocess.run(['sbatch', slurm_script], capture_output=False, text=True)
 
-def launch_failed_chargemol_calcs():
+def launch_failed_chargemol_calcs(partition_info=('comm_small_day','24:00:00','16', '1'), executor=None):
 
-    db=DatabaseManager()
-    success,failed=db.check_chargemol()
-
-    slurm_scripts=[]
+    # Calculations not run yet or failed. Queued and running ones are left alone,
+    # those of jobs no longer in the queue without bond orders are failed
+    tracker=CalcTracker()
+    tracker.reconcile(active_job_ids=active_slurm_jobs() if executor is None else None)
+    failed=tracker.relaunch_list()
 
     print(f"About to launch {len(failed)} calculations")
-    for path in failed[:]:
-        # print(path)
-        slurm_script=os.path.join(path,'run.slurm')
-        slurm_scripts.append(slurm_script)
-        
-    launch_calcs(slurm_scripts)
+    if failed == []:
+        return []
+
+    # Packed into job arrays of several calculations per task, instead of one sbatch per calculation
+    manifest=write_job_arrays(failed, partition_info=partition_info)
+    return submit_job_arrays(manifest['batch_dir'], executor=executor, tracker=tracker)
 
 
 
 if __name__=='__main__':
-    launch_failed_chargemol_calcs()
\ No newline at end of file
+    launch_failed_chargemol_calcs()
@@ -1,23 +1,36 @@
+from matgraphdb.utils import DB_CALC_DIR
+from matgraphdb.database.json.dft_calc.calc_tracker import CalcTracker, CALC_SUBDIR, FINISHED_STAGES
 
-import os 
-import json
-import re
-import shutil
-from glob import glob
+# Calculations not queued or running, whose WAVECAR is no longer written or read
+IDLE_STAGES=('staged','done','failed','parsed')
+# Where calculations were staged before CALC_SUBDIR, the multi-GB WAVECARs the original cleanup removed
+LEGACY_SUBDIR='static'
 
-scratch_dir='/users/lllang/SCRATCH'
-root_dir=os.path.join(scratch_dir,'projects','crystal_graph') 
-database_dir=os.path.join(root_dir,'data','raw','mp_database_calcs_no_restriction')
-calc_dirs=glob(database_dir + '/mp-*')
 
+def remove_wavecar(calc_path=DB_CALC_DIR, subdir=CALC_SUBDIR, stages=FINISHED_STAGES):
+    """
+    Removes the WAVECAR files of the calculations in calc_path/mp-*/<subdir> in the given stages.
 
-for calc_dir in calc_dirs[:]:
-    print(calc_dir)
-    scf_dir=os.path.join(calc_dir,'static')
-    wavecar_file=os.path.join(scf_dir,'WAVECAR')
+    The original script removed static/WAVECAR in every calc dir. This only cleans one subdir,
+    and by default only finished calculations, so queued, running and failed runs keep theirs.
+    Pass stages=IDLE_STAGES to also clear failed and staged calculations, and subdir=LEGACY_SUBDIR
+    for calculations staged before CALC_SUBDIR.
 
-    try:
-    
-        os.remove(wavecar_file)
-    except:
-        pass
\ No newline at end of file
+    Args:
+        calc_path (str): The directory holding the mp-* calc dirs.
+        subdir (str): The calculation directory inside each calc dir.
+        stages (tuple): The stages whose WAVECAR files are removed.
+
+    Returns:
+        int: Number of files removed.
+    """
+    # The tracker records which calculations still have a WAVECAR,
+    # so only those files are removed instead of trying every directory
+    tracker=CalcTracker(calc_path=calc_path, subdir=subdir)
+    tracker.reconcile()
+    return tracker.remove_wavecars(stages=stages)
+
+
+if __name__=='__main__':
+    for subdir in (CALC_SUBDIR, LEGACY_SUBDIR):
+        remove_wavecar(subdir=subdir, stages=IDLE_STAGES)
@@ -5,6 +5,7 @@ from typing import Dict, List, Tuple
 from multiprocessing import Pool
 
 from matgraphdb.utils import DB_DIR,DB_CALC_DIR,N_CORES
+from matgraphdb.database.json.dft_calc.calc_tracker import CalcTracker, CALC_SUBDIR, STAGES, FINISHED_STAGES
 
 from functools import partial
 
@@ -66,7 +67,7 @@ class DatabaseManager:
         """Check if a given property exists in the data."""
         check=True
 
-        file_path = os.path.join(dir,'chargemol','DDEC6_even_tempered_bond_orders.xyz')
+        file_path = os.path.join(dir,CALC_SUBDIR,'DDEC6_even_tempered_bond_orders.xyz')
         
         if os.path.exists(file_path):
             check=True
@@ -76,21 +77,15 @@ class DatabaseManager:
         return check
     
     def check_chargemol(self):
-        """Check if a given property exists in all JSON files and categorize them."""
+        """Categorize the chargemol calculations into finished and not finished, from the calculation tracker."""
         
-        calc_dirs = glob(self.calculation_path + os.sep + 'mp-*')
+        tracker = CalcTracker(calc_path=self.calculation_path)
         print("Processing files from : ",self.calculation_path + os.sep + 'mp-*')
-        results=self.process_task(self.check_chargemol_task, calc_dirs)
+        # Only lists the calculation directories changed since the last check
+        tracker.reconcile()
 
-        success = []
-        failed = []
-        for path, result in zip(calc_dirs,results):
-
-            chargemol_dir=os.path.join(path,'chargemol')
-            if result==True:
-                success.append(chargemol_dir)
-            else:
-                failed.append(chargemol_dir)
+        success = tracker.calc_dirs(stages=FINISHED_STAGES)
+        failed = tracker.calc_dirs(stages=[stage for stage in STAGES if stage not in FINISHED_STAGES])
 
         return success, failed
 
@@ -101,7 +96,7 @@ class DatabaseManager:
 
         for path, result in zip(calc_dirs,results):
             if result==False:
-                chargemol_dir=os.path.join(path,'chargemol')
+                chargemol_dir=os.path.join(path,CALC_SUBDIR)
                 sumbit_script=os.path.join(chargemol_dir,'run.slurm')
                 with open(sumbit_script, 'w') as file:
                     file.write('#!/bin/bash\n')
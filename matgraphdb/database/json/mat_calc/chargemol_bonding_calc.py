@@ -7,6 +7,7 @@ import pymatgen.core as pmat
 
 from matgraphdb.database.utils import process_database
 from matgraphdb.utils import DB_DIR, DB_CALC_DIR, LOG_DIR, LOGGER
+from matgraphdb.database.json.dft_calc.calc_tracker import CalcTracker, CALC_SUBDIR
 
 
 CHARGEMOL_LOG_FILE = os.path.join(LOG_DIR,'calculations','chargemol','nelements_3','chargemol_bonding_orders_debug.txt')
@@ -16,14 +17,15 @@ BOND_ORDER_CUTOFF=0.0
 
 def chargemol_bonding_calc_task(file, from_scratch=True,lock = Lock()):
 
+    mp_id=file.split(os.sep)[-1].split('.')[0]
+    parsed=False
     try:
         with open(file) as f:
             db = json.load(f)
             struct = pmat.Structure.from_dict(db['structure'])
         
         if 'chargemol_bonding_connections' not in db or from_scratch:
-            mp_id=file.split(os.sep)[-1].split('.')[0]
-            calc_dir=os.path.join(DB_CALC_DIR,mp_id,'static')
+            calc_dir=os.path.join(DB_CALC_DIR,mp_id,CALC_SUBDIR)
             bond_order_file=os.path.join(calc_dir,'DDEC6_even_tempered_bond_orders.xyz')
 
             with open(bond_order_file,'r') as f:
@@ -61,10 +63,11 @@ def chargemol_bonding_calc_task(file, from_scratch=True,lock = Lock()):
             
             db['chargemol_bonding_connections']=bonding_connections
             db['chargemol_bonding_orders']=bonding_orders
+            parsed=True
 
 
     except Exception as e:
-        LOGGER.error(f"Error processing file {mpid}: {e}")
+        LOGGER.error(f"Error processing file {mp_id}: {e}")
 
         with lock:
             with open(CHARGEMOL_LOG_FILE, 'a') as log_file:
@@ -76,6 +79,8 @@ def chargemol_bonding_calc_task(file, from_scratch=True,lock = Lock()):
     with open(file,'w') as f:
         json.dump(db, f, indent=4)
 
+    return mp_id if parsed else None
+
 def chargemol_bonding_calc():
     LOGGER.info('#'*100)
     LOGGER.info('Running Chargemol Bonding Calculation')
@@ -84,7 +89,11 @@ def chargemol_bonding_calc():
     if os.path.exists(CHARGEMOL_LOG_FILE):
         os.remove(CHARGEMOL_LOG_FILE)
         
-    process_database(chargemol_bonding_calc_task)
+    results=process_database(chargemol_bonding_calc_task)
+
+    # Parsed calculations are recorded in the calculation tracker
+    tracker=CalcTracker(calc_path=DB_CALC_DIR)
+    tracker.set_stage([mp_id for mp_id in results if mp_id is not None], 'parsed')
 
 if __name__=='__main__':
     chargemol_bonding_calc()
@@ -1,23 +1,107 @@
 import os
 import json
 import copy
+import time
 from glob import glob
+from functools import partial
+from multiprocessing import Pool, Process
 
+import numpy as np
 import pymatgen.core as pmat
 from pymatgen.analysis.chemenv.coordination_environments.chemenv_strategies import MultiWeightsChemenvStrategy
 from pymatgen.analysis.chemenv.coordination_environments.coordination_geometry_finder import LocalGeometryFinder
 from pymatgen.analysis.chemenv.coordination_environments.structure_environments import LightStructureEnvironments
 
-from matgraphdb.utils import LOGGER,DB_DIR
-from matgraphdb.database.utils import process_database
+from matgraphdb.utils import LOGGER,DB_DIR,N_CORES
+from matgraphdb.utils.symmetry import get_stored_symmetry
 
-def chemenv_calc_task(file, from_scratch=True):
+# Radius (Angstrom) of the sphere used to estimate how many neighbors ChemEnv considers per site
+CHEMENV_COST_RADIUS = 6.0
+# Materials whose estimated cost (sites x neighbors) exceeds this go into the heavy queue
+HEAVY_CHEMENV_COST = 1.0e4
+
+def estimate_chemenv_cost(file):
+    """
+    Estimate the cost of the ChemEnv calculation for a material as the number of sites
+    times the number of neighbors expected within CHEMENV_COST_RADIUS given the atomic density.
+
+    Args:
+    file (str): Path to the JSON file containing the structure data.
+
+    Returns:
+    float: The estimated cost. Returns inf if the file could not be read.
+    """
+    try:
+        with open(file) as f:
+            db = json.load(f)
+
+        nsites = db.get('nsites') or len(db['structure']['sites'])
+
+        # density_atomic is the volume per site
+        volume_per_site = db.get('density_atomic')
+        if not volume_per_site:
+            volume_per_site = pmat.Structure.from_dict(db['structure']).volume / nsites
+
+        n_neighbors = 4.0 / 3.0 * np.pi * CHEMENV_COST_RADIUS**3 / volume_per_site
+    except Exception as e:
+        LOGGER.error(f"Error estimating ChemEnv cost for {file}: {e}")
+        return float('inf')
+    return nsites * n_neighbors
+
+def get_symmetry_site_mapping(frac_coords, symmetry):
+    """
+    Finds a representative site for each crystallographic orbit and, for every site,
+    the permutation of site indices that carries its representative onto it.
+
+    Args:
+    frac_coords (np.ndarray): Fractional coordinates of the sites (n_sites,3).
+    symmetry (dict): The symmetry dictionary from matgraphdb.utils.symmetry.
+
+    Returns:
+    tuple: (equivalent_atoms, permutations) where equivalent_atoms[i] is the index of the
+        representative of site i and permutations[i] is an array such that permutations[i][j]
+        is the image of site j under the operation mapping equivalent_atoms[i] onto i.
+    """
+    equivalent_atoms = np.array(symmetry['equivalent_atoms'])
+    rotations = np.array(symmetry['rotations'])
+    translations = np.array(symmetry['translations'])
+
+    n_sites = len(frac_coords)
+
+    # Image of every site under every symmetry operation (n_ops, n_sites, 3)
+    images = np.einsum('oij,sj->osi', rotations, frac_coords) + translations[:, None, :]
+
+    permutations = np.tile(np.arange(n_sites), (n_sites, 1))
+    op_permutations = {}
+    for i_site in range(n_sites):
+        rep = equivalent_atoms[i_site]
+        if rep == i_site:
+            continue
+
+        # Choose the first operation that sends the representative onto this site
+        diff = images[:, rep, :] - frac_coords[i_site]
+        diff -= np.round(diff)
+        i_op = int(np.argmin(np.linalg.norm(diff, axis=1)))
+
+        if i_op not in op_permutations:
+            diff = images[i_op][:, None, :] - frac_coords[None, :, :]
+            diff -= np.round(diff)
+            op_permutations[i_op] = np.argmin(np.linalg.norm(diff, axis=2), axis=1)
+
+        permutations[i_site] = op_permutations[i_op]
+
+    return equivalent_atoms, permutations
+
+
+def chemenv_calc_task(file, from_scratch=True, symmetry_reduced=False):
     """
     Calculate the chemical environment using the ChemEnv tool.
 
     Args:
     file (str): Path to the JSON file containing the structure data.
     from_scratch (bool): Whether to recompute the chemical environment.
+    symmetry_reduced (bool): Whether to compute environments only for one representative site
+        per crystallographic orbit and map the results onto the symmetry-equivalent sites.
     """
 
     # Load data from JSON file
@@ -31,22 +115,33 @@ def chemenv_calc_task(file, from_scratch=True):
     try:
         # Check if calculation is needed
         if 'coordination_environments_multi_weight' not in db or from_scratch:
+            n_sites = len(struct)
+            if symmetry_reduced:
+                symmetry = get_stored_symmetry(db)
+                equivalent_atoms, permutations = get_symmetry_site_mapping(struct.frac_coords, symmetry)
+                only_indices = sorted(set(equivalent_atoms.tolist()))
+            else:
+                equivalent_atoms, permutations = np.arange(n_sites), None
+                only_indices = None
+
             # Set up the local geometry finder
             lgf = LocalGeometryFinder()
             lgf.setup_structure(structure=struct)
 
             # Compute the structure environments
-            se = lgf.compute_structure_environments(maximum_distance_factor=1.41, only_cations=False)
+            se = lgf.compute_structure_environments(maximum_distance_factor=1.41, only_cations=False,
+                                                    only_indices=only_indices)
 
             # Define the strategy for environment calculation
             strategy = MultiWeightsChemenvStrategy.stats_article_weights_parameters()
             lse = LightStructureEnvironments.from_structure_environments(strategy=strategy, structure_environments=se)
 
-            # Get a list of possible coordination environments per site
-            coordination_environments = copy.copy(lse.coordination_environments)
+            # Get a list of possible coordination environments per site.
+            # Equivalent sites share the environment of their representative
+            coordination_environments = [copy.deepcopy(lse.coordination_environments[rep]) for rep in equivalent_atoms]
 
             # Replace empty environments with default value
-            for i, env in enumerate(lse.coordination_environments):
+            for i, env in enumerate(coordination_environments):
                 if env is None or env==[]:
                     coordination_environments[i] = [{'ce_symbol': 'S:1', 'ce_fraction': 1.0, 'csm': 0.0, 'permutation': [0]}]
 
@@ -60,14 +155,19 @@ def chemenv_calc_task(file, from_scratch=True):
             
             # Determine nearest neighbors
             nearest_neighbors = []
-            for i_site, neighbors in enumerate(lse.neighbors_sets):
+            for i_site, rep in enumerate(equivalent_atoms):
+                neighbors = lse.neighbors_sets[rep]
 
                 neighbor_index = []
-                if neighbors!=[]:
+                if neighbors:
                     neighbors = neighbors[0]
                     for neighbor_site in neighbors.neighb_sites_and_indices:
                         index = neighbor_site['index']
                         neighbor_index.append(index)
+
+                    # Permute the representative's neighbors onto this site
+                    if permutations is not None:
+                        neighbor_index = [int(permutations[i_site][index]) for index in neighbor_index]
                     nearest_neighbors.append(neighbor_index)
                 else:
                     pass
@@ -86,19 +186,114 @@ def chemenv_calc_task(file, from_scratch=True):
         db['coordination_multi_connections'] = None
         db['coordination_multi_numbers'] = None
 
-    # Write the updated data back to the JSON file
+    # Write the updated data back to the JSON file. Written to a temporary file first
+    # so a task killed by the timeout cannot leave a truncated file behind
+    tmp_file = file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(db, f, indent=4)
+    os.replace(tmp_file, file)
+
+
+def chemenv_failed_task(file):
+    """
+    Mark the ChemEnv fields of a material as failed.
+
+    Args:
+    file (str): Path to the JSON file containing the structure data.
+    """
+    with open(file) as f:
+        db = json.load(f)
+
+    db['coordination_environments_multi_weight'] = None
+    db['coordination_multi_connections'] = None
+    db['coordination_multi_numbers'] = None
+
     with open(file, 'w') as f:
         json.dump(db, f, indent=4)
 
 
-def chemenv_calc():
+def run_tasks_with_timeout(func, files, n_workers=1, timeout=3600, poll_interval=1.0):
+    """
+    Run func on each file in its own process, with at most n_workers running at once.
+    Processes running longer than timeout seconds are terminated.
+
+    Args:
+    func (callable): A function that takes in a json file to process.
+    files (list): The json files to process.
+    n_workers (int): Maximum number of concurrent processes.
+    timeout (float): Wall time in seconds allowed per file.
+    poll_interval (float): Seconds between checks on the running processes.
+
+    Returns:
+    list: The files whose processes timed out.
+    """
+    pending = list(files)
+    running = {}
+    timed_out = []
+    while pending or running:
+        while pending and len(running) < n_workers:
+            file = pending.pop(0)
+            process = Process(target=func, args=(file,))
+            process.start()
+            running[file] = (process, time.time())
+
+        for file, (process, start_time) in list(running.items()):
+            if not process.is_alive():
+                process.join()
+                del running[file]
+            elif time.time() - start_time > timeout:
+                process.terminate()
+                process.join()
+                del running[file]
+                timed_out.append(file)
+
+        time.sleep(poll_interval)
+    return timed_out
+
+
+def chemenv_calc(symmetry_reduced=False, n_cores=N_CORES,
+                 heavy_cost=HEAVY_CHEMENV_COST, heavy_n_cores=1, heavy_timeout=3600):
+    """
+    Run the ChemEnv calculation over the database. Materials are split by their estimated cost;
+    the cheap majority is processed first, then the heavy materials run in a separate queue with
+    their own worker count and a per-material timeout.
+
+    Args:
+    symmetry_reduced (bool): Whether to compute one site per crystallographic orbit.
+    n_cores (int): Number of workers for the cheap materials.
+    heavy_cost (float): Estimated cost above which a material goes into the heavy queue.
+    heavy_n_cores (int): Number of workers for the heavy materials.
+    heavy_timeout (float): Wall time in seconds allowed per heavy material.
+    """
     # Print header for the process
     LOGGER.info('#' * 100)
     LOGGER.info('Running Chemenv Calculation using Multi Weight Strategy')
+    if symmetry_reduced:
+        LOGGER.info('Computing one site per crystallographic orbit')
     LOGGER.info('#' * 100)
 
-    # Process the database with the defined function
-    process_database(chemenv_calc_task)
+    task = partial(chemenv_calc_task, symmetry_reduced=symmetry_reduced)
+
+    # Split the database with the cost model
+    database_files = glob(DB_DIR + os.sep + '*.json')
+    with Pool(n_cores) as p:
+        costs = p.map(estimate_chemenv_cost, database_files)
+
+    light_files = [file for file, cost in zip(database_files, costs) if cost <= heavy_cost]
+    heavy_files = [file for file, cost in sorted(zip(database_files, costs), key=lambda x: x[1]) if cost > heavy_cost]
+    LOGGER.info(f"Light materials: {len(light_files)}, heavy materials: {len(heavy_files)}")
+
+    # Light materials are written out as they finish
+    with Pool(n_cores) as p:
+        for i, _ in enumerate(p.imap_unordered(task, light_files)):
+            if i % 100 == 0:
+                LOGGER.info(f"Finished {i} of {len(light_files)} light materials")
+
+    # Heavy materials, cheapest first
+    timed_out = run_tasks_with_timeout(task, heavy_files, n_workers=heavy_n_cores, timeout=heavy_timeout)
+    for file in timed_out:
+        LOGGER.error(f"ChemEnv timed out after {heavy_timeout}s for file {file}")
+        chemenv_failed_task(file)
 
 # Main execution block
 if __name__ == '__main__':
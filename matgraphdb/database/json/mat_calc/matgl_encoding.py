@@ -0,0 +1,190 @@
+import os
+import json
+import shutil
+from glob import glob
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+import dgl
+import matgl
+from matgl.ext.pymatgen import Structure2Graph
+from pymatgen.core import Structure
+
+from matgraphdb.utils import DB_DIR, ENCODING_DIR, N_CORES, LOGGER, timeit
+from matgraphdb.database.encoding_store import EncodingStore
+
+MATGL_MODELS=["MEGNet-MP-2018.6.1-Eform"]
+# Number of graphs per forward pass
+BATCH_SIZE=128
+# Number of materials per checkpointed chunk
+CHUNK_SIZE=4096
+
+_CONVERTER=None
+
+def _init_converter(element_types, cutoff):
+    global _CONVERTER
+    torch.set_num_threads(1)
+    _CONVERTER=Structure2Graph(element_types=element_types, cutoff=cutoff)
+
+def structure_graph_task(material_file):
+    """
+    Converts the structure of a material into the graph of the converter of this worker.
+
+    Args:
+        material_file (str): The material json file.
+
+    Returns:
+        tuple: (material_id, graph, state attributes), or None if the conversion failed.
+    """
+    mpid = material_file.split(os.sep)[-1].split('.')[0]
+    try:
+        with open(material_file) as f:
+            db = json.load(f)
+        structure = Structure.from_dict(db['structure'])
+
+        g, lat, state_attr = _CONVERTER.get_graph(structure)
+        g.edata["pbc_offshift"] = torch.matmul(g.edata["pbc_offset"], lat[0])
+        g.ndata["pos"] = g.ndata["frac_coords"] @ lat[0]
+        return mpid, g, np.asarray(state_attr)
+    except Exception as e:
+        LOGGER.error(f"Error processing file {mpid}: {e}")
+        return None
+
+def encode_graphs(model, graphs, state_attrs, batch_size=BATCH_SIZE):
+    """
+    Runs the model over the graphs in batches, the batched equivalent of calling
+    model.predict_structure on each structure.
+
+    Args:
+        model (torch.nn.Module): A matgl property model, e.g. MEGNet or M3GNet.
+        graphs (list): The DGL graphs.
+        state_attrs (list): The state attributes of each graph.
+        batch_size (int): Number of graphs per forward pass.
+
+    Returns:
+        np.ndarray: The float32 encodings, one row per graph.
+    """
+    if not graphs:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    encodings = []
+    with torch.no_grad():
+        for i in range(0, len(graphs), batch_size):
+            g = dgl.batch(graphs[i:i + batch_size])
+            state_attr = torch.tensor(np.stack(state_attrs[i:i + batch_size]), dtype=matgl.float_th)
+            output = model(g=g, state_attr=state_attr)
+            encodings.append(output.detach().reshape(g.batch_size, -1).numpy().astype(np.float32))
+    return np.concatenate(encodings)
+
+def _chunk_file(output_dir, i_chunk):
+    return os.path.join(output_dir, 'chunks', f'{i_chunk:06d}.npz')
+
+def _chunk_done(chunk_file, chunk_ids):
+    # A chunk is reused only if it was computed for the same materials
+    if not os.path.exists(chunk_file):
+        return False
+    with np.load(chunk_file) as chunk:
+        return chunk['chunk_ids'].tolist() == chunk_ids
+
+def _save_chunk(chunk_file, chunk_ids, ids, encodings):
+    os.makedirs(os.path.dirname(chunk_file), exist_ok=True)
+    tmp_file = chunk_file + '.tmp.npz'
+    np.savez(tmp_file, chunk_ids=np.array(chunk_ids), ids=np.array(ids), encodings=encodings)
+    os.replace(tmp_file, chunk_file)
+
+def _assemble_chunks(output_dir, n_chunks, modelname):
+    ids = []
+    encodings = []
+    dimension = 0
+    for i_chunk in range(n_chunks):
+        with np.load(_chunk_file(output_dir, i_chunk)) as chunk:
+            dimension = max(dimension, chunk['encodings'].shape[1])
+            if len(chunk['ids']) == 0:
+                continue
+            ids.extend(chunk['ids'].tolist())
+            encodings.append(chunk['encodings'])
+
+    if encodings:
+        encodings = np.concatenate(encodings).astype(np.float32)
+    else:
+        # No material could be converted, an empty store is written so the model is not rerun
+        LOGGER.warning(f"{modelname}: no material was encoded, writing an empty store")
+        encodings = np.zeros((0, dimension), dtype=np.float32)
+
+    store = EncodingStore.save(output_dir, encodings, ids, model=modelname)
+    shutil.rmtree(os.path.join(output_dir, 'chunks'))
+    return store
+
+@timeit
+def encode_database(modelnames=MATGL_MODELS, material_files=None, output_dir=ENCODING_DIR,
+                    batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE, n_cores=N_CORES):
+    """
+    Encodes every material of the database with one or more matgl models.
+
+    The materials are processed in chunks. Each chunk's structures are converted to
+    graphs in parallel, once per distinct graph converter (element types and cutoff),
+    and every model sharing that converter encodes the same graphs in batches on CPU.
+    Finished chunks are saved under output_dir/<model>/chunks, so an interrupted run
+    resumes at the first missing chunk. When all chunks of a model are done they are
+    merged into an EncodingStore in output_dir/<model>. The encoding dimension is
+    whatever the model outputs.
+
+    Args:
+        modelnames (list): Names of pretrained matgl property models.
+        material_files (list): Optional, the material json files. Defaults to every file in DB_DIR.
+        output_dir (str): The encoding directory.
+        batch_size (int): Number of graphs per forward pass.
+        chunk_size (int): Number of materials per checkpoint.
+        n_cores (int): Number of processes converting structures to graphs.
+
+    Returns:
+        dict: Model name to its EncodingStore.
+    """
+    if material_files is None:
+        material_files = sorted(glob(DB_DIR + os.sep + '*.json'))
+    material_ids = [file.split(os.sep)[-1].split('.')[0] for file in material_files]
+    n_chunks = (len(material_files) + chunk_size - 1) // chunk_size
+
+    LOGGER.info('#' * 100)
+    LOGGER.info(f"Encoding {len(material_files)} materials with {modelnames}")
+    LOGGER.info('#' * 100)
+
+    # Group the models by graph converter so each conversion is shared
+    groups = {}
+    for modelname in modelnames:
+        model = matgl.load_model(modelname)
+        model.eval()
+        converter_key = (tuple(model.element_types), float(model.cutoff))
+        groups.setdefault(converter_key, []).append((modelname, model))
+
+    pools = {}
+    try:
+        for i_chunk in range(n_chunks):
+            chunk_files = material_files[i_chunk * chunk_size:(i_chunk + 1) * chunk_size]
+            chunk_ids = material_ids[i_chunk * chunk_size:(i_chunk + 1) * chunk_size]
+
+            for converter_key, models in groups.items():
+                todo = [(modelname, model) for modelname, model in models
+                        if not _chunk_done(_chunk_file(os.path.join(output_dir, modelname), i_chunk), chunk_ids)]
+                if not todo:
+                    continue
+
+                if converter_key not in pools:
+                    pools[converter_key] = Pool(n_cores, initializer=_init_converter, initargs=converter_key)
+                results = [result for result in pools[converter_key].map(structure_graph_task, chunk_files) if result is not None]
+                ids = [result[0] for result in results]
+                graphs = [result[1] for result in results]
+                state_attrs = [result[2] for result in results]
+
+                for modelname, model in todo:
+                    encodings = encode_graphs(model, graphs, state_attrs, batch_size=batch_size)
+                    _save_chunk(_chunk_file(os.path.join(output_dir, modelname), i_chunk), chunk_ids, ids, encodings)
+                    LOGGER.info(f"{modelname}: chunk {i_chunk + 1}/{n_chunks} encoded, dimension {encodings.shape[1]}")
+    finally:
+        for pool in pools.values():
+            pool.close()
+            pool.join()
+
+    return {modelname: _assemble_chunks(os.path.join(output_dir, modelname), n_chunks, modelname)
+            for modelname in modelnames}
@@ -1,22 +1,51 @@
 import os
 import json
+import time
+import asyncio
+from glob import glob
+from functools import lru_cache, partial
 
 import openai
 import tiktoken
-import pandas as pd
 import numpy as np
 
-from matgraphdb.utils import OPENAI_API_KEY, DB_DIR, ENCODING_DIR
+from matgraphdb.utils import OPENAI_API_KEY, ENCODING_DIR, LOGGER
 from matgraphdb.database.utils import process_database
+from matgraphdb.database.encoding_store import EncodingStore
 from matgraphdb.database.json.utils import PROPERTY_NAMES
+from matgraphdb.database.neo4j.similarity_chat import local_embedding
+
+# Limits of the embeddings endpoint
+MAX_INPUTS_PER_REQUEST=2048
+MAX_TOKENS_PER_INPUT=8191
+MAX_TOKENS_PER_REQUEST=300000
+# Client side limits, set below the account limits
+REQUESTS_PER_MINUTE=3000
+TOKENS_PER_MINUTE=1000000
+MAX_CONCURRENT_REQUESTS=8
+MAX_RETRIES=6
+
+EMBEDDING_ENCODING="cl100k_base"
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str):
+    """Returns the tokenizer, built once per process."""
+    return tiktoken.get_encoding(encoding_name)
 
 def num_tokens_from_string(string: str, encoding_name: str) -> int:
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.get_encoding(encoding_name)
+    encoding = get_encoding(encoding_name)
     num_tokens = len(encoding.encode(string))
     return num_tokens
 
 
+def truncate_text(text, max_tokens=MAX_TOKENS_PER_INPUT, encoding_name=EMBEDDING_ENCODING):
+    """Returns the text cut to its first max_tokens tokens, and its number of tokens."""
+    encoding = get_encoding(encoding_name)
+    tokens = encoding.encode(text)[:max_tokens]
+    return encoding.decode(tokens), len(tokens)
+
+
 def get_embedding(text, client, model="text-embedding-3-small"):
    text = text.replace("\n", " ")
    return client.embeddings.create(input = [text], model=model).data[0].embedding
@@ -32,10 +61,278 @@ def extract_text_from_json(json_file):
             emd_dict[key]=data[key]
         elif key=='structure':
             emd_dict['lattice']=data[key]['lattice']
-            
+
     compact_json_text = json.dumps(emd_dict, separators=(',', ':'))
     return compact_json_text
 
+def extract_text_tokens_task(json_file, encoding_name=EMBEDDING_ENCODING):
+    """
+    Extracts the text of a material and counts its tokens in the same pass, so the
+    texts are tokenized in the worker processes instead of serially in the parent.
+
+    Args:
+        json_file (str): The material json file.
+        encoding_name (str): The tiktoken encoding of the embedding model.
+
+    Returns:
+        tuple: (material_id, text, number of tokens)
+    """
+    mpid = json_file.split(os.sep)[-1].split('.')[0]
+    text = extract_text_from_json(json_file)
+    return mpid, text, num_tokens_from_string(text, encoding_name=encoding_name)
+
+def token_count_report(token_counts, cost_per_token, n_bins=20):
+    """
+    Summarizes the token counts of a job and its cost before any request is sent.
+
+    Args:
+        token_counts (list): Number of tokens of each input.
+        cost_per_token (float): Price of one token in $.
+        n_bins (int): Number of histogram bins.
+
+    Returns:
+        dict: total tokens, cost, min/mean/max tokens, histogram counts and bin edges.
+    """
+    token_counts = np.asarray(token_counts)
+    counts, bin_edges = np.histogram(token_counts, bins=n_bins)
+    report = {
+        'n_inputs': len(token_counts),
+        'total_tokens': int(token_counts.sum()),
+        'cost': float(token_counts.sum() * cost_per_token),
+        'min_tokens': int(token_counts.min()),
+        'mean_tokens': float(token_counts.mean()),
+        'max_tokens': int(token_counts.max()),
+        'n_over_limit': int((token_counts > MAX_TOKENS_PER_INPUT).sum()),
+        'histogram': counts.tolist(),
+        'bin_edges': bin_edges.tolist(),
+        }
+
+    LOGGER.info(f"{report['n_inputs']} inputs, {report['total_tokens']} tokens, estimated cost {report['cost']:.4f} $")
+    LOGGER.info(f"Tokens per input: min {report['min_tokens']}, mean {report['mean_tokens']:.1f}, max {report['max_tokens']}")
+    width = max(counts.max(), 1)
+    for count, low, high in zip(counts, bin_edges[:-1], bin_edges[1:]):
+        LOGGER.info(f"{low:8.0f} - {high:8.0f} | {'#' * int(50 * count / width):<50} {count}")
+    return report
+
+
+class OpenAIEmbeddingBackend:
+    """
+    Embeds batches of texts with the OpenAI embeddings endpoint.
+    """
+    def __init__(self, api_key=OPENAI_API_KEY):
+        self.client = openai.AsyncOpenAI(api_key=api_key)
+
+    async def embed(self, texts, model):
+        response = await self.client.embeddings.create(input=texts, model=model)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+class LocalEmbeddingBackend:
+    """
+    Offline stand-in for the OpenAI backend, see similarity_chat.local_embedding.
+    """
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    async def embed(self, texts, model):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return [local_embedding(text, model=model) for text in texts]
+
+
+class RateLimiter:
+    """
+    Token bucket limiting both the requests and the tokens sent per minute.
+    """
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = requests_per_minute
+        self.available_tokens = tokens_per_minute
+        self.last_update = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+        self.available_requests = min(self.requests_per_minute, self.available_requests + elapsed * self.requests_per_minute / 60)
+        self.available_tokens = min(self.tokens_per_minute, self.available_tokens + elapsed * self.tokens_per_minute / 60)
+
+    async def acquire(self, n_tokens):
+        # A single request may never exceed the bucket, otherwise it would wait forever
+        n_tokens = min(n_tokens, self.tokens_per_minute)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.available_requests >= 1 and self.available_tokens >= n_tokens:
+                    self.available_requests -= 1
+                    self.available_tokens -= n_tokens
+                    return
+                wait_requests = (1 - self.available_requests) * 60 / self.requests_per_minute
+                wait_tokens = (n_tokens - self.available_tokens) * 60 / self.tokens_per_minute
+                await asyncio.sleep(max(wait_requests, wait_tokens, 0.01))
+
+
+def batch_inputs(token_counts, max_inputs=MAX_INPUTS_PER_REQUEST, max_tokens=MAX_TOKENS_PER_REQUEST):
+    """
+    Groups inputs into requests holding at most max_inputs inputs and max_tokens tokens.
+
+    Args:
+        token_counts (list): Number of tokens of each input.
+        max_inputs (int): Maximum number of inputs per request.
+        max_tokens (int): Maximum number of tokens per request.
+
+    Returns:
+        list: The input indices of each request.
+    """
+    batches=[]
+    batch=[]
+    batch_tokens=0
+    for i, n_tokens in enumerate(token_counts):
+        if batch and (len(batch) == max_inputs or batch_tokens + n_tokens > max_tokens):
+            batches.append(batch)
+            batch=[]
+            batch_tokens=0
+        batch.append(i)
+        batch_tokens+=n_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def load_checkpoints(checkpoint_dir):
+    """
+    Loads the embeddings of every finished request of a previous run.
+
+    Returns:
+        dict: Material id to embedding.
+    """
+    embeddings={}
+    for file in sorted(glob(os.path.join(checkpoint_dir, '*.npz'))):
+        with np.load(file) as checkpoint:
+            for material_id, embedding in zip(checkpoint['ids'], checkpoint['embeddings']):
+                embeddings[str(material_id)] = embedding
+    return embeddings
+
+
+def save_checkpoint(checkpoint_dir, ids, embeddings):
+    file = os.path.join(checkpoint_dir, f'{ids[0]}_{len(ids)}.npz')
+    # The temporary name must not match *.npz, a partial file left by a crash would be loaded on resume
+    tmp_file = file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.savez(f, ids=np.array(ids), embeddings=np.asarray(embeddings, dtype=np.float32))
+    os.replace(tmp_file, file)
+
+
+async def _embed_batches(ids, texts, token_counts, batches, model, backend, checkpoint_dir,
+                         rate_limiter, max_concurrent_requests, max_retries):
+    semaphore = asyncio.Semaphore(max_concurrent_requests)
+
+    async def run(batch):
+        batch_ids = [ids[i] for i in batch]
+        batch_texts = [texts[i].replace("\n", " ") for i in batch]
+        n_tokens = sum(token_counts[i] for i in batch)
+        async with semaphore:
+            for attempt in range(max_retries):
+                await rate_limiter.acquire(n_tokens)
+                try:
+                    embeddings = await backend.embed(batch_texts, model)
+                    break
+                except Exception as e:
+                    if attempt == max_retries - 1:
+                        LOGGER.error(f"Error embedding batch starting at {batch_ids[0]}: {e}")
+                        return 0
+                    wait = 2 ** attempt
+                    LOGGER.info(f"Retrying batch starting at {batch_ids[0]} in {wait}s: {e}")
+                    await asyncio.sleep(wait)
+        save_checkpoint(checkpoint_dir, batch_ids, embeddings)
+        return len(batch)
+
+    results = await asyncio.gather(*[run(batch) for batch in batches])
+    return sum(results)
+
+
+def run_embedding_job(ids, texts, token_counts, model="text-embedding-3-small", backend=None,
+                      output_dir=None,
+                      max_inputs_per_request=MAX_INPUTS_PER_REQUEST,
+                      max_tokens_per_request=MAX_TOKENS_PER_REQUEST,
+                      requests_per_minute=REQUESTS_PER_MINUTE,
+                      tokens_per_minute=TOKENS_PER_MINUTE,
+                      max_concurrent_requests=MAX_CONCURRENT_REQUESTS,
+                      max_retries=MAX_RETRIES,
+                      encoding_name=EMBEDDING_ENCODING):
+    """
+    Embeds many texts with batched, concurrent and rate limited requests.
+
+    Every finished request is checkpointed to output_dir/checkpoints, so a restarted
+    job only sends the inputs that are not embedded yet. When every input is embedded
+    the encodings are saved as an EncodingStore in output_dir and the checkpoints
+    are removed.
+
+    Args:
+        ids (list): The material id of each text.
+        texts (list): The texts to embed.
+        token_counts (list): Number of tokens of each text.
+        model (str): The embedding model.
+        backend: Object with an async embed(texts, model) method. Defaults to OpenAIEmbeddingBackend.
+        output_dir (str): Output directory. Defaults to ENCODING_DIR/model.
+        max_inputs_per_request (int): Maximum number of texts per request.
+        max_tokens_per_request (int): Maximum number of tokens per request.
+        requests_per_minute (int): Request rate limit.
+        tokens_per_minute (int): Token rate limit.
+        max_concurrent_requests (int): Maximum number of requests in flight.
+        max_retries (int): Attempts per request, with exponential backoff.
+        encoding_name (str): The tiktoken encoding used to truncate inputs over MAX_TOKENS_PER_INPUT.
+
+    Returns:
+        np.ndarray: The float32 encodings, or None if some requests failed.
+    """
+    if backend is None:
+        backend = OpenAIEmbeddingBackend()
+    if output_dir is None:
+        output_dir = os.path.join(ENCODING_DIR, model)
+    checkpoint_dir = os.path.join(output_dir, 'checkpoints')
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    ids = [str(material_id) for material_id in ids]
+    done = load_checkpoints(checkpoint_dir)
+    todo = [i for i, material_id in enumerate(ids) if material_id not in done]
+    LOGGER.info(f"{len(done)} embeddings restored from checkpoints, {len(todo)} to compute")
+
+    # The endpoint rejects the whole request if one input is too long, so those are truncated
+    texts = list(texts)
+    token_counts = list(token_counts)
+    for i in todo:
+        if token_counts[i] > MAX_TOKENS_PER_INPUT:
+            LOGGER.warning(f"{ids[i]} has {token_counts[i]} tokens, truncated to the {MAX_TOKENS_PER_INPUT} allowed per input")
+            texts[i], token_counts[i] = truncate_text(texts[i].replace("\n", " "), max_tokens=MAX_TOKENS_PER_INPUT,
+                                                      encoding_name=encoding_name)
+
+    batches = batch_inputs([token_counts[i] for i in todo], max_inputs=max_inputs_per_request, max_tokens=max_tokens_per_request)
+    batches = [[todo[i] for i in batch] for batch in batches]
+
+    rate_limiter = RateLimiter(requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute)
+    n_embedded = asyncio.run(_embed_batches(ids, texts, token_counts, batches, model, backend, checkpoint_dir,
+                                            rate_limiter, max_concurrent_requests, max_retries))
+    LOGGER.info(f"Embedded {n_embedded} of {len(todo)} inputs in {len(batches)} requests")
+
+    done = load_checkpoints(checkpoint_dir)
+    missing = [material_id for material_id in ids if material_id not in done]
+    if missing:
+        LOGGER.error(f"{len(missing)} inputs are not embedded, rerun to resume")
+        return None
+
+    encodings = np.stack([done[material_id] for material_id in ids]).astype(np.float32)
+    EncodingStore.save(output_dir, encodings, ids, model=model)
+
+    # Also removes the partial files of interrupted writes
+    for file in glob(os.path.join(checkpoint_dir, '*')):
+        os.remove(file)
+    os.rmdir(checkpoint_dir)
+    return encodings
+
+
 def main():
     ####################
     # Parameters
@@ -43,46 +340,30 @@ def main():
     models=["text-embedding-3-small","text-embedding-3-large","ada v2"]
     cost_per_token=[0.00000002,0.00000013,0.00000010]
     model_index=0
-    
-    embedding_encoding = "cl100k_base"
-    
+
+    embedding_encoding = EMBEDDING_ENCODING
+
 
     ####################
     # Code runs below
     ####################
 
     MODEL=models[model_index]
-    filename=MODEL + ".csv"
-    
-    client = openai.OpenAI(api_key=OPENAI_API_KEY)
 
     print("Processing database...")
-    # Extracting raw json text from the database
-    results=process_database(extract_text_from_json)
+    # Extracting raw json text from the database and counting its tokens
+    results=process_database(partial(extract_text_tokens_task, encoding_name=embedding_encoding))
     print("Finished processing database")
 
-    # Calculate the total number of tokens and the cost
-    token_count=0
-    for result in results:
-        token_count+=num_tokens_from_string(result,encoding_name=embedding_encoding)
-
-    print("Total number of tokens: ",token_count)
-    print("Total cost: ",token_count*cost_per_token[model_index], "$")
-
-    # Get the mp_ids
-    mp_ids=[ file.split('.')[0] for file in os.listdir(DB_DIR) if file.endswith('.json')]
-
-    # put reselts into a dataframe under the column 'combined'
-    df = pd.DataFrame(results, columns=['combined'], index=mp_ids)
+    mp_ids, texts, token_counts = map(list, zip(*results))
 
+    # Calculate the total number of tokens and the cost
+    report=token_count_report(token_counts, cost_per_token=cost_per_token[model_index])
 
-    df['ada_embedding'] = df.combined.apply(lambda x: get_embedding(x,client, model=MODEL))
-
-    # Create a dataframe of the embeddings. emb dim span columns size 1535
-    df_embeddings = pd.DataFrame(np.array(df['ada_embedding'].tolist()), index=mp_ids)
+    print("Total number of tokens: ",report['total_tokens'])
+    print("Total cost: ",report['cost'], "$")
 
-    # Save the embeddings to a csv file
-    df_embeddings.to_csv(os.path.join(ENCODING_DIR,filename), index=True)
+    run_embedding_job(mp_ids, texts, token_counts, model=MODEL, backend=OpenAIEmbeddingBackend())
 
 
 if __name__=='__main__':
@@ -107,5 +388,5 @@ if __name__=='__main__':
     # print("Number of tokens: ",num_tokens)
 
 
-    
+
 
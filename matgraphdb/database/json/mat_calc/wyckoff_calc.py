@@ -1,28 +1,28 @@
 import os
 import json
 
-import pymatgen.core as pmat
-from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
-
 from matgraphdb.database.utils import process_database
 from matgraphdb.utils import DB_DIR, LOGGER
+from matgraphdb.utils.symmetry import get_symmetry_info, spglib_cell_from_dict
 
 def wyckoff_calc_task(file, from_scratch=False):
 
     try:
         with open(file) as f:
             db = json.load(f)
-            struct = pmat.Structure.from_dict(db['structure'])
         mpid=file.split(os.sep)[-1].split('.')[0]
-        if 'wyckoffs' not in db or from_scratch:
-            spg_a = SpacegroupAnalyzer(struct)
-            sym_dataset=spg_a.get_symmetry_dataset()
+        if 'wyckoffs' not in db or 'symmetry' not in db or from_scratch:
+            # spglib is called directly on the raw arrays. The full result is stored
+            # so downstream calculations do not recompute the symmetry
+            symmetry=get_symmetry_info(*spglib_cell_from_dict(db['structure']))
 
-            db['wyckoffs']=sym_dataset['wyckoffs']
+            db['symmetry']=symmetry
+            db['wyckoffs']=symmetry['wyckoffs']
 
 
     except Exception as e:
         LOGGER.error(f"Error processing file {mpid}: {e}")
+        db['symmetry']=None
         db['wyckoffs']=None
 
     with open(file,'w') as f:
@@ -56,3 +56,5 @@ PROPERTIES=[
     ("e_electronic","float"),
     ("wyckoffs","string[]"),
 ]
+
+PROPERTY_NAMES=[property_name for property_name,_ in PROPERTIES]
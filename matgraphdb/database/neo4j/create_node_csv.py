@@ -11,8 +11,20 @@ from matgraphdb.database.neo4j.node_types import (ELEMENTS,ELEMENT_PROPERTIES, M
                                                 LATTICE_IDS, LATTICE_PROPERTIES,SITE_IDS, SITE_PROPERTIES, SITES_IDS, SITES_PROPERTIES)
 from matgraphdb.database.json.utils import PROPERTIES
 from matgraphdb.utils import  GLOBAL_PROP_FILE, NODE_DIR, LOGGER, ENCODING_DIR
+from matgraphdb.database.encoding_store import EncodingStore, list_encoding_stores
 
-def create_nodes(node_names, node_type, node_prefix, node_properties=None, filepath=None):
+# Number of materials whose encodings are serialized at a time
+ENCODING_CHUNK_SIZE=10000
+
+def _encoding_columns(encoding_stores):
+    # Accepts a list of stores, named by their model, or a dictionary of column name to store
+    if isinstance(encoding_stores, dict):
+        return list(encoding_stores.items())
+    return [(store.name, store) for store in encoding_stores]
+
+
+def create_nodes(node_names, node_type, node_prefix, node_properties=None, filepath=None,
+                 encoding_stores=None, chunk_size=ENCODING_CHUNK_SIZE):
     """
     Create nodes for a graph database.
 
@@ -22,9 +34,13 @@ def create_nodes(node_names, node_type, node_prefix, node_properties=None, filep
         node_prefix (str): Prefix for node IDs.
         node_properties (list, optional): List of dictionaries containing additional properties for each node. Defaults to None.
         filepath (str, optional): Filepath to save the node data as a CSV file. Defaults to None.
+        encoding_stores (list or dict, optional): EncodingStores whose vectors are added as '<name>:float[]' columns,
+            aligned to node_names by material id. A dictionary maps column names to stores. Defaults to None.
+        chunk_size (int, optional): Number of rows whose encodings are serialized at a time when writing to filepath.
 
     Returns:
-        pandas.DataFrame: DataFrame containing the node data.
+        pandas.DataFrame: DataFrame containing the node data. When writing encodings to filepath
+            the encoding columns are streamed to the file chunk by chunk and not returned.
 
     """
     
@@ -53,6 +69,25 @@ def create_nodes(node_names, node_type, node_prefix, node_properties=None, filep
 
     df = pd.DataFrame(node_dict)
 
+    if encoding_stores:
+        encoding_columns = _encoding_columns(encoding_stores)
+        node_names = list(node_names)
+
+        if not filepath:
+            for name, store in encoding_columns:
+                df[f'{name}:float[]'] = store.to_neo4j_arrays(node_names)
+            return df
+
+        # Only chunk_size rows of each encoding are gathered and serialized at a time
+        for start in range(0, len(df), chunk_size):
+            df_chunk = df.iloc[start:start + chunk_size].copy()
+            for name, store in encoding_columns:
+                df_chunk[f'{name}:float[]'] = store.to_neo4j_arrays(node_names[start:start + chunk_size])
+            df_chunk.to_csv(filepath, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+        for name, store in encoding_columns:
+            LOGGER.info(f"Added {name} encodings of dimension {store.dimension} to {filepath}")
+        return df
+
     if filepath:
         df.to_csv(filepath, index=False)
 
@@ -115,7 +150,8 @@ def main():
                 node_type='Material',
                 node_prefix='materials',
                 node_properties=MATERIAL_PROPERTIES,
-                filepath=os.path.join(save_path, 'materials.csv'))
+                filepath=os.path.join(save_path, 'materials.csv'),
+                encoding_stores=[EncodingStore.load(store_dir) for store_dir in list_encoding_stores(ENCODING_DIR)])
     
     # SPG_WYCKOFFS
     # create_nodes(node_names=SPG_WYCKOFFS,
@@ -4,6 +4,7 @@ import itertools
 from functools import partial
 from multiprocessing import Pool
 
+import numpy as np
 import pandas as pd
 import pymatgen.core as pmat
 from matminer.datasets import load_dataset
@@ -344,21 +345,25 @@ def similarity_task(material_combs, features):
     return material_combs_values
 
 def megnet_lookup_task(material_combs, features):
-    n_materials_combs=len(material_combs)
-    material_combs_values = [None]*n_materials_combs
-
-    for i, material_comb in enumerate(material_combs):
-        mat_id_1,mat_id_2=material_comb
-
-        row_1 = features.iloc[mat_id_1].values
-        row_2 = features.iloc[mat_id_2].values
-
-        similarity=cosine_similarity(a=row_1,b=row_2)
-
-        material_comb_values=(mat_id_1,mat_id_2,'RELATIONSHP',similarity)
-        material_combs_values[i] = material_comb_values
-
-    return material_combs_values
+    """
+    Cosine similarity of pairs of materials from their encodings.
+
+    Args:
+        material_combs (list): Pairs of material node ids, which are rows of features.
+        features (np.ndarray): The encodings aligned with the material nodes, e.g. EncodingStore.align(MATERIAL_IDS).
+    """
+    material_combs = np.asarray(material_combs)
+    if len(material_combs) == 0:
+        return []
+    features = np.asarray(features, dtype=np.float32)
+    norms = np.linalg.norm(features, axis=1)
+
+    rows_1 = features[material_combs[:,0]]
+    rows_2 = features[material_combs[:,1]]
+    similarities = np.einsum('ij,ij->i', rows_1, rows_2) / (norms[material_combs[:,0]] * norms[material_combs[:,1]])
+
+    return [(int(mat_id_1),int(mat_id_2),'RELATIONSHP',float(similarity))
+            for (mat_id_1,mat_id_2),similarity in zip(material_combs.tolist(),similarities)]
 
 def get_structure_composition_task(material_file):
     # Load material data from file and get their pymatgen Structure and Compositions objects
@@ -609,13 +614,12 @@ def main():
     # Below is for similarity between materials
     # Note for 10647 materials this took 1457.1755.0496 seconds to complete. Max memory used 18.5 Gb
     # Reset the index
-    # df=pd.read_csv(os.path.join(ENCODING_DIR,'MEGNet-MP-2018.6.1-Eform.csv'),index_col=0)
-    # df.reset_index(drop=True, inplace=True)
+    # features=EncodingStore.load('MEGNet-MP-2018.6.1-Eform').align(MATERIAL_IDS)
 
     # create_material_material_relationship(material_file_csv=os.path.join(NODE_DIR,'materials.csv'),
     #                                       mp_task=get_structure_composition_task,
     #                                       similarity_task=megnet_lookup_task,
-    #                                       features=df,
+    #                                       features=features,
     #                                       chunk_size=500,
     #                                       filepath=os.path.join(save_path,'material-material_MEGNet-MP-2018.6.1-Eform-similarity.csv')
     #                                       )
@@ -1,13 +1,11 @@
-from openai import OpenAI
-
 from matgraphdb.database.neo4j.graph_database import MatGraphDB
-from matgraphdb.utils import OPENAI_API_KEY
+from matgraphdb.database.neo4j.similarity_chat import get_client
 
 
 class ChatHandler:
     def __init__(self):
 
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+        self.client = get_client()
         with MatGraphDB() as session:
             schema_list = session.list_schema()
             self.db_schema = "\n".join(schema_list)
@@ -1,13 +1,55 @@
 from neo4j import GraphDatabase
 
-from matgraphdb.utils import PASSWORD,USER,LOCATION,DB_NAME
-from matgraphdb.database.neo4j.similarity_chat import get_similarity_query
+from matgraphdb.utils import PASSWORD,USER,LOCATION,GRAPH_DB_NAME as DB_NAME
+from matgraphdb.utils.cache import TTLCache
+from matgraphdb.database.neo4j.similarity_chat import get_similarity_query, normalize_prompt, MODEL
+
+# Number of rows sent per UNWIND batch write
+BATCH_SIZE=10000
+# Maximum number of pooled connections held by the driver
+MAX_CONNECTION_POOL_SIZE=50
+# Seconds a schema returned by list_schema stays valid
+SCHEMA_CACHE_TTL=600
+# Number of vector query results kept in memory and the seconds they stay valid
+QUERY_CACHE_SIZE=1024
+QUERY_CACHE_TTL=600
+
+# Shared by every MatGraphDB instance of the process, keys start with (uri, database)
+_SCHEMA_CACHE=TTLCache(maxsize=64, ttl=SCHEMA_CACHE_TTL)
+_QUERY_CACHE=TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+
+def _property_type(property_types):
+    # Converts the neo4j type names reported by the schema procedures, e.g. ['Double'], to python names
+    if isinstance(property_types, list):
+        property_types = property_types[0] if property_types else ''
+    property_type = property_types.replace("`",'')
+    for neo4j_name, python_name in [('String','str'), ('Integer','int'), ('Long','int'),
+                                    ('Float','float'), ('Double','float'), ('Boolean','bool')]:
+        property_type = property_type.replace(neo4j_name, python_name)
+    return property_type
 
 class MatGraphDB:
-    def __init__(self, uri=LOCATION, user=USER, password=PASSWORD):
+    def __init__(self, uri=LOCATION, user=USER, password=PASSWORD, database=DB_NAME,
+                 max_connection_pool_size=MAX_CONNECTION_POOL_SIZE,
+                 connection_acquisition_timeout=60.0):
+        """
+        A long lived connection to the graph database. The driver and its connection
+        pool are created once and shared by every query of this instance.
+
+        Args:
+            uri (str): The bolt uri of the dbms.
+            user (str): The user name.
+            password (str): The password.
+            database (str): The database to run queries against.
+            max_connection_pool_size (int): Maximum number of pooled connections.
+            connection_acquisition_timeout (float): Seconds to wait for a connection from the pool.
+        """
         self.uri = uri
         self.user = user
         self.password = password
+        self.database = database
+        self.max_connection_pool_size = max_connection_pool_size
+        self.connection_acquisition_timeout = connection_acquisition_timeout
         self.driver = None
 
     def __enter__(self):
@@ -18,111 +60,202 @@ class MatGraphDB:
         self.close()
 
     def create_driver(self):
-        self.driver = GraphDatabase.driver(self.uri, auth=(self.user, self.password))
+        if self.driver is None:
+            self.driver = GraphDatabase.driver(self.uri, auth=(self.user, self.password),
+                                            max_connection_pool_size=self.max_connection_pool_size,
+                                            connection_acquisition_timeout=self.connection_acquisition_timeout)
+        return self.driver
 
     def close(self):
         if self.driver:
             self.driver.close()
+            self.driver = None
+
+    def session(self, **kwargs):
+        """
+        Opens a session on the pooled driver. Sessions are cheap, they borrow a
+        connection from the pool for the duration of the session.
+        """
+        return self.create_driver().session(database=self.database, **kwargs)
 
-    def list_schema(self):
+    def list_schema(self, use_cache=True):
         """
         Retrieves the schema of the graph database.
 
+        The schema comes from three procedure calls, db.schema.nodeTypeProperties,
+        db.schema.relTypeProperties and db.schema.visualization, none of which touch
+        the data. The result is cached per database for SCHEMA_CACHE_TTL seconds and
+        invalidated by write and batch_write.
+
+        Args:
+            use_cache (bool): Whether to return the cached schema if it is still valid.
+
         Returns:
             schema_list (list): A list of strings representing the schema of the graph database.
         """
+        key = (self.uri, self.database)
+        if use_cache:
+            schema_list = _SCHEMA_CACHE.get(key)
+            if schema_list is not None:
+                return list(schema_list)
+
         schema_list=[]
 
         # Query for node labels and properties
-        labels_query =  "CALL db.schema.nodeTypeProperties()"
-        labels_results = self.execute_query(labels_query)
         node_and_properties = {}
-        for record in labels_results:
-
+        for record in self.read("CALL db.schema.nodeTypeProperties()"):
             node_type = record["nodeType"]
-            propert_name = record["propertyName"]
-
-            if isinstance(record["propertyTypes"], list):
-                property_type = record["propertyTypes"][0]
-            else:
-                property_type = record["propertyTypes"]
-            property_type=property_type.replace("`",'').replace("String",'str').replace('Integer','int').replace('Float','float')
-            if node_type not in node_and_properties:
-                node_and_properties[node_type] = {propert_name : property_type}
-            else:
-                node_and_properties[node_type].update({propert_name : property_type})
-
-        # Query for relationship types
-        labels_query =  "CALL db.schema.visualization()"
-        labels_results = self.execute_query(labels_query)
-
-        for i,record in enumerate(labels_results):
-            
-            # Getting node types and names
-            try:
-                node_1_type=record["nodes"][0]['name']
-                node_2_type=record["nodes"][1]['name']
-                node_1_name=f':`{node_1_type}`'
-                node_2_name=f':`{node_2_type}`'
-            except:
+            node_and_properties.setdefault(node_type, {})
+            if record["propertyName"] is not None:
+                node_and_properties[node_type][record["propertyName"]] = _property_type(record["propertyTypes"])
+
+        # Query for relationship types and properties
+        relationship_and_properties = {}
+        for record in self.read("CALL db.schema.relTypeProperties()"):
+            relationship_type = record["relType"].lstrip(':').strip('`')
+            relationship_and_properties.setdefault(relationship_type, {})
+            if record["propertyName"] is not None:
+                relationship_and_properties[relationship_type][record["propertyName"]] = _property_type(record["propertyTypes"])
+
+        # Query for which node labels each relationship type connects
+        for record in self.read("CALL db.schema.visualization()"):
+            if len(record["nodes"]) < 2:
                 raise Exception("Only one node in this graph gb")
 
             # Adding indexes and contraints
-            # node_and_properties[node_1_name].update({'indexes' : type(record["nodes"][0]._properties['indexes']).__name__})
-            # node_and_properties[node_2_name].update({'indexes' : type(record["nodes"][1]._properties['indexes']).__name__})
-
-            # node_and_properties[node_1_name].update({'constraints' : type(record["nodes"][0]._properties['constraints']).__name__})
-            # node_and_properties[node_2_name].update({'constraints' : type(record["nodes"][1]._properties['constraints']).__name__})
-
-            node_and_properties[node_1_name].update({'indexes' : record["nodes"][0]._properties['indexes']})
-            node_and_properties[node_2_name].update({'indexes' : record["nodes"][1]._properties['indexes']})
-
-            node_and_properties[node_1_name].update({'constraints' : record["nodes"][0]._properties['constraints']})
-            node_and_properties[node_2_name].update({'constraints' : record["nodes"][1]._properties['constraints']})
+            for node in record["nodes"]:
+                node_name=f':`{node["name"]}`'
+                node_and_properties.setdefault(node_name, {})
+                node_and_properties[node_name].update({'indexes' : node._properties['indexes']})
+                node_and_properties[node_name].update({'constraints' : node._properties['constraints']})
 
             # Get relationship infor for all relationships
             for relationship in record["relationships"]:
 
                 # Get start and end node names
-                start_node=relationship.start_node
-                end_node=relationship.end_node
+                start_node_name=f':`{relationship.start_node._properties["name"]}`'
+                end_node_name=f':`{relationship.end_node._properties["name"]}`'
 
-                start_node_name=f':`{start_node._properties["name"]}`'
-                end_node_name=f':`{end_node._properties["name"]}`'
-
-                # Get relationship type
                 relationship_type = relationship.type
-
-                # Get the relationship properties
-                query_relationship=f'MATCH ({start_node_name})-[r:`{relationship_type}`]-({end_node_name}) RETURN r LIMIT 1'
-                relationship = self.execute_query(query_relationship)[0][0]
-
-                relationship_properties = {}
-                for key, value in relationship._properties.items():
-                    relationship_properties[key] = type(value).__name__
+                relationship_properties = relationship_and_properties.get(relationship_type, {})
 
                 # Create the final schema
-                query_relationship=f'({start_node_name} {node_and_properties[node_1_name]} )-[r:`{relationship_type}` {relationship_properties}]-({end_node_name} {node_and_properties[node_2_name]}) '
+                query_relationship=f'({start_node_name} {node_and_properties[start_node_name]} )-[r:`{relationship_type}` {relationship_properties}]-({end_node_name} {node_and_properties[end_node_name]}) '
                 schema_list.append(query_relationship)
-        
-        return schema_list
+
+        _SCHEMA_CACHE.set(key, schema_list)
+        return list(schema_list)
+
+    def invalidate_cache(self):
+        """
+        Drops the cached schema and query results of this database.
+        """
+        key = (self.uri, self.database)
+        _SCHEMA_CACHE.pop(key)
+        _QUERY_CACHE.clear(lambda query_key: query_key[:2] == key)
     
     def execute_query(self, query, parameters=None):
 
-        with self.driver.session(database=DB_NAME) as session:
+        with self.session() as session:
             results = session.run(query, parameters)
             return [record for record in results]
 
-    def execute_llm_query(self, prompt, n_results=5):
+    def read(self, query, parameters=None):
+        """
+        Runs a query in a managed read transaction, retried on transient errors.
 
-        embedding, execute_statement = get_similarity_query(prompt)
-        parameters =  {"embedding": embedding,"nresults":n_results}
+        Returns:
+            records (list): The records of the query.
+        """
+        def work(tx):
+            return [record for record in tx.run(query, parameters)]
 
-        with self.driver.session(database=DB_NAME) as session:
-            results = session.run(execute_statement, parameters)
+        with self.session() as session:
+            return session.execute_read(work)
 
-            return [record for record in results]
+    def write(self, query, parameters=None):
+        """
+        Runs a query in a managed write transaction, retried on transient errors.
+
+        Returns:
+            counters (neo4j.SummaryCounters): The update counters of the query.
+        """
+        def work(tx):
+            return tx.run(query, parameters).consume().counters
+
+        with self.session() as session:
+            counters = session.execute_write(work)
+        self.invalidate_cache()
+        return counters
+
+    def batch_write(self, query, rows, batch_size=BATCH_SIZE, parameters=None):
+        """
+        Writes rows in batches, one managed write transaction per batch. The query
+        receives each batch as $rows, e.g.
+
+            UNWIND $rows AS row MERGE (m:Material {name: row.name}) SET m += row.properties
+
+        Args:
+            query (str): A query starting with UNWIND $rows.
+            rows (list): The list of row dictionaries.
+            batch_size (int): Number of rows per transaction.
+            parameters (dict): Extra parameters shared by every batch.
+
+        Returns:
+            n_batches (int): The number of batches written.
+        """
+        def work(tx, batch):
+            tx.run(query, dict(parameters or {}, rows=batch)).consume()
+
+        n_batches = 0
+        with self.session() as session:
+            for i in range(0, len(rows), batch_size):
+                session.execute_write(work, rows[i:i + batch_size])
+                n_batches += 1
+        self.invalidate_cache()
+        return n_batches
+
+    def stream(self, query, parameters=None, fetch_size=1000):
+        """
+        Iterates over the records of a query as they arrive, fetching fetch_size
+        records at a time instead of materializing the whole result.
+
+        Yields:
+            record (neo4j.Record): The next record.
+        """
+        with self.session(fetch_size=fetch_size) as session:
+            for record in session.run(query, parameters):
+                yield record
+
+    def execute_llm_query(self, prompt, n_results=5, model=MODEL, backend='openai', use_cache=True):
+        """
+        Runs a vector similarity query for a prompt. The prompt embedding is cached on
+        disk and the records are cached in memory for QUERY_CACHE_TTL seconds, so a
+        repeated prompt returns without calling the embeddings api or the database.
+
+        Args:
+            prompt (str): The prompt.
+            n_results (int): Number of nearest materials.
+            model (str): The embedding model.
+            backend (str): 'openai' or 'local', the offline stand-in.
+            use_cache (bool): Whether to return cached records.
+
+        Returns:
+            records (list): The records with the material node 'sm' and its 'score'.
+        """
+        key = (self.uri, self.database, normalize_prompt(prompt), n_results, model, backend)
+        if use_cache:
+            records = _QUERY_CACHE.get(key)
+            if records is not None:
+                # A copy, so a caller changing the list does not change the cached records
+                return list(records)
+
+        embedding, execute_statement = get_similarity_query(prompt, model=model, backend=backend)
+        parameters =  {"embedding": embedding,"nresults":n_results}
 
+        records = self.read(execute_statement, parameters)
+        _QUERY_CACHE.set(key, records)
+        return list(records)
 
 if __name__ == "__main__":
 
@@ -5,13 +5,11 @@ import json
 import numpy as np
 from pymatgen.core.periodic_table import Element
 import pymatgen.core as pmat
-import pandas as pd
 
 from matgraphdb.utils.periodic_table import atomic_symbols
 from matgraphdb.utils.coord_geom import mp_coord_encoding
 from matgraphdb.utils import DB_DIR
 from matgraphdb.database.json.utils import PROPERTIES
-from matgraphdb.utils import LOGGER, ENCODING_DIR
 MATERIAL_FILES =  glob(DB_DIR + os.sep + '*.json')
 
 MATERIAL_PROPERTIES = []
@@ -96,25 +94,7 @@ for i,material_file in enumerate(MATERIAL_FILES):
 
             material_property_dict.update({node_key:property_value})
 
-    # # Check if encodings are present
-    # if os.path.exists(ENCODING_DIR):
-    #     encoding_files=glob(os.path.join(ENCODING_DIR,'*.csv'))
-    #     for encoding_file in encoding_files:
-    #         encoding_name=encoding_file.split(os.sep)[-1].split('.')[0]
-
-    #         df=pd.read_csv(encoding_file,index_col=0)
-
-    #         # Convert the dataframe values to a list of strings where the strings are the rows of the dataframe separated by a semicolon
-    #         df = df.apply(lambda x: ';'.join(map(str, x)), axis=1)
-    #         print(df.head())
-    #         # Where the encoding contains nan value replace with None:
-    #         df[f'{encoding_name}:float[]']=df[f'{encoding_name}:float[]'].apply(lambda x: None if 'nan' in x else x)
-
-    #         # Remove rows with that contain None values
-    #         df=df.dropna(subset=[f'{encoding_name}:float[]'])
-
-    #         material_property_dict.update({f'{encoding_name}:float[]': df.tolist()})
-    #     del df
+    # Encodings are added as float[] columns by create_node_csv.create_nodes(encoding_stores=...)
 
     MATERIAL_PROPERTIES.append(material_property_dict)
 
@@ -0,0 +1,377 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from matgraphdb.utils import NODE_DIR, RELATIONSHIP_DIR, LOGGER, timeit
+from matgraphdb.database.neo4j.graph_database import MatGraphDB, BATCH_SIZE
+
+# Number of concurrent writer threads
+N_WRITERS=4
+# Array delimiter used by neo4j-admin import csv files
+ARRAY_DELIMITER=';'
+
+TYPE_CASTS={
+    'int': int,
+    'long': int,
+    'short': int,
+    'byte': int,
+    'float': float,
+    'double': float,
+    'boolean': lambda value: str(value).lower() == 'true' if isinstance(value, str) else bool(value),
+    'string': str,
+}
+
+
+def _as_python(value):
+    # numpy scalars are not accepted as query parameters
+    return value.item() if hasattr(value, 'item') else value
+
+
+def parse_column_header(column):
+    """
+    Splits a neo4j-admin import header, e.g. 'band_gap:float' or ':START_ID(materials-ID)'.
+
+    Args:
+        column (str): The column header.
+
+    Returns:
+        tuple: (name, field_type, id_space). field_type is None for untyped columns and
+            id_space is None unless the column is an ID, START_ID or END_ID column.
+    """
+    match = re.match(r'^(.*?):(ID|START_ID|END_ID)\((.+?)\)$', column)
+    if match:
+        return match.group(1), match.group(2), match.group(3)
+    if ':' in column:
+        name, field_type = column.rsplit(':', 1)
+        return name, field_type, None
+    return column, None, None
+
+
+def cast_value(value, field_type):
+    """
+    Casts a csv value to the python type of its header. Missing values return None.
+    """
+    if field_type is not None and field_type.endswith('[]'):
+        if isinstance(value, str):
+            value = value.split(ARRAY_DELIMITER)
+        elif value is None or (not isinstance(value, (list, tuple)) and pd.isna(value)):
+            return None
+        cast = TYPE_CASTS.get(field_type[:-2], _as_python)
+        return [cast(x) for x in value]
+
+    if value is None or pd.isna(value):
+        return None
+    cast = TYPE_CASTS.get(field_type, _as_python)
+    return cast(value)
+
+
+def _property_columns(df):
+    # Returns (column, name, field_type) for every column stored as a property
+    columns = []
+    for column in df.columns:
+        name, field_type, id_space = parse_column_header(column)
+        if id_space is not None or field_type in ('LABEL', 'TYPE') or name == '':
+            continue
+        columns.append((column, name, field_type))
+    return columns
+
+
+def _rows_properties(df, columns):
+    properties = []
+    for record in df[[column for column, _, _ in columns]].itertuples(index=False, name=None):
+        row_properties = {}
+        for value, (_, name, field_type) in zip(record, columns):
+            value = cast_value(value, field_type)
+            if value is not None:
+                row_properties[name] = value
+        properties.append(row_properties)
+    return properties
+
+
+def _id_column(df, field_type='ID'):
+    for column in df.columns:
+        _, column_type, id_space = parse_column_header(column)
+        if column_type == field_type:
+            return column, id_space
+    raise ValueError(f"No {field_type} column in {list(df.columns)}")
+
+
+def _read(df_or_csv):
+    if isinstance(df_or_csv, pd.DataFrame):
+        return df_or_csv
+    return pd.read_csv(df_or_csv)
+
+
+def node_rows(node_df):
+    """
+    Converts a node dataframe produced by create_node_csv.create_nodes into UNWIND rows.
+
+    Args:
+        node_df (pd.DataFrame): The node dataframe.
+
+    Returns:
+        tuple: (label, rows) where each row is {'name': ..., 'properties': {...}}.
+    """
+    labels = node_df['type:LABEL'].unique()
+    if len(labels) != 1:
+        raise ValueError(f"Expected one node label per dataframe, found {labels}")
+
+    columns = [column for column in _property_columns(node_df) if column[1] != 'name']
+    names = node_df['name:string'].astype(str).tolist()
+    properties = _rows_properties(node_df, columns)
+    rows = [{'name': name, 'properties': props} for name, props in zip(names, properties)]
+    return labels[0], rows
+
+
+def relationship_rows(relationship_df, node_a_df, node_b_df):
+    """
+    Converts a relationship dataframe produced by create_relationship_csv.create_relationships
+    into UNWIND rows. The START_ID and END_ID columns are mapped to the node names,
+    which are stable across loads, unlike the positional csv ids.
+
+    Args:
+        relationship_df (pd.DataFrame): The relationship dataframe.
+        node_a_df (pd.DataFrame): The node dataframe of the start nodes.
+        node_b_df (pd.DataFrame): The node dataframe of the end nodes.
+
+    Returns:
+        tuple: (relationship_type, rows) where each row is {'start': ..., 'end': ..., 'properties': {...}}.
+    """
+    types = relationship_df[':TYPE'].unique()
+    if len(types) != 1:
+        raise ValueError(f"Expected one relationship type per dataframe, found {types}")
+
+    start_column, _ = _id_column(relationship_df, 'START_ID')
+    end_column, _ = _id_column(relationship_df, 'END_ID')
+    node_a_id_column, _ = _id_column(node_a_df)
+    node_b_id_column, _ = _id_column(node_b_df)
+
+    start_names = relationship_df[start_column].map(pd.Series(node_a_df['name:string'].values, index=node_a_df[node_a_id_column].values))
+    end_names = relationship_df[end_column].map(pd.Series(node_b_df['name:string'].values, index=node_b_df[node_b_id_column].values))
+
+    missing = start_names.isna() | end_names.isna()
+    if missing.any():
+        LOGGER.error(f"{missing.sum()} relationships of type {types[0]} reference unknown node ids and are skipped")
+
+    properties = _rows_properties(relationship_df, _property_columns(relationship_df))
+    rows = [{'start': str(start), 'end': str(end), 'properties': props}
+            for start, end, props, skip in zip(start_names, end_names, properties, missing)
+            if not skip]
+    return types[0], rows
+
+
+def create_constraints(labels, matgraphdb):
+    """
+    Creates a uniqueness constraint on name for every label. The constraint is backed by
+    an index, so the MERGE and MATCH lookups by name of the loader are index seeks.
+
+    Args:
+        labels (list): The node labels.
+        matgraphdb (MatGraphDB): An open connection.
+    """
+    for label in labels:
+        statement = (f"CREATE CONSTRAINT `{label.lower()}_name` IF NOT EXISTS "
+                     f"FOR (n:`{label}`) REQUIRE n.name IS UNIQUE")
+        matgraphdb.write(statement)
+
+
+def merge_nodes_statement(label):
+    return (f"UNWIND $rows AS row\n"
+            f"MERGE (n:`{label}` {{name: row.name}})\n"
+            f"SET n += row.properties")
+
+
+def merge_relationships_statement(node_a_label, node_b_label, relationship_type, accumulate=None):
+    """
+    Generates the parameterized statement merging a batch of relationships.
+
+    Args:
+        node_a_label (str): Label of the start nodes.
+        node_b_label (str): Label of the end nodes.
+        relationship_type (str): The relationship type.
+        accumulate (list): Optional, properties that are summed with the stored value when the
+            relationship already exists, e.g. ['weight'] when adding new materials.
+
+    Returns:
+        str: The statement, it expects the batch as $rows.
+    """
+    statement = (f"UNWIND $rows AS row\n"
+                 f"MATCH (a:`{node_a_label}` {{name: row.start}})\n"
+                 f"MATCH (b:`{node_b_label}` {{name: row.end}})\n"
+                 f"MERGE (a)-[r:`{relationship_type}`]->(b)\n"
+                 f"ON CREATE SET r += row.properties")
+    if accumulate:
+        updates = ', '.join(f"r.`{name}` = coalesce(r.`{name}`, 0) + coalesce(row.properties.`{name}`, 0)" for name in accumulate)
+        statement += f"\nON MATCH SET {updates}"
+    else:
+        statement += "\nON MATCH SET r += row.properties"
+    return statement
+
+
+def partition_rows(rows, n_partitions, key):
+    """
+    Splits rows into n_partitions by hashing key(row), so equal keys land in the same partition.
+    """
+    partitions = [[] for _ in range(n_partitions)]
+    for row in rows:
+        partitions[hash(key(row)) % n_partitions].append(row)
+    return partitions
+
+
+def pair_rounds(n_buckets):
+    """
+    Round robin schedule of every unordered pair of buckets, n_buckets even. Each round
+    is a list of pairs in which every bucket appears once, the last round holds the
+    (bucket, bucket) pairs.
+    """
+    rounds = []
+    for r in range(n_buckets - 1):
+        pairs = [(n_buckets - 1, r)]
+        for i in range(1, n_buckets // 2):
+            pairs.append(((r + i) % (n_buckets - 1), (r - i) % (n_buckets - 1)))
+        rounds.append(pairs)
+    rounds.append([(bucket, bucket) for bucket in range(n_buckets)])
+    return rounds
+
+
+def _run_writers(matgraphdb, statement, partitions, batch_size, n_writers):
+    partitions = [partition for partition in partitions if partition]
+    if not partitions:
+        return 0
+    with ThreadPoolExecutor(max_workers=min(n_writers, len(partitions))) as executor:
+        futures = [executor.submit(matgraphdb.batch_write, statement, partition, batch_size) for partition in partitions]
+        return sum(future.result() for future in futures)
+
+
+@timeit
+def load_nodes(node_df, matgraphdb=None, batch_size=BATCH_SIZE, n_writers=N_WRITERS):
+    """
+    Merges nodes into a running database. Existing nodes, matched by name, have their
+    properties updated, so reloading a csv with new materials only adds the new ones.
+
+    Args:
+        node_df (pd.DataFrame or str): The node dataframe or its csv file.
+        matgraphdb (MatGraphDB): Optional, an open connection to reuse. A new one is opened otherwise.
+        batch_size (int): Number of rows per transaction.
+        n_writers (int): Number of concurrent writer threads.
+
+    Returns:
+        int: The number of nodes sent.
+    """
+    if matgraphdb is None:
+        with MatGraphDB() as matgraphdb:
+            return load_nodes(node_df, matgraphdb=matgraphdb, batch_size=batch_size, n_writers=n_writers)
+
+    label, rows = node_rows(_read(node_df))
+    create_constraints([label], matgraphdb)
+
+    # Each node is touched by exactly one row, so the writers never contend for node locks
+    partitions = [rows[i::n_writers] for i in range(n_writers)]
+    n_batches = _run_writers(matgraphdb, merge_nodes_statement(label), partitions, batch_size, n_writers)
+    LOGGER.info(f"Merged {len(rows)} {label} nodes in {n_batches} batches")
+    return len(rows)
+
+
+@timeit
+def load_relationships(relationship_df, node_a_df, node_b_df, matgraphdb=None,
+                       accumulate=None, batch_size=BATCH_SIZE, n_writers=N_WRITERS):
+    """
+    Merges relationships into a running database.
+
+    Creating a relationship locks both of its nodes, so two writers that share a node
+    serialize on it and can deadlock. The rows are therefore partitioned so that the
+    writers of a round never share a node.
+
+    Between two labels the start and end nodes are distinct, so the rows are hashed into
+    an n_writers x n_writers grid of (start, end) buckets and loaded in n_writers rounds.
+    In round k writer i loads bucket (i, (i+k) % n_writers).
+
+    Within one label a node can be the start of one row and the end of another, so both
+    ends are hashed into the same 2*n_writers buckets and the rows grouped by their
+    unordered pair of buckets. Each round of pair_rounds loads pairs that have no bucket
+    in common.
+
+    Args:
+        relationship_df (pd.DataFrame or str): The relationship dataframe or its csv file.
+        node_a_df (pd.DataFrame or str): The start node dataframe or its csv file.
+        node_b_df (pd.DataFrame or str): The end node dataframe or its csv file.
+        matgraphdb (MatGraphDB): Optional, an open connection to reuse. A new one is opened otherwise.
+        accumulate (list): Optional, properties summed with the stored value for existing relationships.
+        batch_size (int): Number of rows per transaction.
+        n_writers (int): Number of concurrent writer threads.
+
+    Returns:
+        int: The number of relationships sent.
+    """
+    if matgraphdb is None:
+        with MatGraphDB() as matgraphdb:
+            return load_relationships(relationship_df, node_a_df, node_b_df, matgraphdb=matgraphdb,
+                                      accumulate=accumulate, batch_size=batch_size, n_writers=n_writers)
+
+    node_a_df = _read(node_a_df)
+    node_b_df = _read(node_b_df)
+    node_a_label = node_a_df['type:LABEL'].iloc[0]
+    node_b_label = node_b_df['type:LABEL'].iloc[0]
+    relationship_type, rows = relationship_rows(_read(relationship_df), node_a_df, node_b_df)
+
+    create_constraints({node_a_label, node_b_label}, matgraphdb)
+    statement = merge_relationships_statement(node_a_label, node_b_label, relationship_type, accumulate=accumulate)
+
+    n_batches = 0
+    if node_a_label != node_b_label:
+        start_buckets = partition_rows(rows, n_writers, key=lambda row: row['start'])
+        grid = [partition_rows(bucket, n_writers, key=lambda row: row['end']) for bucket in start_buckets]
+
+        for k in range(n_writers):
+            partitions = [grid[i][(i + k) % n_writers] for i in range(n_writers)]
+            n_batches += _run_writers(matgraphdb, statement, partitions, batch_size, n_writers)
+    else:
+        n_buckets = 2 * n_writers
+        pairs = {}
+        for row in rows:
+            a = hash(row['start']) % n_buckets
+            b = hash(row['end']) % n_buckets
+            pairs.setdefault((min(a, b), max(a, b)), []).append(row)
+
+        for pairs_round in pair_rounds(n_buckets):
+            partitions = [pairs.get((min(a, b), max(a, b)), []) for a, b in pairs_round]
+            n_batches += _run_writers(matgraphdb, statement, partitions, batch_size, n_writers)
+
+    LOGGER.info(f"Merged {len(rows)} {relationship_type} relationships "
+                f"({node_a_label})->({node_b_label}) in {n_batches} batches")
+    return len(rows)
+
+
+def main():
+    node_path = os.path.join(NODE_DIR, 'new')
+    relationship_path = os.path.join(RELATIONSHIP_DIR, 'new')
+
+    LOGGER.info('#' * 100)
+    LOGGER.info('Loading nodes and relationships into the running database')
+    LOGGER.info('#' * 100)
+
+    with MatGraphDB() as matgraphdb:
+        # Nodes first, so every relationship finds both of its ends
+        for node_file in ['elements.csv', 'chemenv_names.csv', 'chemenv_element_names.csv', 'materials.csv']:
+            load_nodes(os.path.join(node_path, node_file), matgraphdb=matgraphdb)
+
+        relationships = [
+            ('chemenv_chemenv_geometric-electric.csv', 'chemenv_names.csv', 'chemenv_names.csv'),
+            ('chemenv_chemenv_geometric.csv', 'chemenv_names.csv', 'chemenv_names.csv'),
+            ('chemenv_chemenv_electric.csv', 'chemenv_names.csv', 'chemenv_names.csv'),
+            ('chemenv_elements.csv', 'chemenv_names.csv', 'elements.csv'),
+            ('materials_elements.csv', 'materials.csv', 'elements.csv'),
+            ('materials_chemenv.csv', 'materials.csv', 'chemenv_names.csv'),
+            ('materials_chemenvElement.csv', 'materials.csv', 'chemenv_element_names.csv'),
+            ]
+        for relationship_file, node_a_file, node_b_file in relationships:
+            load_relationships(os.path.join(relationship_path, relationship_file),
+                               node_a_df=os.path.join(node_path, node_a_file),
+                               node_b_df=os.path.join(node_path, node_b_file),
+                               matgraphdb=matgraphdb)
+
+
+if __name__ == '__main__':
+    main()
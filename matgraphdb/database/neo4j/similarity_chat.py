@@ -1,10 +1,19 @@
 import os
-import json
+import re
+import hashlib
+from functools import lru_cache
 
+import numpy as np
 import openai
 import tiktoken
 
-from matgraphdb.utils import OPENAI_API_KEY
+from matgraphdb.utils import OPENAI_API_KEY, ENCODING_DIR
+
+MODEL="text-embedding-3-small"
+# Prompt embeddings are stored here, one .npy file per (model, prompt)
+PROMPT_EMBEDDING_DIR=os.path.join(ENCODING_DIR,'prompt_embeddings')
+# Dimension of the local stand-in embedding, same as text-embedding-3-small
+LOCAL_EMBEDDING_DIM=1536
 
 def num_tokens_from_string(string: str, encoding_name: str) -> int:
     """Returns the number of tokens in a text string."""
@@ -12,27 +21,88 @@ def num_tokens_from_string(string: str, encoding_name: str) -> int:
     num_tokens = len(encoding.encode(string))
     return num_tokens
 
-def get_embedding(text, client, model="text-embedding-3-small"):
+@lru_cache(maxsize=1)
+def get_client():
+    """Returns the OpenAI client shared by every embedding and chat request of this process."""
+    return openai.OpenAI(api_key=OPENAI_API_KEY)
+
+def get_embedding(text, client, model=MODEL):
    text = text.replace("\n", " ")
    return client.embeddings.create(input = [text], model=model).data[0].embedding
 
-def get_similarity_query(prompt):
-    models=["text-embedding-3-small","text-embedding-3-large","ada v2"]
-    cost_per_token=[0.00000002,0.00000013,0.00000010]
-    model_index=0
-    
-    MODEL=models[model_index]
+def local_embedding(text, model=MODEL, dimensions=LOCAL_EMBEDDING_DIM):
+    """
+    Deterministic stand-in for the embeddings API, usable offline and in tests.
+    Words are hashed into a bag of words vector, so prompts sharing words are similar.
+
+    Args:
+        text (str): The text to embed.
+        model (str): Only used to seed the hashing, so different models give different vectors.
+        dimensions (int): The embedding dimension.
 
-    client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    Returns:
+        list: The unit norm embedding.
+    """
+    embedding = np.zeros(dimensions, dtype=np.float32)
+    for word in re.findall(r'\w+', text.lower()):
+        digest = hashlib.md5(f"{model}:{word}".encode()).digest()
+        index = int.from_bytes(digest[:4], 'little') % dimensions
+        embedding[index] += 1.0 if digest[4] % 2 else -1.0
+    norm = np.linalg.norm(embedding)
+    if norm > 0:
+        embedding /= norm
+    return embedding.tolist()
+
+def normalize_prompt(prompt):
+    """Lower cases and collapses whitespace so near-repeated prompts share a cache entry."""
+    return ' '.join(prompt.lower().split())
 
-    embedding=get_embedding(prompt,client, model=MODEL)
+def prompt_key(prompt, model=MODEL):
+    return hashlib.sha256(f"{model}\n{normalize_prompt(prompt)}".encode()).hexdigest()
+
+def get_cached_embedding(prompt, model=MODEL, backend='openai', cache_dir=PROMPT_EMBEDDING_DIR):
+    """
+    Returns the embedding of a prompt, calling the backend only the first time the
+    prompt is seen. Embeddings are stored on disk keyed by the prompt hash and model.
 
-    execute_statement="""
-    CALL db.index.vector.queryNodes('material-text-embedding-3-small-embeddings', $nresults, $embedding)
+    Args:
+        prompt (str): The prompt.
+        model (str): The embedding model.
+        backend (str): 'openai' or 'local', the offline stand-in.
+        cache_dir (str): Directory of the prompt embeddings. None disables the disk cache.
+
+    Returns:
+        list: The embedding.
+    """
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, backend, model, prompt_key(prompt, model) + '.npy')
+        if os.path.exists(cache_file):
+            return np.load(cache_file).tolist()
+
+    if backend == 'openai':
+        embedding = get_embedding(prompt, get_client(), model=model)
+    elif backend == 'local':
+        embedding = local_embedding(prompt, model=model)
+    else:
+        raise ValueError(f"Unknown embedding backend {backend}")
+
+    if cache_dir is not None:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # Write then rename, so a concurrent reader never sees a partial file
+        tmp_file = cache_file + f'.{os.getpid()}.tmp.npy'
+        np.save(tmp_file, np.asarray(embedding, dtype=np.float32))
+        os.replace(tmp_file, cache_file)
+    return embedding
+
+def get_similarity_query(prompt, model=MODEL, backend='openai'):
+    embedding=get_cached_embedding(prompt, model=model, backend=backend)
+
+    execute_statement=f"""
+    CALL db.index.vector.queryNodes('material-{model}-embeddings', $nresults, $embedding)
     YIELD node as sm, score
     RETURN sm, score
     """
-    
+
     return embedding, execute_statement
 
 # if __name__ == "__main__":
@@ -40,4 +110,4 @@ def get_similarity_query(prompt):
 #     # prompt = "What are some materials with a large band gap?"
 #     prompt = "band_gap greater than 1.0?"
 #     # prompt = "What are some materials with a with hexagonal crystal system?"
-#     similarity_query(prompt,n_results=20)
\ No newline at end of file
+#     similarity_query(prompt,n_results=20)
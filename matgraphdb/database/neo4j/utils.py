@@ -2,19 +2,23 @@ from typing import List
 
 from neo4j import GraphDatabase
 
-from matgraphdb.utils import PASSWORD,USER,LOCATION,DB_NAME
+from matgraphdb.utils import PASSWORD,USER,LOCATION,GRAPH_DB_NAME as DB_NAME
+from matgraphdb.database.neo4j.graph_database import MatGraphDB
 
-def execute_statements(statements: List[str]):
+def execute_statements(statements: List[str], matgraphdb: MatGraphDB=None):
+    """
+    Runs statements in managed write transactions over one pooled driver.
 
-    connection = GraphDatabase.driver(LOCATION, auth=(USER, PASSWORD))
-    session = connection.session(database=DB_NAME)
+    Args:
+        statements (List[str]): The statements to run.
+        matgraphdb (MatGraphDB): Optional, an open connection to reuse. A new one is opened otherwise.
+    """
+    if matgraphdb is None:
+        with MatGraphDB() as matgraphdb:
+            return execute_statements(statements, matgraphdb=matgraphdb)
 
     for execute_statement in statements:
-        session.run(execute_statement)
-
-
-    session.close()
-    connection.close()
+        matgraphdb.write(execute_statement)
   
 
 def create_database(connection):
@@ -62,9 +66,9 @@ def delete_database():
 
 def delete_nodes_relationships():
     execute_statment = ["MATCH (n) DETACH DELETE n"]
-    execute_statements(execute_statment,n_cores=1)
+    execute_statements(execute_statment)
 
 def delete_relationships():
     execute_statment = ["MATCH ()-[r]-() DELETE r"]
-    execute_statements(execute_statment,n_cores=1)
+    execute_statements(execute_statment)
 
@@ -4,19 +4,22 @@ from multiprocessing import Pool
 
 from matgraphdb.utils import DB_DIR, N_CORES
 
-def process_database(func, n_cores=N_CORES):
+def process_database(func, n_cores=N_CORES, database_files=None):
     """
     func: A function that takes in a json file to process
+    database_files: Optional, the files to process, e.g. only the stale ones. Defaults to every file in DB_DIR
     """
     
-    database_files=glob(DB_DIR + os.sep +'*.json')
+    if database_files is None:
+        database_files=glob(DB_DIR + os.sep +'*.json')
 
     if n_cores==1:
+        results=[]
         for i,file in enumerate(database_files[:]):
             if i%100==0:
                 print(i)
             print(file)
-            func(file)
+            results.append(func(file))
     else:
         with Pool(n_cores) as p:
             results=p.map(func, database_files)
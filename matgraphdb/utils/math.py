@@ -64,23 +64,71 @@ def cosine_similarity(x,y):
 def distance_similarity(x,y):
     return np.linalg.norm(x/np.linalg.norm(x) - y/np.linalg.norm(y))
 
+def similarity_matrices(encodings):
+    """Pairwise cosine and distance similarity of all encodings with one normalized matmul
 
-def similarity_score(point_set_1, point_set_2, loss=None,max_iter=100,alpha=1,threshold_plan =0):
-    if loss is None:
-        def loss(x, y):
-            return np.abs(x - y)
+    Parameters
+    ----------
+    encodings : np.ndarray
+        The stacked encodings (n_samples, n_features)
+
+    Returns
+    -------
+    Tuple[np.ndarray,np.ndarray]
+        The cosine and distance similarity matrices (n_samples, n_samples), 
+        matching cosine_similarity and distance_similarity elementwise
+    """
+    encodings = np.asarray(encodings, dtype=float)
+    normalized = encodings / np.linalg.norm(encodings, axis=1, keepdims=True)
+    cosine_mat = normalized @ normalized.T
+    # |a - b|^2 = 2 - 2 a.b for unit vectors
+    distance_mat = np.sqrt(np.clip(2.0 - 2.0 * cosine_mat, 0.0, None))
+    return cosine_mat, distance_mat
 
-    # https://pythonot.github.io/gen_modules/ot.gromov.html
-    C1 = cdist(point_set_1, point_set_1)
-    C2 = cdist(point_set_2, point_set_2)
 
-    C1 /= C1.max()
-    C2 /= C2.max()
+def abs_loss(x, y):
+    return np.abs(x - y)
 
-    n_p=point_set_1.shape[0]
-    n_q=point_set_2.shape[0]
-    p = ot.unif(n_p)
-    q = ot.unif(n_q)
+
+def normalized_distance_matrix(point_set):
+    """Pairwise distance matrix of a point set scaled to a maximum of 1
+
+    Parameters
+    ----------
+    point_set : np.ndarray
+        The points (n_points,3)
+
+    Returns
+    -------
+    np.ndarray
+        The normalized distance matrix (n_points,n_points)
+    """
+    C = cdist(point_set, point_set)
+    C /= C.max()
+    return C
+
+
+def gromov_wasserstein_score(C1, C2, loss=None,max_iter=100,alpha=1,threshold_plan =0):
+    """Pointwise Gromov-Wasserstein distance between two precomputed distance matrices
+
+    Parameters
+    ----------
+    C1 : np.ndarray
+        Normalized distance matrix of the first point set
+    C2 : np.ndarray
+        Normalized distance matrix of the second point set
+
+    Returns
+    -------
+    Tuple[float,float]
+        The estimated distance and its standard deviation
+    """
+    if loss is None:
+        loss = abs_loss
+
+    # https://pythonot.github.io/gen_modules/ot.gromov.html
+    p = ot.unif(C1.shape[0])
+    q = ot.unif(C2.shape[0])
     pgw, plog = ot.gromov.pointwise_gromov_wasserstein(C1, C2, p, q, loss, 
                                                     max_iter=max_iter,
                                                     alpha=alpha,
@@ -90,6 +138,12 @@ def similarity_score(point_set_1, point_set_2, loss=None,max_iter=100,alpha=1,th
     return plog['gw_dist_estimated'],plog['gw_dist_std']
 
 
+def similarity_score(point_set_1, point_set_2, loss=None,max_iter=100,alpha=1,threshold_plan =0):
+    C1 = normalized_distance_matrix(point_set_1)
+    C2 = normalized_distance_matrix(point_set_2)
+    return gromov_wasserstein_score(C1, C2, loss=loss, max_iter=max_iter, alpha=alpha, threshold_plan=threshold_plan)
+
+
 def softmax(arr):
     # print(exp_arr.sum())
     exp_arr = np.exp(arr- np.max(arr))  # subtract max for numerical stability
@@ -2,47 +2,75 @@ import os
 
 import numpy as np
 import pandas as pd
+import torch
 
 from torch_geometric.loader import DataLoader
 from matgraphdb.utils.plotting import plot_similarity_matrix,plot_training_curves
-from matgraphdb.utils.math import distance_similarity, cosine_similarity
-
-def compare_polyhedra(run_dir, dataset, model, device):
-
-    loader = DataLoader(dataset, batch_size=1,shuffle=False)
-    expected_values = []
+from matgraphdb.utils.math import similarity_matrices
+
+def evaluate_polyhedra(dataset, model, device, batch_size=512):
+    """Runs the model over the dataset in batches and stacks the encodings
+
+    Parameters
+    ----------
+    dataset : torch_geometric.data.Dataset
+        The polyhedra dataset
+    model : torch.nn.Module
+        Model with a forward returning predictions first and an encode_2 method
+    device : torch.device
+        The device to evaluate on
+    batch_size : int, optional
+        Number of graphs per batch, by default 512
+
+    Returns
+    -------
+    Tuple[dict,np.ndarray,List[str],List[int]]
+        The prediction columns, the encodings (n_samples, n_features), 
+        the labels and the number of nodes of each sample
+    """
+    loader = DataLoader(dataset, batch_size=batch_size,shuffle=False)
     columns = {
         'expected_value':[],
         'prediction_value':[],
         'percent_error':[],
         'label':[],
+        'n_nodes':[],
         }
-    polyhedra_encodings = []
-    n_nodes = []
+    encodings = []
     model.eval()
-    for sample in loader:
-        sample.to(device)
-        predictions = model(sample)
-        for real, pred, encoding in zip(sample.y,predictions[0],model.encode_2(sample)):
-        #     print('______________________________________________________')
-            print(f"Prediction : {pred.item()} | Expected : {real.item()} | Percent error : { 100*abs(real.item() - pred.item()) / real.item() }")
-            columns['prediction_value'].append(round(pred.item(),3))
-            columns['expected_value'].append(round(real.item(),3))
-            columns['percent_error'].append(round(100* abs(real.item() - pred.item()) / real.item(),3))
-            columns['label'].append(sample.label[0])
-            expected_values.append(real.item())
-            polyhedra_encodings.append((np.array(encoding.tolist()),sample.label[0] ))
-
-    distance_similarity_mat = np.zeros(shape = (len(polyhedra_encodings),len(polyhedra_encodings)))
-    cosine_similarity_mat = np.zeros(shape = (len(polyhedra_encodings),len(polyhedra_encodings)))
-    for i,poly_a in enumerate(polyhedra_encodings):
-        for j,poly_b in enumerate(polyhedra_encodings):
-            # print('_______________________________________')
-            # print(f'Poly_a - {poly_a[1]} | Poly_b - {poly_b[1]}')
-            # print(f'Cosine : {cosine_similarity(x=poly_a[0],y=poly_b[0])}')
-            # print(f'Distance : {distance_similarity(x=poly_a[0],y=poly_b[0])}')
-            distance_similarity_mat[i,j] = distance_similarity(x=poly_a[0],y=poly_b[0]).round(3)
-            cosine_similarity_mat[i,j] = cosine_similarity(x=poly_a[0],y=poly_b[0]).round(3)
+    with torch.no_grad():
+        for sample in loader:
+            sample.to(device)
+            predictions = model(sample)
+            encoding = model.encode_2(sample)
+
+            # float64 like the python floats of .item(), so rounding to 3 decimals writes 0.123, not 0.12300000339746475
+            real = sample.y.detach().cpu().numpy().reshape(-1).astype(np.float64)
+            pred = predictions[0].detach().cpu().numpy().reshape(-1).astype(np.float64)
+            percent_error = 100 * np.abs(real - pred) / real
+            n_nodes = torch.bincount(sample.batch, minlength=sample.num_graphs).tolist()
+
+            for i in range(sample.num_graphs):
+                print(f"Prediction : {pred[i]} | Expected : {real[i]} | Percent error : { percent_error[i] }")
+            columns['prediction_value'].extend(pred.round(3).tolist())
+            columns['expected_value'].extend(real.round(3).tolist())
+            columns['percent_error'].extend(percent_error.round(3).tolist())
+            columns['label'].extend(list(sample.label))
+            columns['n_nodes'].extend(n_nodes)
+            encodings.append(encoding.detach().cpu().numpy().astype(np.float64))
+
+    encodings = np.concatenate(encodings, axis=0)
+    return columns, encodings, columns['label'], columns['n_nodes']
+
+def compare_polyhedra(run_dir, dataset, model, device, batch_size=512):
+
+    columns, encodings, names, n_nodes = evaluate_polyhedra(dataset, model, device, batch_size=batch_size)
+    columns.pop('n_nodes')
+    polyhedra_encodings = list(zip(encodings, names))
+
+    cosine_similarity_mat, distance_similarity_mat = similarity_matrices(encodings)
+    distance_similarity_mat = distance_similarity_mat.round(3)
+    cosine_similarity_mat = cosine_similarity_mat.round(3)
             
     print('________________________________________________________________')
     poly_type_str = ''
@@ -86,50 +114,14 @@ def compare_polyhedra(run_dir, dataset, model, device):
     
 
 
-def compare_polyhedra_old(run_dir, dataset, model, device):
+def compare_polyhedra_old(run_dir, dataset, model, device, batch_size=512):
 
-    loader = DataLoader(dataset, batch_size=1,shuffle=False)
-    expected_values = []
-    columns = {
-        'expected_value':[],
-        'prediction_value':[],
-        'percent_error':[],
-        'label':[],
-        'n_nodes':[],
-        }
-    polyhedra_encodings = []
-    n_nodes = []
-    model.eval()
-    for sample in loader:
-        sample.to(device)
-        predictions = model(sample)
-        # print(sample.label)
-        # print(sample.x)
-        for real, pred, encoding,pos in zip(sample.y,predictions[0],model.encode_2(sample),sample.node_stores[0]['pos']):
-        #     print('______________________________________________________')
-            print(f"Prediction : {pred.item()} | Expected : {real.item()} | Percent error : { 100*abs(real.item() - pred.item()) / real.item() }")
-            columns['prediction_value'].append(round(pred.item(),3))
-            columns['expected_value'].append(round(real.item(),3))
-            columns['percent_error'].append(round(100* abs(real.item() - pred.item()) / real.item(),3))
-            columns['label'].append(sample.label[0])
-            columns['n_nodes'].append(sample.num_nodes)
-            
-            # print(f"Encodings : {encoding.tolist()}")
-            n_node = len(pos)
-            n_nodes.append(n_node)
-            expected_values.append(real.item())
-            polyhedra_encodings.append((np.array(encoding.tolist()),sample.label[0] , sample.num_nodes ))
-
-    distance_similarity_mat = np.zeros(shape = (len(polyhedra_encodings),len(polyhedra_encodings)))
-    cosine_similarity_mat = np.zeros(shape = (len(polyhedra_encodings),len(polyhedra_encodings)))
-    for i,poly_a in enumerate(polyhedra_encodings):
-        for j,poly_b in enumerate(polyhedra_encodings):
-            # print('_______________________________________')
-            # print(f'Poly_a - {poly_a[1]} | Poly_b - {poly_b[1]}')
-            # print(f'Cosine : {cosine_similarity(x=poly_a[0],y=poly_b[0])}')
-            # print(f'Distance : {distance_similarity(x=poly_a[0],y=poly_b[0])}')
-            distance_similarity_mat[i,j] = distance_similarity(x=poly_a[0],y=poly_b[0]).round(3)
-            cosine_similarity_mat[i,j] = cosine_similarity(x=poly_a[0],y=poly_b[0]).round(3)
+    columns, encodings, names, n_nodes = evaluate_polyhedra(dataset, model, device, batch_size=batch_size)
+    polyhedra_encodings = list(zip(encodings, names, n_nodes))
+
+    cosine_similarity_mat, distance_similarity_mat = similarity_matrices(encodings)
+    distance_similarity_mat = distance_similarity_mat.round(3)
+    cosine_similarity_mat = cosine_similarity_mat.round(3)
             
     print('________________________________________________________________')
     poly_type_str = ''
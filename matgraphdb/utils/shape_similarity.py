@@ -0,0 +1,149 @@
+import hashlib
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+from matgraphdb.utils.config import N_CORES
+from matgraphdb.utils.math import normalized_distance_matrix, gromov_wasserstein_score
+from matgraphdb.utils.shapes import PLUTONIC_POLYS, test_polys, test_names
+
+# Reference distance matrices of the worker processes, set once per worker
+_REFERENCE_MATRICES = None
+
+
+def shape_key(point_set):
+    """Hash of a point set, used to cache its distance matrix
+
+    Parameters
+    ----------
+    point_set : np.ndarray
+        The points (n_points,3)
+
+    Returns
+    -------
+    str
+        The hex digest of the point coordinates
+    """
+    point_set = np.ascontiguousarray(point_set, dtype=float)
+    return hashlib.sha1(point_set.tobytes() + str(point_set.shape).encode()).hexdigest()
+
+
+def _init_worker(reference_matrices):
+    global _REFERENCE_MATRICES
+    _REFERENCE_MATRICES = reference_matrices
+
+
+def _compare_task(C, **kwargs):
+    scores = np.zeros(len(_REFERENCE_MATRICES))
+    stds = np.zeros(len(_REFERENCE_MATRICES))
+    for i, C_ref in enumerate(_REFERENCE_MATRICES):
+        scores[i], stds[i] = gromov_wasserstein_score(C, C_ref, **kwargs)
+    return scores, stds
+
+
+class ShapeSimilarityService:
+    """Batched Gromov-Wasserstein shape similarity between polyhedra and reference shapes
+
+    The normalized distance matrix of every point set is computed once and cached by
+    shape_key. The reference shapes are loaded once when the service is created and
+    sent once to each worker of the pool, and many-to-many comparisons are split by
+    query shape across the workers.
+
+    Parameters
+    ----------
+    references : List[Tuple[np.ndarray,str]], optional
+        The reference (vertices, name) pairs, by default PLUTONIC_POLYS
+    n_cores : int, optional
+        Number of worker processes, by default N_CORES
+    loss : callable, optional
+        The loss passed to pointwise_gromov_wasserstein, by default abs_loss
+    max_iter : int, optional
+    alpha : float, optional
+    threshold_plan : float, optional
+    """
+
+    def __init__(self, references=None, n_cores=N_CORES, loss=None, max_iter=100, alpha=1, threshold_plan=0):
+        if references is None:
+            references = PLUTONIC_POLYS
+
+        self.n_cores = n_cores
+        self.gw_kwargs = dict(loss=loss, max_iter=max_iter, alpha=alpha, threshold_plan=threshold_plan)
+
+        self._distance_matrices = {}
+        self.reference_names = [name for _, name in references]
+        self.reference_matrices = [self.distance_matrix(vertices) for vertices, _ in references]
+
+    @classmethod
+    def from_test_polys(cls, **kwargs):
+        """Service with the test polyhedra of matgraphdb.utils.shapes as references"""
+        return cls(references=list(zip(test_polys, test_names)), **kwargs)
+
+    def distance_matrix(self, point_set, key=None):
+        """Normalized distance matrix of a point set, computed once per shape
+
+        Parameters
+        ----------
+        point_set : np.ndarray
+            The points (n_points,3)
+        key : str, optional
+            Cache key, by default shape_key(point_set)
+
+        Returns
+        -------
+        np.ndarray
+            The normalized distance matrix
+        """
+        if key is None:
+            key = shape_key(point_set)
+        if key not in self._distance_matrices:
+            self._distance_matrices[key] = normalized_distance_matrix(np.asarray(point_set, dtype=float))
+        return self._distance_matrices[key]
+
+    def compare(self, point_sets, keys=None):
+        """Compares many point sets against all the reference shapes
+
+        Parameters
+        ----------
+        point_sets : List[np.ndarray]
+            The query point sets
+        keys : List[str], optional
+            Cache keys of the point sets
+
+        Returns
+        -------
+        Tuple[np.ndarray,np.ndarray]
+            The scores and their standard deviations (n_point_sets,n_references)
+        """
+        if keys is None:
+            keys = [None] * len(point_sets)
+        matrices = [self.distance_matrix(point_set, key=key) for point_set, key in zip(point_sets, keys)]
+
+        task = partial(_compare_task, **self.gw_kwargs)
+        if self.n_cores == 1 or len(matrices) <= 1:
+            _init_worker(self.reference_matrices)
+            results = [task(C) for C in matrices]
+        else:
+            with Pool(self.n_cores, initializer=_init_worker, initargs=(self.reference_matrices,)) as p:
+                results = p.map(task, matrices, chunksize=max(1, len(matrices) // (4 * self.n_cores)))
+
+        scores = np.array([result[0] for result in results]).reshape(len(matrices), -1)
+        stds = np.array([result[1] for result in results]).reshape(len(matrices), -1)
+        return scores, stds
+
+    def shape_measures(self, point_sets, keys=None):
+        """Shape measures against the references, as in PolyFeaturizer.get_shape_measures
+
+        Returns
+        -------
+        Tuple[np.ndarray,np.ndarray,np.ndarray]
+            The scores, the normalized inverse scores and the softmax of the inverse scores
+        """
+        scores, _ = self.compare(point_sets, keys=keys)
+        with np.errstate(divide='ignore'):
+            scores_inv = 1 / scores
+        scores_inv[np.isinf(scores_inv)] = 10000
+        scores_norm = scores_inv / scores_inv.sum(axis=1, keepdims=True)
+        exp_scores = np.exp(scores_inv - scores_inv.max(axis=1, keepdims=True))
+        scores_softmax = exp_scores / exp_scores.sum(axis=1, keepdims=True)
+        return scores, scores_norm, scores_softmax
@@ -0,0 +1,171 @@
+import numpy as np
+import spglib
+
+from matgraphdb.utils.periodic_table import atomic_symbols
+
+SYMPREC=0.01
+ANGLE_TOLERANCE=5.0
+
+ATOMIC_NUMBERS={symbol:Z for Z, symbol in enumerate(atomic_symbols) if symbol}
+
+
+def _dataset_value(dataset, key):
+    # spglib<2.5 returns a dict, newer versions return a SpglibDataset
+    if isinstance(dataset, dict):
+        return dataset[key]
+    return getattr(dataset, key)
+
+
+def spglib_cell_from_dict(structure_dict):
+    """
+    Builds the spglib cell directly from a pymatgen structure dictionary
+    without constructing the pymatgen object.
+
+    Args:
+        structure_dict (dict): A pymatgen Structure.as_dict() dictionary.
+
+    Returns:
+        tuple: (lattice, positions, numbers) as numpy arrays.
+    """
+    lattice = np.array(structure_dict['lattice']['matrix'], dtype=float)
+    positions = np.array([site['abc'] for site in structure_dict['sites']], dtype=float)
+    numbers = np.array([ATOMIC_NUMBERS[site['species'][0]['element']] for site in structure_dict['sites']], dtype=int)
+    return lattice, positions, numbers
+
+
+def get_symmetry_info(lattice, positions, numbers, symprec=SYMPREC, angle_tolerance=ANGLE_TOLERANCE):
+    """
+    Runs spglib once on the raw arrays and returns everything downstream
+    consumers need in a jsonable dictionary.
+
+    Args:
+        lattice (np.ndarray): Lattice vectors, one per row (3,3).
+        positions (np.ndarray): Fractional coordinates (n_sites,3).
+        numbers (np.ndarray): Atomic numbers (n_sites).
+        symprec (float): Distance tolerance.
+        angle_tolerance (float): Angle tolerance in degrees.
+
+    Returns:
+        dict: space group, wyckoffs, site symmetries, equivalent atoms,
+            primitive mapping, the symmetry operations and the analysed cell.
+    """
+    cell = (np.asarray(lattice, dtype=float), np.asarray(positions, dtype=float), np.asarray(numbers, dtype=int))
+    dataset = spglib.get_symmetry_dataset(cell, symprec=symprec, angle_tolerance=angle_tolerance)
+    if dataset is None:
+        raise ValueError(f"spglib failed to find the symmetry: {spglib.get_error_message()}")
+
+    symmetry = {
+        'spg_number': int(_dataset_value(dataset, 'number')),
+        'spg_symbol': str(_dataset_value(dataset, 'international')),
+        'hall_symbol': str(_dataset_value(dataset, 'hall')),
+        'wyckoffs': list(_dataset_value(dataset, 'wyckoffs')),
+        'site_symmetry_symbols': list(_dataset_value(dataset, 'site_symmetry_symbols')),
+        'equivalent_atoms': np.asarray(_dataset_value(dataset, 'equivalent_atoms')).tolist(),
+        'crystallographic_orbits': np.asarray(_dataset_value(dataset, 'crystallographic_orbits')).tolist(),
+        'mapping_to_primitive': np.asarray(_dataset_value(dataset, 'mapping_to_primitive')).tolist(),
+        'rotations': np.asarray(_dataset_value(dataset, 'rotations')).tolist(),
+        'translations': np.asarray(_dataset_value(dataset, 'translations')).tolist(),
+        'symprec': symprec,
+        'angle_tolerance': angle_tolerance,
+        # The analysed cell, so the per site values can be matched to other site orders
+        'lattice': cell[0].tolist(),
+        'positions': cell[1].tolist(),
+        'numbers': cell[2].tolist(),
+        }
+    return symmetry
+
+
+def get_stored_symmetry(db, symprec=SYMPREC, angle_tolerance=ANGLE_TOLERANCE):
+    """
+    Returns the symmetry stored in a database entry. It is computed and stored
+    in db['symmetry'] if missing or if it was computed with other tolerances.
+
+    Args:
+        db (dict): A material entry of the json database.
+        symprec (float): Distance tolerance.
+        angle_tolerance (float): Angle tolerance in degrees.
+
+    Returns:
+        dict: The symmetry dictionary from get_symmetry_info.
+    """
+    symmetry = db.get('symmetry')
+    if symmetry is None or symmetry['symprec'] != symprec or symmetry['angle_tolerance'] != angle_tolerance:
+        symmetry = get_symmetry_info(*spglib_cell_from_dict(db['structure']),
+                                     symprec=symprec, angle_tolerance=angle_tolerance)
+        db['symmetry'] = symmetry
+    return symmetry
+
+
+def symmetry_for_cell(symmetry, lattice, positions, numbers, tol=1e-4):
+    """
+    Reorders a stored symmetry dictionary to the site order of a cell, e.g. the sorted
+    primitive cell of core.Structure, so the analysis is not rerun.
+
+    Args:
+        symmetry (dict): A dictionary from get_symmetry_info.
+        lattice (np.ndarray): Lattice vectors, one per row (3,3).
+        positions (np.ndarray): Fractional coordinates (n_sites,3).
+        numbers (np.ndarray): Atomic numbers (n_sites).
+        tol (float): Tolerance on the lattice and the fractional coordinates.
+
+    Returns:
+        dict: The symmetry with per site values in the order of positions. Site indices
+            (equivalent_atoms, crystallographic_orbits) refer to the new order. None if the
+            dictionary does not record its cell or was computed on another cell.
+    """
+    if not symmetry or 'positions' not in symmetry:
+        return None
+    lattice = np.asarray(lattice, dtype=float)
+    positions = np.asarray(positions, dtype=float)
+    numbers = np.asarray(numbers, dtype=int)
+    stored_lattice = np.asarray(symmetry['lattice'], dtype=float)
+    stored_positions = np.asarray(symmetry['positions'], dtype=float)
+    stored_numbers = np.asarray(symmetry['numbers'], dtype=int)
+    if stored_positions.shape != positions.shape or not np.allclose(stored_lattice, lattice, atol=tol):
+        return None
+
+    diff = positions[:, None, :] - stored_positions[None, :, :]
+    diff -= np.round(diff)
+    match = np.all(np.abs(diff) < tol, axis=2) & (numbers[:, None] == stored_numbers[None, :])
+    if not np.all(match.sum(axis=1) == 1):
+        return None
+    # stored index of every site, and new index of every stored site
+    order = np.argmax(match, axis=1)
+    if len(np.unique(order)) != len(order):
+        return None
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(len(order))
+
+    reordered = dict(symmetry)
+    for key in ['wyckoffs', 'site_symmetry_symbols', 'mapping_to_primitive']:
+        reordered[key] = [symmetry[key][i] for i in order]
+    for key in ['equivalent_atoms', 'crystallographic_orbits']:
+        reordered[key] = [int(inverse[symmetry[key][i]]) for i in order]
+    reordered['lattice'] = lattice.tolist()
+    reordered['positions'] = positions.tolist()
+    reordered['numbers'] = numbers.tolist()
+    return reordered
+
+
+def wyckoff_positions(wyckoffs, numbers):
+    """
+    Combines wyckoff letters with their multiplicity per species, e.g. '4a'.
+
+    Args:
+        wyckoffs (list): Wyckoff letters per site.
+        numbers (list): Atomic numbers per site.
+
+    Returns:
+        list: Wyckoff positions per site.
+    """
+    wyckoffs = np.array(wyckoffs)
+    numbers = np.array(numbers)
+    positions = ['']*len(wyckoffs)
+    for iwyckoff in np.unique(wyckoffs):
+        idx = np.where(wyckoffs == iwyckoff)[0]
+        for ispc in np.unique(numbers[idx]):
+            idx2 = idx[numbers[idx] == ispc]
+            multiplicity = len(idx2)
+            for i in idx2:
+                positions[i] = str(multiplicity) + iwyckoff
+    return positions
@@ -0,0 +1,12 @@
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# matgraphdb.utils reads private_config.yml on import, so nothing can be collected without it
+if not os.path.exists(os.path.join(ROOT, 'private_config.yml')):
+    collect_ignore_glob = ['test_*.py']
+
+
+def pytest_report_header(config):
+    if not os.path.exists(os.path.join(ROOT, 'private_config.yml')):
+        return "private_config.yml not found, the matgraphdb tests are not collected"
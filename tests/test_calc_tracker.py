@@ -0,0 +1,129 @@
+import os
+
+import pytest
+
+from matgraphdb.database.json.dft_calc.calc_tracker import BOND_ORDER_FILE, CalcTracker
+from matgraphdb.database.json.dft_calc.remove_wavecar import IDLE_STAGES, remove_wavecar
+
+
+def _make_calc(calc_path, mpid, files=(), subdir='chargemol'):
+    calc_dir = os.path.join(calc_path, mpid, subdir)
+    os.makedirs(calc_dir, exist_ok=True)
+    for name in files:
+        with open(os.path.join(calc_dir, name), 'w') as f:
+            f.write(name)
+    return calc_dir
+
+
+def _add_file(calc_dir, name):
+    # Bumps the directory mtime explicitly, the filesystem clock may not tick between writes
+    mtime_ns = os.stat(calc_dir).st_mtime_ns
+    with open(os.path.join(calc_dir, name), 'w') as f:
+        f.write(name)
+    os.utime(calc_dir, ns=(mtime_ns + 10**9, mtime_ns + 10**9))
+
+
+@pytest.fixture
+def calc_path(tmp_path):
+    calc_path = tmp_path / 'MaterialsData'
+    calc_path.mkdir()
+    return str(calc_path)
+
+
+def _tracker(calc_path, subdir='chargemol'):
+    return CalcTracker(calc_path=calc_path, subdir=subdir, db_file=os.path.join(os.path.dirname(calc_path), f'{subdir}.sqlite'))
+
+
+def test_reconcile_infers_stages_from_the_files(calc_path):
+    _make_calc(calc_path, 'mp-1')
+    _make_calc(calc_path, 'mp-2', files=['OUTCAR'])
+    _make_calc(calc_path, 'mp-3', files=['OUTCAR', BOND_ORDER_FILE])
+    # Not a calc dir, and a calc dir without the subdir
+    os.makedirs(os.path.join(calc_path, 'logs'))
+    os.makedirs(os.path.join(calc_path, 'mp-4'))
+    tracker = _tracker(calc_path)
+
+    assert tracker.reconcile() == 3
+    counts = tracker.counts()
+    assert (counts['staged'], counts['failed'], counts['done']) == (1, 1, 1)
+    assert tracker.relaunch_list() == [os.path.join(calc_path, 'mp-1', 'chargemol'),
+                                       os.path.join(calc_path, 'mp-2', 'chargemol')]
+
+
+def test_reconcile_only_lists_changed_directories(calc_path):
+    calc_dirs = [_make_calc(calc_path, f'mp-{i}') for i in range(5)]
+    tracker = _tracker(calc_path)
+    assert tracker.reconcile() == 5
+    assert tracker.reconcile() == 0
+
+    _add_file(calc_dirs[2], BOND_ORDER_FILE)
+    assert tracker.reconcile() == 1
+    assert tracker.calc_dirs(stages=['done']) == [calc_dirs[2]]
+
+
+def test_reconcile_follows_submitted_calculations(calc_path):
+    calc_dirs = [_make_calc(calc_path, f'mp-{i}') for i in range(3)]
+    tracker = _tracker(calc_path)
+    tracker.reconcile()
+    tracker.set_stage(calc_dirs[:2], 'submitted', job_id='101')
+    tracker.set_stage(calc_dirs[2:], 'submitted', job_id='102')
+
+    _add_file(calc_dirs[0], 'OSZICAR')
+    tracker.reconcile(active_job_ids={'101', '102'})
+    assert tracker.calc_dirs(stages=['running']) == [calc_dirs[0]]
+    assert tracker.counts()['submitted'] == 2
+
+    # Job 102 left the queue without writing bond orders
+    tracker.reconcile(active_job_ids={'101'})
+    assert tracker.calc_dirs(stages=['failed']) == [calc_dirs[2]]
+
+    _add_file(calc_dirs[0], BOND_ORDER_FILE)
+    tracker.reconcile(active_job_ids={'101'})
+    assert tracker.calc_dirs(stages=['done']) == [calc_dirs[0]]
+    assert tracker.calc_dirs(stages=['submitted']) == [calc_dirs[1]]
+
+
+def test_reconcile_without_active_jobs_fails_every_submitted_calculation(calc_path):
+    calc_dirs = [_make_calc(calc_path, f'mp-{i}') for i in range(2)]
+    calc_dirs.append(_make_calc(calc_path, 'mp-2', files=[BOND_ORDER_FILE]))
+    tracker = _tracker(calc_path)
+    tracker.set_stage(calc_dirs, 'submitted', job_id='101')
+    tracker.set_stage(calc_dirs[2:], 'parsed')
+
+    tracker.reconcile(active_job_ids=set())
+    counts = tracker.counts()
+    assert (counts['failed'], counts['parsed'], counts['submitted']) == (2, 1, 0)
+
+
+def test_set_stage_rejects_unknown_stages(calc_path):
+    with pytest.raises(ValueError):
+        _tracker(calc_path).set_stage(['mp-1'], 'finished')
+
+
+def test_remove_wavecars_only_touches_the_given_stages(calc_path):
+    done = _make_calc(calc_path, 'mp-1', files=['WAVECAR', BOND_ORDER_FILE])
+    failed = _make_calc(calc_path, 'mp-2', files=['WAVECAR', 'OUTCAR'])
+    running = _make_calc(calc_path, 'mp-3', files=['WAVECAR'])
+    tracker = _tracker(calc_path)
+    tracker.set_stage([running], 'submitted', job_id='101')
+    tracker.reconcile()
+
+    assert tracker.remove_wavecars() == 1
+    assert not os.path.exists(os.path.join(done, 'WAVECAR'))
+    assert os.path.exists(os.path.join(failed, 'WAVECAR'))
+    assert os.path.exists(os.path.join(running, 'WAVECAR'))
+    # The removal is recorded, the next reconcile does not list the directory again
+    assert tracker.reconcile() == 0
+
+    assert tracker.remove_wavecars(stages=['failed']) == 1
+    assert tracker.remove_wavecars(stages=['failed']) == 0
+    assert os.path.exists(os.path.join(running, 'WAVECAR'))
+
+
+def test_remove_wavecar_cleans_the_legacy_static_dirs(calc_path):
+    static_dirs = [_make_calc(calc_path, f'mp-{i}', files=['WAVECAR', 'OUTCAR'], subdir='static') for i in range(3)]
+    chargemol_dir = _make_calc(calc_path, 'mp-0', files=['WAVECAR', BOND_ORDER_FILE])
+
+    assert remove_wavecar(calc_path=calc_path, subdir='static', stages=IDLE_STAGES) == 3
+    assert not any(os.path.exists(os.path.join(static_dir, 'WAVECAR')) for static_dir in static_dirs)
+    assert os.path.exists(os.path.join(chargemol_dir, 'WAVECAR'))
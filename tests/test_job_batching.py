@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+import pytest
+
+from matgraphdb.database.json.dft_calc.calc_tracker import CalcTracker
+from matgraphdb.database.json.dft_calc.job_batching import (BOND_ORDER_FILE, LocalExecutor, array_script,
+                                                            estimate_cost_task, load_manifest, pack_batches,
+                                                            pack_batches_by_budget, parse_time_limit,
+                                                            submit_job_arrays, write_job_arrays)
+
+# Stand-in for vasp and chargemol, records the run and writes the bond orders
+COMMANDS = ['echo "$NUM_CORES" > ran.txt', f'touch {BOND_ORDER_FILE}']
+SETUP_COMMANDS = ['export NUM_CORES=$((SLURM_JOB_NUM_NODES * SLURM_CPUS_ON_NODE))']
+PARTITION_INFO = ('debug', '1:00:00', '2', '1')
+
+
+def _make_calc_dir(calc_path, mpid, nsites, kpoints=(2, 2, 2)):
+    calc_dir = os.path.join(calc_path, mpid, 'chargemol')
+    os.makedirs(calc_dir)
+    with open(os.path.join(calc_dir, 'POSCAR'), 'w') as f:
+        f.write(f"{mpid}\n1.0\n4 0 0\n0 4 0\n0 0 4\nSi\n{nsites}\nDirect\n"
+                + "0 0 0\n"*nsites)
+    with open(os.path.join(calc_dir, 'KPOINTS'), 'w') as f:
+        f.write(f"Automatic\n0\nGamma\n{' '.join(str(k) for k in kpoints)}\n")
+    return calc_dir
+
+
+def test_pack_batches_is_balanced():
+    costs = np.random.default_rng(0).uniform(1, 100, size=200).tolist()
+    batches = pack_batches(costs, 7)
+
+    assert sorted(i for batch in batches for i in batch) == list(range(len(costs)))
+    totals = [sum(costs[i] for i in batch) for batch in batches]
+    # Longest processing time first is within the largest item of the balanced total
+    assert max(totals) - min(totals) <= max(costs)
+
+
+def test_pack_batches_by_budget_keeps_batches_within_budget():
+    costs = [10, 9, 8, 1, 1, 1, 50]
+    batches = pack_batches_by_budget(costs, 12)
+
+    assert batches == [[6], [0], [1, 4], [2, 3, 5]]
+    assert all(sum(costs[i] for i in batch) <= 12 for batch in batches if len(batch) > 1)
+
+
+@pytest.mark.parametrize('time_limit, seconds', [('90', 5400), ('1:30', 90), ('24:00:00', 86400),
+                                                 ('1-12', 129600), ('1-12:30', 131400), ('2-00:00:10', 172810)])
+def test_parse_time_limit(time_limit, seconds):
+    assert parse_time_limit(time_limit) == seconds
+
+
+def test_estimate_cost_task(tmp_path):
+    calc_dir = _make_calc_dir(str(tmp_path), 'mp-1', nsites=3, kpoints=(2, 3, 4))
+    assert estimate_cost_task(calc_dir) == 24*3**2
+    assert estimate_cost_task(str(tmp_path / 'mp-2' / 'chargemol')) is None
+
+
+def test_array_script_runs_its_batch_and_skips_finished_calcs(tmp_path):
+    script = array_script(str(tmp_path), first_task=4, n_tasks=3, partition_info=PARTITION_INFO, max_concurrent=2,
+                          setup_commands=SETUP_COMMANDS, commands=COMMANDS)
+
+    assert '#SBATCH --array=0-2%2' in script
+    assert '#SBATCH -t 1:00:00' in script
+    assert 'TASK_ID=$((SLURM_ARRAY_TASK_ID + 4))' in script
+    assert f'if [ -f "$CALC_DIR/{BOND_ORDER_FILE}" ]; then' in script
+    assert all('    ' + command in script.splitlines() for command in COMMANDS)
+
+
+def test_job_arrays_run_every_calc_once(tmp_path):
+    calc_path = str(tmp_path / 'MaterialsData')
+    calc_dirs = [_make_calc_dir(calc_path, f'mp-{i}', nsites=1 + i % 4) for i in range(12)]
+    # Finished before the arrays run, must not be run again
+    open(os.path.join(calc_dirs[0], BOND_ORDER_FILE), 'w').close()
+    tracker = CalcTracker(calc_path=calc_path, db_file=str(tmp_path / 'calc_state.sqlite'))
+
+    # Costs of 8 to 128 units (8 k-points, 1 to 4 sites), batches of at most 300 estimated seconds
+    manifest = write_job_arrays(calc_dirs, name='test', batch_root=str(tmp_path / 'batches'), seconds_per_cost=1,
+                                time_fill=300/3600, max_array_size=2, partition_info=PARTITION_INFO,
+                                setup_commands=SETUP_COMMANDS, commands=COMMANDS, max_workers=4)
+
+    batched = [calc_dir for batch in manifest['batches'] for calc_dir in batch['calc_dirs']]
+    assert sorted(batched) == sorted(calc_dirs)
+    assert all(batch['estimated_seconds'] <= 300 + 1e-6 for batch in manifest['batches'])
+    assert len(manifest['arrays']) == (len(manifest['batches']) + 1)//2
+
+    executor = LocalExecutor(max_workers=2, cpus_per_task=2)
+    job_ids = submit_job_arrays(manifest['batch_dir'], executor=executor, tracker=tracker)
+
+    assert len(job_ids) == len(manifest['arrays'])
+    assert all(returncode == 0 for returncodes in executor.returncodes.values() for returncode in returncodes)
+    assert not os.path.exists(os.path.join(calc_dirs[0], 'ran.txt'))
+    for calc_dir in calc_dirs[1:]:
+        with open(os.path.join(calc_dir, 'ran.txt')) as f:
+            assert f.read().strip() == '2'
+        assert os.path.exists(os.path.join(calc_dir, BOND_ORDER_FILE))
+    assert tracker.counts()['submitted'] == len(calc_dirs)
+
+    # Every array has a job id, nothing is submitted twice
+    assert all(array['job_id'] in job_ids for array in load_manifest(manifest['batch_dir'])['arrays'])
+    assert submit_job_arrays(manifest['batch_dir'], executor=executor) == []
+    assert len(executor.returncodes) == len(job_ids)
+
+    tracker.reconcile()
+    assert tracker.counts()['done'] == len(calc_dirs)
@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('openai')
+pytest.importorskip('tiktoken')
+pytest.importorskip('pymatgen')
+
+from matgraphdb.database.encoding_store import EncodingStore
+from matgraphdb.database.json.mat_calc.openai_embedding import (LocalEmbeddingBackend, batch_inputs,
+                                                                load_checkpoints, run_embedding_job,
+                                                                save_checkpoint)
+from matgraphdb.database.neo4j.similarity_chat import local_embedding
+
+MODEL = 'test-model'
+
+
+class CountingBackend(LocalEmbeddingBackend):
+    """Local backend recording every text it embeds, failing for the texts in fail."""
+    def __init__(self, fail=()):
+        super().__init__()
+        self.fail = set(fail)
+        self.embedded = []
+
+    async def embed(self, texts, model):
+        if self.fail.intersection(texts):
+            raise RuntimeError("request rejected")
+        self.embedded.extend(texts)
+        return await super().embed(texts, model)
+
+
+def _inputs(n=10):
+    ids = [f'mp-{i}' for i in range(n)]
+    texts = [f'material {i} is a stable oxide' for i in range(n)]
+    return ids, texts, [6]*n
+
+
+def test_batch_inputs_respects_both_limits():
+    batches = batch_inputs([5, 5, 5, 20, 1, 1, 1], max_inputs=3, max_tokens=12)
+    assert batches == [[0, 1], [2], [3], [4, 5, 6]]
+
+
+def test_run_embedding_job_saves_a_store(tmp_path):
+    ids, texts, token_counts = _inputs()
+    encodings = run_embedding_job(ids, texts, token_counts, model=MODEL, backend=LocalEmbeddingBackend(),
+                                  output_dir=str(tmp_path), max_inputs_per_request=3)
+
+    expected = np.array([local_embedding(text, model=MODEL) for text in texts], dtype=np.float32)
+    np.testing.assert_allclose(encodings, expected, rtol=1e-6)
+    store = EncodingStore.load(str(tmp_path))
+    assert store.material_ids == ids
+    np.testing.assert_allclose(store.align(ids), expected, rtol=1e-6)
+    assert not os.path.exists(tmp_path / 'checkpoints')
+
+
+def test_run_embedding_job_resumes_after_a_partial_write(tmp_path):
+    ids, texts, token_counts = _inputs()
+    checkpoint_dir = tmp_path / 'checkpoints'
+    checkpoint_dir.mkdir()
+    save_checkpoint(str(checkpoint_dir), ids[:4], [local_embedding(text, model=MODEL) for text in texts[:4]])
+    # A crash while writing the next checkpoint leaves a partial temporary file
+    (checkpoint_dir / f'{ids[4]}_3.npz.tmp').write_bytes(b'PK\x03\x04 truncated')
+    assert set(load_checkpoints(str(checkpoint_dir))) == set(ids[:4])
+
+    backend = CountingBackend()
+    encodings = run_embedding_job(ids, texts, token_counts, model=MODEL, backend=backend,
+                                  output_dir=str(tmp_path), max_inputs_per_request=3)
+
+    assert sorted(backend.embedded) == sorted(texts[4:])
+    assert encodings.shape == (len(ids), len(local_embedding('x')))
+    assert not os.path.exists(checkpoint_dir)
+
+
+def test_run_embedding_job_reruns_only_failed_requests(tmp_path):
+    ids, texts, token_counts = _inputs()
+    failing = CountingBackend(fail=[texts[7]])
+    assert run_embedding_job(ids, texts, token_counts, model=MODEL, backend=failing, output_dir=str(tmp_path),
+                             max_inputs_per_request=3, max_retries=1) is None
+    assert os.path.exists(tmp_path / 'checkpoints')
+
+    backend = CountingBackend()
+    encodings = run_embedding_job(ids, texts, token_counts, model=MODEL, backend=backend, output_dir=str(tmp_path),
+                                  max_inputs_per_request=3)
+    assert sorted(backend.embedded) == sorted(texts[6:9])
+    assert encodings is not None and len(encodings) == len(ids)
@@ -0,0 +1,135 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('monty')
+
+from matgraphdb.database.download.parallel_download import (RecordedClient, RecordingClient, clear_stale,
+                                                            download_materials, get_stale_files, load_downloaded,
+                                                            load_manifest, sync_materials)
+
+FIELDS = ['material_id', 'nsites', 'formula_pretty']
+CRITERIA = {'nelements': 2}
+
+
+class FakeClient:
+    """In-memory Materials Project, failing the summary requests of the pages starting at an id in fail."""
+    def __init__(self, n_materials=10, fail=()):
+        self.docs = {f'mp-{i}': {'material_id': f'mp-{i}', 'nsites': i + 1, 'formula_pretty': f'A{i + 1}B',
+                                 'last_updated': '2024-01-01', 'dimensionality': 3 if i % 2 else 2}
+                     for i in range(n_materials)}
+        self.fail = set(fail)
+        self.requested = []
+
+    def search_ids(self, criteria):
+        return sorted(self.docs)
+
+    def search_updates(self, criteria):
+        return [{'material_id': material_id, 'last_updated': doc['last_updated']} for material_id, doc in self.docs.items()]
+
+    def search_summary(self, material_ids, fields):
+        if material_ids[0] in self.fail:
+            raise RuntimeError("server error")
+        self.requested.extend(material_ids)
+        return [{field: self.docs[material_id][field] for field in fields} for material_id in material_ids]
+
+    def search_robocrys(self, material_ids):
+        return [{'material_id': material_id, 'dimensionality': self.docs[material_id]['dimensionality']}
+                for material_id in material_ids]
+
+
+def _read(output_dir, material_id):
+    with open(os.path.join(output_dir, f'{material_id}.json')) as f:
+        return json.load(f)
+
+
+def test_download_materials_writes_every_document(tmp_path):
+    client = FakeClient()
+    manifest = download_materials(str(tmp_path), CRITERIA, fields=FIELDS, client=client, page_size=3, max_workers=2)
+
+    assert sorted(manifest['downloaded']) == sorted(client.docs)
+    assert _read(tmp_path, 'mp-4') == {'material_id': 'mp-4', 'nsites': 5, 'formula_pretty': 'A5B'}
+    # The manifest is written once, the finished pages are appended to downloaded.txt
+    assert 'downloaded' not in load_manifest(str(tmp_path))
+    assert load_downloaded(str(tmp_path)) == set(client.docs)
+
+
+def test_download_materials_resumes_the_missing_pages(tmp_path):
+    failing = FakeClient(fail=['mp-3'])
+    manifest = download_materials(str(tmp_path), CRITERIA, fields=FIELDS, client=failing, page_size=3, max_workers=2)
+    assert set(manifest['downloaded']) == set(failing.docs) - {'mp-3', 'mp-4', 'mp-5'}
+
+    # An interrupted append leaves a line without its newline, which is ignored
+    with open(tmp_path / 'downloaded.txt', 'a') as f:
+        f.write('mp-')
+
+    client = FakeClient()
+    manifest = download_materials(str(tmp_path), CRITERIA, fields=FIELDS, client=client, page_size=3, max_workers=2)
+    assert client.requested == ['mp-3', 'mp-4', 'mp-5']
+    assert sorted(manifest['downloaded']) == sorted(client.docs)
+    assert load_downloaded(str(tmp_path)) == set(client.docs)
+
+
+def test_download_materials_screens_dimensionality(tmp_path):
+    client = FakeClient()
+    manifest = download_materials(str(tmp_path), CRITERIA, fields=FIELDS, client=client, dimensionality=3, page_size=3)
+    expected = sorted(material_id for material_id, doc in client.docs.items() if doc['dimensionality'] == 3)
+    assert manifest['material_ids'] == expected
+    assert sorted(name[:-5] for name in os.listdir(tmp_path) if name.startswith('mp-')) == expected
+
+
+def test_recorded_client_replays_a_download_offline(tmp_path):
+    recording_dir = str(tmp_path / 'recording')
+    online = RecordingClient(FakeClient(), recording_dir)
+    download_materials(str(tmp_path / 'online'), CRITERIA, fields=FIELDS, client=online, page_size=4)
+
+    offline = RecordedClient(recording_dir)
+    manifest = download_materials(str(tmp_path / 'offline'), CRITERIA, fields=FIELDS, client=offline, page_size=4)
+
+    for material_id in manifest['material_ids']:
+        assert _read(tmp_path / 'offline', material_id) == _read(tmp_path / 'online', material_id)
+    with pytest.raises(KeyError):
+        offline.search_ids({'nelements': 3})
+
+
+def test_sync_materials_marks_only_changed_materials_stale(tmp_path):
+    client = FakeClient()
+    sync_materials(str(tmp_path), CRITERIA, fields=FIELDS, client=client, page_size=3)
+    assert len(get_stale_files(str(tmp_path))) == len(client.docs)
+    clear_stale(str(tmp_path))
+
+    # mp-2 changed upstream, mp-5 was only re-stamped, mp-10 is new and mp-9 no longer matches
+    client.docs['mp-2'].update(nsites=30, last_updated='2024-02-01')
+    client.docs['mp-5'].update(last_updated='2024-02-01')
+    client.docs['mp-10'] = dict(client.docs['mp-9'], material_id='mp-10')
+    del client.docs['mp-9']
+    # The mat_calc tasks add keys to the files, a rewrite drops them
+    entry = dict(_read(tmp_path, 'mp-2'), chargemol_bonding_orders=[[1.0]])
+    with open(tmp_path / 'mp-2.json', 'w') as f:
+        json.dump(entry, f)
+    client.requested = []
+
+    manifest = sync_materials(str(tmp_path), CRITERIA, fields=FIELDS, client=client, page_size=3)
+
+    assert sorted(client.requested) == ['mp-10', 'mp-2', 'mp-5']
+    assert get_stale_files(str(tmp_path)) == [os.path.join(str(tmp_path), 'mp-10.json'),
+                                              os.path.join(str(tmp_path), 'mp-2.json')]
+    assert _read(tmp_path, 'mp-2') == {'material_id': 'mp-2', 'nsites': 30, 'formula_pretty': 'A3B'}
+    assert manifest['removed'] == ['mp-9']
+    assert os.path.exists(tmp_path / 'mp-9.json')
+
+    clear_stale(str(tmp_path), ['mp-2'])
+    assert get_stale_files(str(tmp_path)) == [os.path.join(str(tmp_path), 'mp-10.json')]
+
+
+def test_sync_materials_adopts_a_downloaded_database(tmp_path):
+    client = FakeClient()
+    download_materials(str(tmp_path), CRITERIA, fields=FIELDS, client=client, page_size=3)
+    client.requested = []
+
+    sync_materials(str(tmp_path), CRITERIA, fields=FIELDS, client=client, page_size=3)
+
+    # Files hashed from disk are only refetched to record their stamp, none is rewritten
+    assert sorted(client.requested) == sorted(client.docs)
+    assert get_stale_files(str(tmp_path)) == []
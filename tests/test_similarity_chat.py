@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('openai')
+pytest.importorskip('tiktoken')
+
+from matgraphdb.database.neo4j import similarity_chat
+from matgraphdb.database.neo4j.similarity_chat import get_cached_embedding, local_embedding, prompt_key
+
+
+def test_local_embedding_is_deterministic_and_unit_norm():
+    embedding = local_embedding("Which materials have a band gap above 2 eV?")
+    assert embedding == local_embedding("Which materials have a band gap above 2 eV?")
+    assert len(embedding) == similarity_chat.LOCAL_EMBEDDING_DIM
+    assert np.linalg.norm(embedding) == pytest.approx(1.0, abs=1e-6)
+
+
+def test_local_embedding_prompts_sharing_words_are_closer():
+    query = np.array(local_embedding("stable oxides with a large band gap"))
+    close = np.array(local_embedding("oxides with a large band gap"))
+    far = np.array(local_embedding("magnetic ordering of iron compounds"))
+    assert query @ close > query @ far
+
+
+def test_cached_embedding_calls_the_backend_once(tmp_path, monkeypatch):
+    calls = []
+
+    def counting_embedding(text, model=similarity_chat.MODEL):
+        calls.append(text)
+        return local_embedding(text, model=model)
+
+    monkeypatch.setattr(similarity_chat, 'local_embedding', counting_embedding)
+
+    first = get_cached_embedding("Stable  oxides", backend='local', cache_dir=str(tmp_path))
+    # Same prompt up to case and whitespace, served from the disk cache
+    second = get_cached_embedding("stable oxides", backend='local', cache_dir=str(tmp_path))
+
+    assert len(calls) == 1
+    np.testing.assert_allclose(first, second, rtol=1e-6)
+    cache_file = os.path.join(tmp_path, 'local', similarity_chat.MODEL, prompt_key("stable oxides") + '.npy')
+    assert os.path.exists(cache_file)
+    assert not [name for name in os.listdir(os.path.dirname(cache_file)) if '.tmp' in name]
+
+
+def test_cached_embedding_without_cache_dir_writes_nothing(tmp_path):
+    embedding = get_cached_embedding("stable oxides", backend='local', cache_dir=None)
+    assert embedding == local_embedding("stable oxides")
+    assert os.listdir(tmp_path) == []
+
+
+def test_cached_embedding_rejects_unknown_backends(tmp_path):
+    with pytest.raises(ValueError):
+        get_cached_embedding("stable oxides", backend='unknown', cache_dir=str(tmp_path))